@@ -68,10 +68,14 @@ class ChromaDBManager:
             if metadata:
                 doc_metadata.update(metadata)
             
-            # Generate document ID
-            doc_id = f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            # Generate document ID; a result_key makes equivalent results in a session share one entry
+            if doc_metadata.get("result_key"):
+                doc_id = f"{session_id}_{doc_metadata['result_key']}"
+            else:
+                doc_id = f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             
-            # Store in mock storage
+            # Store in mock storage, replacing an entry with the same ID like an upsert
+            self.mock_storage = [doc for doc in self.mock_storage if doc["id"] != doc_id]
             self.mock_storage.append({
                 "id": doc_id,
                 "content": document_content,
@@ -85,6 +89,14 @@ class ChromaDBManager:
             print(f"[MOCK] Error storing response: {str(e)}")
             return None
     
+    def store_text(self, text: str, metadata: Dict, doc_id: str) -> str:
+        """
+        Mock store a document as given, replacing any document with the same ID
+        """
+        self.mock_storage = [doc for doc in self.mock_storage if doc["id"] != doc_id]
+        self.mock_storage.append({"id": doc_id, "content": text, "metadata": metadata})
+        return doc_id
+    
     def _format_document_content(self, user_query: str, llm_response: Dict) -> str:
         """Format document content for storage"""
         content_parts = [f"User Query: {user_query}"]
@@ -105,18 +117,23 @@ class ChromaDBManager:
         """
         Mock search for similar responses
         """
-        print(f"[MOCK] Searching for: '{query}' (returning stored items)")
+        print(f"[MOCK] Searching for: '{query}' (word overlap scoring)")
         
-        # Simple text matching for mock
+        # Word overlap (Jaccard) stands in for embedding similarity
+        query_words = set(query.lower().split())
         results = []
-        for item in self.mock_storage[-k:]:  # Return last k items
+        for item in self.mock_storage:
+            content_words = set(item["content"].lower().split())
+            overlap = len(query_words & content_words) / len(query_words | content_words) if query_words else 0.0
             results.append({
                 "content": item["content"],
                 "metadata": item["metadata"],
-                "similarity_score": 0.8  # Mock score
+                "similarity_score": 2 * (1 - overlap),
+                "cosine_similarity": overlap
             })
         
-        return results
+        results.sort(key=lambda item: item["cosine_similarity"], reverse=True)
+        return results[:k]
     
     def get_session_history(self, session_id: str) -> List[Dict]:
         """
@@ -1,19 +1,29 @@
 import os
 import time
+import asyncio
 import uuid
-import re
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from langchain_openai import ChatOpenAI
 import json
 
 # Import custom modules
-from schema_parser import parse_pcdc_schema, extract_relevant_schema, standardize_terms
+from schema_parser import extract_relevant_schema, standardize_terms
+from schema_registry import SCHEMA_FILE, SchemaRegistry, SchemaWatcher, is_allowed_schema_file
 from query_builder import build_graphql_filter, extract_query_conditions, build_graphql_query, analyze_query_complexity, decompose_query, combine_results
-from context_manager import session_manager
+from context_manager import QueryMemory, session_manager
 from prompt_builder import create_enhanced_prompt, create_nested_query_prompt
+from fast_path import try_fast_path, fast_path_stats
+from llm_backends import create_llm
+from llm_client import ClientDisconnectedError, LLMTimeoutError, ainvoke_llm_shared, cancel_on_disconnect, llm_flights, llm_latency_stats, llm_rate_limiter
+from rate_limiter import PRIORITY_API, PRIORITY_BATCH
+from filter_optimizer import optimize_result
+from filter_ast import extract_filter, filter_hash
+from response_cache import ResponseCache, response_cache_key
+from result_repair import repair_result, repair_stats
+from stream_parser import parse_result
 
 # Load environment variables
 load_dotenv()
@@ -25,158 +35,280 @@ class Query(BaseModel):
     text: str
     session_id: Optional[str] = None
 
+class BatchQuery(BaseModel):
+    texts: List[str]
+    concurrency: Optional[int] = None
+
 # Define output model
 class GraphQLResponse(BaseModel):
     query: str
     explanation: Optional[str] = None
     variables: str = "{}"
+    validation_errors: List[str] = []
+    filter_hash: Optional[str] = None
+    optimizations: List[str] = []
+    contradiction: bool = False
 
 # Create LangChain components
-llm = ChatOpenAI(
+llm = create_llm(
     model="gpt-3.5-turbo",
     temperature=0,
-    api_key=os.getenv("OPENAI_API_KEY")
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=0  # Retries go through the shared rate limiter in llm_client
 )
 
-# Load PCDC schema
-node_properties = {}
-term_mappings = {}
+# Load PCDC schema and everything derived from it (graph, enum index, term
+# matcher, search and vector indexes) as one swappable version
+schema_registry = SchemaRegistry(SCHEMA_FILE)
+print(f"Successfully loaded PCDC schema, node count: {len(schema_registry.current().node_properties)}")
 
-try:
-    node_properties, term_mappings = parse_pcdc_schema("pcdc-schema-prod-20250114.json")
-    print(f"Successfully loaded PCDC schema, node count: {len(node_properties)}")
-except Exception as e:
-    print(f"Failed to load PCDC schema: {str(e)}")
+# Drop session schema caches for nodes that changed on reload
+schema_registry.add_listener(lambda diff, old, new: session_manager.invalidate_schema_cache(diff["changed_nodes"]))
 
-# Set up route
-@app.post("/convert")
-async def convert_to_graphql(query: Query):
-    try:
-        # Get or create session
-        session_id = query.session_id if query.session_id else str(uuid.uuid4())
-        memory = session_manager.get_or_create_session(session_id)
+# Cache generated responses; a reload drops entries built from changed nodes
+response_cache = ResponseCache()
+schema_registry.add_listener(lambda diff, old, new: response_cache.invalidate(diff["changed_nodes"]))
+
+# Poll for new schema files; SCHEMA_WATCH_INTERVAL=0 disables the watcher
+schema_watcher = SchemaWatcher(schema_registry, interval=float(os.getenv("SCHEMA_WATCH_INTERVAL", "30"))).start()
+
+# Schema retrieval mode: "index" (scored keyword index) or "vector" (cosine top-k)
+SCHEMA_RETRIEVAL_MODE = os.getenv("SCHEMA_RETRIEVAL_MODE", "index")
+
+# Batch conversion limits: questions converted at once and questions per request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+async def run_conversion(text, memory, schema, save_history=True, priority=PRIORITY_API, user="anonymous"):
+    """Convert one natural-language question into a GraphQL response
+    
+    The schema version is pinned by the caller, so every question of a
+    request (or batch) is converted against the same version. priority and
+    user place the LLM call in the rate limiter's queue.
+    """
+    # Standardize user input
+    standardized_query = standardize_terms(text, schema.term_mappings, schema.term_matcher)
+    
+    # Analyze query complexity
+    complexity = analyze_query_complexity(standardized_query, schema.graph.nodes)
+    
+    # Extract relevant schema information
+    relevant_schema = extract_relevant_schema(
+        standardized_query,
+        schema.node_properties,
+        schema.enum_index,
+        mode=SCHEMA_RETRIEVAL_MODE,
+        vector_index=schema.vector_index,
+        search_index=schema.search_index
+    )
+    detected_values = schema.enum_index.group_matches(schema.enum_index.find_in_text(standardized_query))
+    
+    # Responses are cached by query, schema slice, prompt version and history
+    prior_history = memory.get_formatted_context()
+    cache_key = response_cache_key(standardized_query, relevant_schema, prior_history)
+    cache_nodes = set(relevant_schema)
+    
+    # Answer common cohort filters with the rule-based compiler, skipping the LLM;
+    # follow-up questions need the conversation, which the compiler doesn't see
+    raw_response = ""
+    result = try_fast_path(text, schema) if not prior_history else None
+    source = "fast_path"
+    if result is None:
+        result = response_cache.get(cache_key)
+        source = "cache" if result is not None else "llm"
+    
+    if result is not None:
+        memory.add_message({"role": "user", "content": text})
+        memory.add_message({"role": "assistant", "content": json.dumps(result)})
+    elif complexity == "complex":
+        # Handle complex query
+        query_parts = decompose_query(standardized_query, schema.graph)
+        cache_nodes.update(query_parts["related_nodes"])
         
-        # Standardize user input
-        standardized_query = standardize_terms(query.text, term_mappings)
+        # Create a comprehensive schema that includes all related nodes
+        comprehensive_schema = relevant_schema.copy()
         
-        # Analyze query complexity
-        complexity = analyze_query_complexity(standardized_query)
+        # Add schema information for related nodes
+        for node in query_parts["related_nodes"]:
+            node_schema = extract_relevant_schema(node, schema.node_properties, search_index=schema.search_index)
+            comprehensive_schema.update(node_schema)
         
-        # Extract relevant schema information
-        relevant_schema = extract_relevant_schema(standardized_query, node_properties)
+        # Get conversation history
+        conversation_history = memory.get_formatted_context()
         
-        result = None
+        # Create prompt with enhanced schema to generate a single nested query
+        prompt_text = create_enhanced_prompt(
+            standardized_query,
+            comprehensive_schema,
+            conversation_history,
+            nested_paths=query_parts.get("nested_paths"),
+            detected_values=detected_values
+        )
         
-        if complexity == "complex":
-            # Handle complex query
-            query_parts = decompose_query(standardized_query)
-            
-            # Create a comprehensive schema that includes all related nodes
-            comprehensive_schema = relevant_schema.copy()
-            
-            # Add schema information for related nodes
-            for node in query_parts["related_nodes"]:
-                node_schema = extract_relevant_schema(node, node_properties)
-                comprehensive_schema.update(node_schema)
-            
-            # Get conversation history
-            conversation_history = memory.get_formatted_context()
-            
-            # Create prompt with enhanced schema to generate a single nested query
-            prompt_text = create_enhanced_prompt(standardized_query, comprehensive_schema, conversation_history)
-            
-            # Call LLM
-            response = llm.invoke(prompt_text)
-            
-            # Parse results
-            try:
-                result = json.loads(response.content)
-                
-                # Update session memory
-                memory.add_message({"role": "user", "content": standardized_query})
-                memory.add_message({"role": "assistant", "content": response.content})
-            except Exception as e:
-                print(f"Failed to parse complex query result: {str(e)}")
-                
-                # If parsing as JSON fails, try to extract the query and variables
-                content = response.content
-                query_match = re.search(r'```graphql\s*(.*?)\s*```', content, re.DOTALL)
-                variables_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                
-                query_str = query_match.group(1) if query_match else ""
-                variables_str = variables_match.group(1) if variables_match else "{}"
-                
-                result = {
-                    "query": query_str,
-                    "variables": variables_str,
-                    "explanation": "Query and variables extracted from response"
-                }
-                
-                print(f"Extracted content: {content}")
-        else:
-            # Handle simple query
-            conversation_history = memory.get_formatted_context()
-            
-            # Create prompt
-            prompt_text = create_enhanced_prompt(standardized_query, relevant_schema, conversation_history)
-            
-            # Call LLM
-            response = llm.invoke(prompt_text)
-            
-            # Parse results
-            try:
-                result = json.loads(response.content)
-            except Exception as json_error:
-                # If parsing as JSON fails, try to extract the query and variables
-                content = response.content
-                query_match = re.search(r'```graphql\s*(.*?)\s*```', content, re.DOTALL)
-                variables_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                
-                query_str = query_match.group(1) if query_match else ""
-                variables_str = variables_match.group(1) if variables_match else "{}"
-                
-                result = {
-                    "query": query_str,
-                    "variables": variables_str,
-                    "explanation": "Query and variables extracted from response"
-                }
-                
-                print(f"Error parsing JSON response: {str(json_error)}")
-                print(f"Extracted content: {content}")
-            
-            # Update session memory
-            memory.add_message({"role": "user", "content": query.text})
-            memory.add_message({"role": "assistant", "content": json.dumps(result)})
+        # Call LLM
+        response = await ainvoke_llm_shared(llm, prompt_text, label=standardized_query, priority=priority, user=user)
+        raw_response = response.content
+        
+        # Parse results, tolerating prose, fences and malformed JSON
+        result = parse_result(raw_response)
+        
+        # Update session memory
+        memory.add_message({"role": "user", "content": standardized_query})
+        memory.add_message({"role": "assistant", "content": raw_response})
+    else:
+        # Handle simple query
+        conversation_history = memory.get_formatted_context()
+        
+        # Create prompt
+        prompt_text = create_enhanced_prompt(standardized_query, relevant_schema, conversation_history, detected_values=detected_values)
+        
+        # Call LLM
+        response = await ainvoke_llm_shared(llm, prompt_text, label=standardized_query, priority=priority, user=user)
+        raw_response = response.content
         
+        # Parse results, tolerating prose, fences and malformed JSON
+        result = parse_result(raw_response)
+        
+        # Update session memory
+        memory.add_message({"role": "user", "content": text})
+        memory.add_message({"role": "assistant", "content": json.dumps(result)})
+    
+    # Simplify the generated filter before validating it and handing it to the backend;
+    # a contradiction is flagged in the response, not added to the cached explanation
+    optimization = optimize_result(result, schema.filter_optimizer)
+    
+    # Validate the generated query against the schema before returning it
+    validation_errors = schema.validator.validate(result.get("query", ""), result.get("variables"))
+    if validation_errors and source == "llm":
+        # Send only the broken part back to the LLM instead of regenerating
+        result, validation_errors = await repair_result(
+            result, validation_errors, schema, standardized_query,
+            lambda repair_prompt: ainvoke_llm_shared(llm, repair_prompt, label=f"repair: {standardized_query}", priority=priority, user=user),
+            raw_response
+        )
+    if validation_errors:
+        print(f"Generated query failed schema validation: {validation_errors}")
+    elif source == "llm" and result.get("query"):
+        response_cache.put(cache_key, result, cache_nodes)
+    
+    if save_history:
         # Save results to file
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         file_path = f"chat_history/{timestamp}.txt"
         print(f"Results saved to: {file_path}")
-        
+    
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
+    
         # Save query and results
         with open(file_path, "w") as f:
-            f.write(f"Query: {query.text}\n")
+            f.write(f"Query: {text}\n")
             f.write(f"Standardized Query: {standardized_query}\n")
             f.write(f"GraphQL Query: {result.get('query', '')}\n")
             f.write(f"Variables: {result.get('variables', '')}\n")
             f.write(f"Explanation: {result.get('explanation', '')}")
+            if validation_errors:
+                f.write(f"\nValidation Errors: {validation_errors}")
+    
+    
+    # Ensure variables is string type
+    variables = result.get("variables", "{}")
+    if isinstance(variables, dict):
+        variables = json.dumps(variables)
+    
+    return GraphQLResponse(
+        query=result.get("query", ""),
+        variables=variables,
+        explanation=result.get("explanation", ""),
+        validation_errors=validation_errors,
+        filter_hash=filter_hash(extract_filter(variables) or {}),
+        optimizations=optimization["rewrites"],
+        contradiction=optimization["contradiction"]
+    )
+
+# Set up route
+@app.post("/convert")
+async def convert_to_graphql(query: Query, request: Request):
+    try:
+        # Get or create session
+        session_id = query.session_id if query.session_id else str(uuid.uuid4())
+        memory = session_manager.get_or_create_session(session_id)
         
-        # Ensure variables is string type
-        variables = result.get("variables", "{}")
-        if isinstance(variables, dict):
-            variables = json.dumps(variables)
+        # Pin the schema version for this request; a reload only affects later requests
+        schema = schema_registry.current()
         
-        return GraphQLResponse(
-            query=result.get("query", ""),
-            variables=variables,
-            explanation=result.get("explanation", "")
-        )
+        # Stop generating if the client goes away before the answer is ready
+        return await cancel_on_disconnect(request, run_conversion(query.text, memory, schema, user=request_user(request)))
+    except LLMTimeoutError as e:
+        print(f"Error in convert_to_graphql: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client disconnected")
     except Exception as e:
         print(f"Error in convert_to_graphql: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def request_user(request):
+    """Who a request counts against for rate-limit fair share"""
+    return request.headers.get("x-user-id") or (request.client.host if request.client else "anonymous")
+
+def batch_dedup_key(text, schema):
+    """Key batch questions by their standardized text, ignoring case and spacing"""
+    return " ".join(standardize_terms(text, schema.term_mappings, schema.term_matcher).lower().split())
+
+@app.post("/convert/batch")
+async def convert_batch(batch: BatchQuery, request: Request):
+    """Convert many questions, streaming NDJSON lines in completion order
+    
+    Questions that standardize to the same text are converted once; every
+    line carries the question's original index, and duplicates name the
+    index of the question they were answered with. Batch LLM calls queue
+    behind interactive and single API requests.
+    """
+    if len(batch.texts) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch has {len(batch.texts)} questions, the limit is {BATCH_MAX_ITEMS}")
+    concurrency = max(1, min(batch.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    
+    # Pin one schema version for the whole batch
+    schema = schema_registry.current()
+    groups = {}
+    for index, text in enumerate(batch.texts):
+        groups.setdefault(batch_dedup_key(text, schema), []).append(index)
+    print(f"Batch of {len(batch.texts)} questions, {len(groups)} unique, concurrency {concurrency}")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    user = request_user(request)
+    
+    async def convert_group(indexes):
+        async with semaphore:
+            try:
+                # Each question gets its own memory so batch items don't share history
+                response = await run_conversion(batch.texts[indexes[0]], QueryMemory(), schema, False, PRIORITY_BATCH, user)
+                return indexes, response.model_dump(), None
+            except Exception as e:
+                print(f"Error converting batch question {indexes[0]}: {str(e)}")
+                return indexes, None, str(e)
+    
+    async def stream_results():
+        tasks = [asyncio.create_task(convert_group(indexes)) for indexes in groups.values()]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indexes, result, error = await finished
+                for index in indexes:
+                    line = {
+                        "index": index,
+                        "text": batch.texts[index],
+                        "duplicate_of": indexes[0] if index != indexes[0] else None,
+                        "result": result,
+                        "error": error
+                    }
+                    yield json.dumps(line) + "\n"
+        finally:
+            # Stop questions that haven't started if the client goes away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 # Add session management routes
 @app.post("/sessions/create")
 async def create_session():
@@ -193,6 +325,48 @@ async def delete_session(session_id: str):
 async def list_sessions():
     return {"sessions": session_manager.get_all_session_ids()}
 
+@app.get("/stats/fast-path")
+async def get_fast_path_stats():
+    return fast_path_stats.snapshot()
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    return response_cache.stats()
+
+@app.get("/stats/llm")
+async def get_llm_stats():
+    return llm_latency_stats.snapshot()
+
+@app.get("/stats/repair")
+async def get_repair_stats():
+    return repair_stats.snapshot()
+
+@app.get("/stats/rate-limit")
+async def get_rate_limit_stats():
+    return llm_rate_limiter.snapshot()
+
+@app.get("/stats/single-flight")
+async def get_single_flight_stats():
+    return llm_flights.snapshot()
+
+# Schema administration routes
+class SchemaReloadRequest(BaseModel):
+    schema_file: Optional[str] = None
+
+@app.get("/admin/schema")
+async def get_schema_version():
+    return schema_registry.current().describe()
+
+@app.post("/admin/schema/reload")
+async def reload_schema(request: SchemaReloadRequest):
+    if request.schema_file and not is_allowed_schema_file(request.schema_file):
+        raise HTTPException(status_code=400, detail=f"Unknown schema file: {request.schema_file}")
+    try:
+        return await schema_registry.reload_async(request.schema_file)
+    except Exception as e:
+        print(f"Error reloading schema: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
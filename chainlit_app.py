@@ -1,5 +1,5 @@
 import chainlit as cl
-from langchain_openai import ChatOpenAI
+import asyncio
 import os
 import json
 import uuid
@@ -9,10 +9,22 @@ from datetime import datetime  # Backup time module
 from dotenv import load_dotenv
 
 # Import custom modules
-from schema_parser import parse_pcdc_schema, extract_relevant_schema, standardize_terms
-from query_builder import analyze_query_complexity, decompose_query, combine_results
+from schema_parser import extract_relevant_schema, standardize_terms
+from schema_registry import SCHEMA_FILE, SchemaRegistry, SchemaWatcher
+from query_builder import analyze_query_complexity, decompose_query, build_sub_queries, combine_results
 from context_manager import session_manager
 from prompt_builder import create_enhanced_prompt, create_nested_query_prompt
+from fast_path import try_fast_path
+from llm_backends import create_llm
+from llm_client import ainvoke_llm_shared, astream_llm_shared
+from rate_limiter import PRIORITY_INTERACTIVE
+from filter_optimizer import optimize_result
+from filter_ast import extract_filter, filter_hash, query_result_key
+from stream_parser import StreamingResultParser, parse_result
+from result_repair import repair_result
+from response_cache import ResponseCache, response_cache_key
+from semantic_cache import SEMANTIC_CACHE_COLLECTION, SemanticCache
+from single_flight import SingleFlight
 # Smart import for ChromaDB - handles SQLite version and other issues
 from ChromaDB import ChromaDBManager
 from chromadb_history_reader import ChromaDBHistoryReader
@@ -20,30 +32,51 @@ from chromadb_history_reader import ChromaDBHistoryReader
 load_dotenv()
 
 # Create LLM instance with retry mechanism
-llm = ChatOpenAI(
+llm = create_llm(
     model="gpt-3.5-turbo",
     temperature=0,
     api_key=os.getenv("OPENAI_API_KEY"),
-    max_retries=3,  # Add retry mechanism
+    max_retries=0,  # Retries go through the shared rate limiter in llm_client
     request_timeout=60  # Increase timeout
 )
 
-# Load PCDC schema
-node_properties = {}
-term_mappings = {}
+# Load PCDC schema and everything derived from it (graph, enum index, term
+# matcher, search and vector indexes) as one swappable version
+schema_registry = SchemaRegistry(SCHEMA_FILE)
+print(f"Successfully loaded PCDC schema, node count: {len(schema_registry.current().node_properties)}")
 
-try:
-    node_properties, term_mappings = parse_pcdc_schema("pcdc-schema-prod-20250114.json")
-    print(f"Successfully loaded PCDC schema, node count: {len(node_properties)}")
-except Exception as e:
-    print(f"Failed to load PCDC schema: {str(e)}")
+# Drop session schema caches for nodes that changed on reload
+schema_registry.add_listener(lambda diff, old, new: session_manager.invalidate_schema_cache(diff["changed_nodes"]))
+
+# Cache generated responses; a reload drops entries built from changed nodes
+response_cache = ResponseCache()
+schema_registry.add_listener(lambda diff, old, new: response_cache.invalidate(diff["changed_nodes"]))
+
+# Poll for new schema files; SCHEMA_WATCH_INTERVAL=0 disables the watcher
+schema_watcher = SchemaWatcher(schema_registry, interval=float(os.getenv("SCHEMA_WATCH_INTERVAL", "30"))).start()
+
+# Schema retrieval mode: "index" (scored keyword index) or "vector" (cosine top-k)
+SCHEMA_RETRIEVAL_MODE = os.getenv("SCHEMA_RETRIEVAL_MODE", "index")
+
+# Redraws per second of a message while its answer streams in
+UI_FRAME_RATE = float(os.getenv("UI_FRAME_RATE", "10"))
+
+# Maximum number of complex-query sub-queries sent to the LLM at once
+MAX_CONCURRENT_SUB_QUERIES = int(os.getenv("MAX_CONCURRENT_SUB_QUERIES", "4"))
 
 # Global session storage (simulates database)
 session_list = {}
 
 # Initialize ChromaDB manager and history reader
-chroma_manager = ChromaDBManager()
-history_reader = ChromaDBHistoryReader()
+CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
+chroma_manager = ChromaDBManager(persist_directory=CHROMA_PERSIST_DIRECTORY)
+history_reader = ChromaDBHistoryReader(os.path.join(CHROMA_PERSIST_DIRECTORY, "chroma.sqlite3"))
+
+# Reuse stored answers to similar questions (SEMANTIC_CACHE_MODE: off, shadow, on)
+semantic_cache = SemanticCache(ChromaDBManager(persist_directory=CHROMA_PERSIST_DIRECTORY, collection_name=SEMANTIC_CACHE_COLLECTION))
+
+# Identical questions in flight at the same time share one embedding lookup
+lookup_flights = SingleFlight("Semantic lookup")
 
 # Authentication callback for Chainlit
 @cl.password_auth_callback
@@ -521,6 +554,100 @@ Your conversation history has been restored. Continue where you left off!"""
         traceback.print_exc()
         await cl.Message(content="❌ Error resuming session. Starting fresh!", author="System").send()
 
+def format_result_content(result, validation_errors=None, contradiction=False):
+    """Format a (possibly still streaming) result as the message shown to the user"""
+    response_parts = []
+    
+    # Add GraphQL query
+    if result.get('query'):
+        response_parts.append(f"**GraphQL Query:**\n```graphql\n{result.get('query', '')}\n```")
+    
+    # Add variables
+    if result.get('variables'):
+        try:
+            variables_value = result.get('variables', '')
+            if isinstance(variables_value, dict):
+                variables_value = json.dumps(variables_value, indent=2)
+            
+            response_parts.append(f"**Variables:**\n```json\n{variables_value}\n```")
+        except Exception as e:
+            print(f"Error formatting variables: {str(e)}")
+    
+    # Add explanation
+    if result.get('explanation'):
+        response_parts.append(f"**Explanation:**\n{result.get('explanation', '')}")
+    
+    if contradiction:
+        response_parts.append("**Note:** the filter conditions contradict each other, so this query returns no subjects.")
+    
+    # Flag fields, paths, operators or values the schema does not have
+    if validation_errors:
+        errors_list = "\n".join(f"- {error}" for error in validation_errors)
+        response_parts.append(f"**⚠️ Schema validation failed:**\n{errors_list}")
+    
+    return "\n\n".join(response_parts)
+
+class CoalescedMessage:
+    """Update a Chainlit message at most UI_FRAME_RATE times per second
+    
+    Streaming tokens arrive far faster than the UI can usefully redraw, so
+    only the latest content is pushed each frame; flush() sends the rest.
+    """
+    
+    def __init__(self, message, frame_rate=None):
+        self.message = message
+        self.interval = 1.0 / (frame_rate or UI_FRAME_RATE)
+        self.content = message.content
+        self.last_update = 0.0
+    
+    async def set(self, content):
+        self.content = content
+        if time.perf_counter() - self.last_update >= self.interval:
+            await self.flush()
+    
+    async def flush(self):
+        if self.content != self.message.content:
+            self.message.content = self.content
+            await self.message.update()
+        self.last_update = time.perf_counter()
+
+async def call_llm(prompt_text, on_token=None, label=None):
+    """Call the LLM without blocking other sessions
+    
+    With on_token, the response is streamed and on_token(text) is awaited
+    for every chunk. Identical prompts from other sessions share the call.
+    The call is tracked in the user session so that stopping the task or
+    closing the chat cancels it instead of waiting out the timeout. Chat
+    messages queue ahead of API and batch calls in the rate limiter.
+    """
+    user_id = cl.user_session.get("user_id") or cl.user_session.get("session_id") or "anonymous"
+    if on_token is None:
+        task = asyncio.ensure_future(ainvoke_llm_shared(llm, prompt_text, label, priority=PRIORITY_INTERACTIVE, user=user_id))
+    else:
+        task = asyncio.ensure_future(astream_llm_shared(llm, prompt_text, on_token, label, priority=PRIORITY_INTERACTIVE, user=user_id))
+    pending = cl.user_session.get("llm_tasks")
+    if pending is None:
+        pending = set()
+        cl.user_session.set("llm_tasks", pending)
+    pending.add(task)
+    try:
+        return await task
+    finally:
+        pending.discard(task)
+
+def cancel_llm_calls():
+    """Cancel the LLM calls still running for the current session"""
+    for task in list(cl.user_session.get("llm_tasks") or ()):
+        task.cancel()
+
+@cl.on_stop
+async def on_stop():
+    cancel_llm_calls()
+
+@cl.on_chat_end
+async def on_chat_end():
+    cancel_llm_calls()
+
 @cl.on_message
 async def main(message: cl.Message):
     # Get session ID and memory
@@ -575,46 +702,113 @@ async def main(message: cl.Message):
     thinking_msg = cl.Message(content="Generating query...")
     await thinking_msg.send()
     
+    semantic_lookup = None
     try:
-        # Process user query
-        standardized_query = standardize_terms(message.content, term_mappings)
-        complexity = analyze_query_complexity(standardized_query)
-        relevant_schema = extract_relevant_schema(standardized_query, node_properties)
-        
-        result = None
+        # Pin the schema version for this message; a reload only affects later messages
+        schema = schema_registry.current()
         
-        if complexity == "complex":
+        # Process user query
+        standardized_query = standardize_terms(message.content, schema.term_mappings, schema.term_matcher)
+        complexity = analyze_query_complexity(standardized_query, schema.graph.nodes)
+        relevant_schema = extract_relevant_schema(
+            standardized_query,
+            schema.node_properties,
+            schema.enum_index,
+            mode=SCHEMA_RETRIEVAL_MODE,
+            vector_index=schema.vector_index,
+            search_index=schema.search_index
+        )
+        detected_values = schema.enum_index.group_matches(schema.enum_index.find_in_text(standardized_query))
+        
+        # Responses are cached by query, schema slice, prompt version and history
+        prior_history = memory.get_formatted_context()
+        cache_key = response_cache_key(standardized_query, relevant_schema, prior_history)
+        cache_nodes = set(relevant_schema)
+        
+        # Answer common cohort filters with the rule-based compiler, skipping the LLM;
+        # follow-up questions need the conversation, which the compiler doesn't see
+        raw_response = ""
+        result = try_fast_path(message.content, schema) if not prior_history else None
+        source = "fast_path"
+        if result is None:
+            result = response_cache.get(cache_key)
+            source = "cache" if result is not None else "llm"
+        
+        # Look for a similar stored answer; only questions that don't build on
+        # earlier messages can reuse one. In shadow mode the lookup runs
+        # alongside the LLM call and is only compared with its answer.
+        if result is None and semantic_cache.enabled and not prior_history:
+            semantic_lookup = asyncio.create_task(lookup_flights.run(
+                (schema.version, " ".join(standardized_query.lower().split())),
+                lambda: asyncio.to_thread(semantic_cache.lookup, standardized_query, schema),
+                label=standardized_query
+            ))
+            if semantic_cache.mode == "on":
+                result = await semantic_lookup
+                if result is not None:
+                    source = "semantic_cache"
+        
+        if result is not None:
+            memory.add_message({"role": "user", "content": message.content})
+            memory.add_message({"role": "assistant", "content": json.dumps(result)})
+        elif complexity == "complex":
             # Handle complex query
             thinking_msg.content = "This is a complex query, breaking it down..."
             await thinking_msg.update()
             
-            sub_queries = decompose_query(standardized_query)
-            sub_results = []
+            sub_queries = build_sub_queries(decompose_query(standardized_query, schema.graph))
+            cache_nodes.update(sub_query["node"] for sub_query in sub_queries)
+            conversation_history = memory.get_formatted_context()
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUB_QUERIES)
+            completed = 0
             
-            for i, sub_query in enumerate(sub_queries):
-                thinking_msg.content = f"Processing sub-query {i+1}/{len(sub_queries)}: {sub_query}"
-                await thinking_msg.update()
-                
-                sub_schema = extract_relevant_schema(sub_query, node_properties)
-                conversation_history = memory.get_formatted_context()
-                prompt_text = create_enhanced_prompt(sub_query, sub_schema, conversation_history)
+            async def run_sub_query(sub_query):
+                nonlocal completed
+                if sub_query is not sub_queries[0]:
+                    sub_schema = extract_relevant_schema(sub_query["node"], schema.node_properties,
+                                                         search_index=schema.search_index)
+                    sub_schema.setdefault("subject", schema.node_properties.get("subject", {}))
+                    prompt_text = create_nested_query_prompt(sub_query["query"], sub_schema, sub_query["node"], conversation_history)
+                else:
+                    prompt_text = create_enhanced_prompt(sub_query["query"], relevant_schema, conversation_history, detected_values=detected_values)
                 
-                response = llm.invoke(prompt_text)
+                # Bound the number of sub-queries in flight against the LLM API
+                async with semaphore:
+                    response = await call_llm(prompt_text, label=f"{sub_query['node']}: {standardized_query}")
                 
+                completed += 1
+                thinking_msg.content = f"Finished sub-query {completed}/{len(sub_queries)}: {sub_query['node']}"
+                await thinking_msg.update()
+                return response
+            
+            # Run all sub-queries concurrently; gather keeps results in sub-query order
+            responses = await asyncio.gather(*(run_sub_query(sub_query) for sub_query in sub_queries), return_exceptions=True)
+            if any(isinstance(response, asyncio.CancelledError) for response in responses):
+                raise asyncio.CancelledError()
+            
+            sub_results = []
+            for sub_query, response in zip(sub_queries, responses):
+                sub_query_text = f"{sub_query['query']} ({sub_query['node']})"
+                if isinstance(response, Exception):
+                    print(f"Sub-query for {sub_query['node']} failed: {str(response)}")
+                    continue
+                sub_result = parse_result(response.content)
+                if not sub_result["query"]:
+                    print(f"No query in sub-query result for {sub_query['node']}: {response.content[:200]}")
+                    continue
                 try:
-                    sub_result = json.loads(response.content)
                     sub_results.append(sub_result)
                     
-                    memory.add_message({"role": "user", "content": sub_query})
+                    memory.add_message({"role": "user", "content": sub_query_text})
                     memory.add_message({"role": "assistant", "content": response.content})
                     
                     # Save sub-query result to chat history
-                    save_to_chat_history(sub_query, sub_result, session_id)
+                    save_to_chat_history(sub_query_text, sub_result, session_id)
                     
                     # Save sub-query result to ChromaDB
-                    chroma_manager.store_response(sub_query, sub_result, session_id)
+                    chroma_manager.store_response(sub_query_text, sub_result, session_id)
                 except Exception as e:
-                    print(f"Failed to parse sub-query result: {str(e)}")
+                    print(f"Failed to store sub-query result: {str(e)}")
             
             result = combine_results(sub_results, standardized_query)
         else:
@@ -623,57 +817,57 @@ async def main(message: cl.Message):
             await thinking_msg.update()
             
             conversation_history = memory.get_formatted_context()
-            prompt_text = create_enhanced_prompt(standardized_query, relevant_schema, conversation_history)
+            prompt_text = create_enhanced_prompt(standardized_query, relevant_schema, conversation_history, detected_values=detected_values)
             
-            response = llm.invoke(prompt_text)
-            print(f"LLM response: {response.content}")
+            # Show the query, variables and explanation as they stream in
+            parser = StreamingResultParser()
+            display = CoalescedMessage(thinking_msg)
             
-            try:
-                result = json.loads(response.content)
-                print(f"Successfully parsed JSON: {result}")
-            except Exception as e:
-                print(f"Failed to parse JSON: {str(e)}")
-                content = response.content
-                import re
-                query_match = re.search(r'```graphql\s*(.*?)\s*```', content, re.DOTALL)
-                variables_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                
-                query = query_match.group(1) if query_match else ""
-                variables = variables_match.group(1) if variables_match else "{}"
-                
-                result = {
-                    "query": query,
-                    "variables": variables,
-                    "explanation": "Query and variables extracted from response"
-                }
+            async def on_token(text):
+                if parser.feed(text):
+                    try:
+                        await display.set(format_result_content(parser.fields))
+                    except Exception as e:
+                        # The stream may be shared with other sessions; a failed redraw must not end it
+                        print(f"Failed to update streaming message: {str(e)}")
+            
+            response = await call_llm(prompt_text, on_token=on_token, label=standardized_query)
+            await display.flush()
+            raw_response = response.content
+            print(f"LLM response: {raw_response}")
+            
+            # Finish the streamed parse; a call shared with another session streamed its tokens there
+            result = parser.result() if parser.text == raw_response else parse_result(raw_response)
             
             memory.add_message({"role": "user", "content": message.content})
             memory.add_message({"role": "assistant", "content": json.dumps(result)})
         
-        # Format results
-        response_parts = []
-        
-        # Add GraphQL query
-        if result.get('query'):
-            response_parts.append(f"**GraphQL Query:**\n```graphql\n{result.get('query', '')}\n```")
-        
-        # Add variables
-        if result.get('variables'):
-            try:
-                variables_value = result.get('variables', '')
-                if isinstance(variables_value, dict):
-                    variables_value = json.dumps(variables_value, indent=2)
-                
-                response_parts.append(f"**Variables:**\n```json\n{variables_value}\n```")
-            except Exception as e:
-                print(f"Error formatting variables: {str(e)}")
+        # Simplify the generated filter before validating it and handing it to the backend;
+        # a contradiction is noted in the message, not added to the cached explanation
+        optimization = optimize_result(result, schema.filter_optimizer)
         
-        # Add explanation
-        if result.get('explanation'):
-            response_parts.append(f"**Explanation:**\n{result.get('explanation', '')}")
+        # Validate the generated query against the schema before showing it
+        validation_errors = schema.validator.validate(result.get("query", ""), result.get("variables"))
+        if validation_errors and source == "llm":
+            # Send only the broken part back to the LLM instead of regenerating
+            thinking_msg.content = format_result_content(result, validation_errors) + "\n\n_Fixing the errors above..._"
+            await thinking_msg.update()
+            result, validation_errors = await repair_result(
+                result, validation_errors, schema, standardized_query,
+                lambda repair_prompt: call_llm(repair_prompt, label=f"repair: {standardized_query}"),
+                raw_response
+            )
+        if validation_errors:
+            print(f"Generated query failed schema validation: {validation_errors}")
+        elif source == "llm" and result.get("query"):
+            response_cache.put(cache_key, result, cache_nodes)
+        if semantic_lookup is not None and semantic_cache.mode == "shadow":
+            semantic_cache.record_shadow(await semantic_lookup, result)
+        if semantic_cache.enabled and source == "llm" and result.get("query") and not validation_errors and not prior_history:
+            await asyncio.to_thread(semantic_cache.store, standardized_query, result, schema)
         
-        # Join final response
-        response_content = "\n\n".join(response_parts)
+        # Format results
+        response_content = format_result_content(result, validation_errors, optimization["contradiction"])
         
         # Update thinking message with result (without actions)
         thinking_msg.content = response_content
@@ -685,12 +879,28 @@ async def main(message: cl.Message):
         # Save to chat history with user context
         save_to_chat_history(message.content, result, session_id)
         
-        # Save to ChromaDB with user context
-        chroma_manager.store_response(message.content, result, session_id)
+        # Save to ChromaDB with user context; equivalent results in a session share one entry
+        result_metadata = {
+            "filter_hash": filter_hash(extract_filter(result.get("variables")) or {}),
+            "result_key": query_result_key(result.get("query", ""), result.get("variables"))
+        }
+        chroma_manager.store_response(message.content, result, session_id, metadata=result_metadata)
         
+    except asyncio.CancelledError:
+        print(f"Query generation cancelled for session {session_id}")
+        try:
+            thinking_msg.content = "⏹️ Request stopped."
+            await thinking_msg.update()
+        except Exception as e:
+            print(f"Error updating stopped message: {str(e)}")
+        raise
     except Exception as e:
         error_msg = f"Error generating query: {str(e)}"
         print(error_msg)
         traceback.print_exc()
         thinking_msg.content = error_msg
-        await thinking_msg.update()
\ No newline at end of file
+        await thinking_msg.update()
+    finally:
+        # A shadow lookup nobody waited for (error or cancellation) must not outlive the message
+        if semantic_lookup is not None and not semantic_lookup.done():
+            semantic_lookup.cancel()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import chromadb
 from chromadb.config import Settings
 from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
+from llm_backends import create_embeddings
 import os
 import json
 from datetime import datetime
@@ -25,9 +25,7 @@ class ChromaDBManager:
         self.collection_name = collection_name
         
         # Initialize embeddings
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self.embeddings = create_embeddings()
         
         # Initialize ChromaDB client
         self.client_settings = Settings(
@@ -96,8 +94,11 @@ class ChromaDBManager:
             if metadata:
                 doc_metadata.update(metadata)
             
-            # Generate document ID
-            doc_id = f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            # Generate document ID; a result_key makes equivalent results in a session share one entry
+            if doc_metadata.get("result_key"):
+                doc_id = f"{session_id}_{doc_metadata['result_key']}"
+            else:
+                doc_id = f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             
             # Store in vectorstore
             self.vectorstore.add_texts(
@@ -113,6 +114,25 @@ class ChromaDBManager:
             print(f"Error storing response in ChromaDB: {str(e)}")
             return None
     
+    def store_text(self, text: str, metadata: Dict, doc_id: str) -> str:
+        """
+        Store a document as given, replacing any document with the same ID
+        
+        Args:
+            text: Text to embed and store
+            metadata: Document metadata
+            doc_id: Document identifier
+            
+        Returns:
+            Document ID
+        """
+        try:
+            self.vectorstore.add_texts(texts=[text], metadatas=[metadata], ids=[doc_id])
+            return doc_id
+        except Exception as e:
+            print(f"Error storing document in ChromaDB: {str(e)}")
+            return None
+    
     def _format_document_content(self, user_query: str, llm_response: Dict) -> str:
         """Format document content for storage"""
         content_parts = [f"User Query: {user_query}"]
@@ -148,7 +168,9 @@ class ChromaDBManager:
                 formatted_results.append({
                     "content": doc.page_content,
                     "metadata": doc.metadata,
-                    "similarity_score": score
+                    "similarity_score": score,
+                    # Score is the squared L2 distance of unit-length embeddings
+                    "cosine_similarity": 1 - score / 2
                 })
             
             return formatted_results
@@ -26,6 +26,14 @@ class QueryMemory:
         """Get cached schema information"""
         return self.schema_cache.get(node_type)
     
+    def invalidate_schema(self, node_types=None):
+        """Drop cached schema for the given node types, or all of it"""
+        if node_types is None:
+            self.schema_cache.clear()
+        else:
+            for node_type in node_types:
+                self.schema_cache.pop(node_type, None)
+    
     def store_query_result(self, query_id, result):
         """Store query result"""
         self.query_results[query_id] = result
@@ -66,6 +74,11 @@ class SessionManager:
     def get_all_session_ids(self):
         """Get all session IDs"""
         return list(self.sessions.keys())
+    
+    def invalidate_schema_cache(self, node_types=None):
+        """Drop cached schema for the given node types in every session"""
+        for memory in list(self.sessions.values()):
+            memory.invalidate_schema(node_types)
 
 
 # Global session manager instance
@@ -0,0 +1,311 @@
+import os
+import re
+import threading
+import time
+
+from query_builder import build_graphql_filter, build_graphql_query, build_nested_filter, build_nested_selection
+
+# Minimum confidence for answering without the LLM
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.85"))
+
+# Nodes whose fields are filtered and selected directly on subject
+FLAT_NODES = ("subject", "person")
+
+# Fields returned for every cohort query, as in the prompt examples
+DEFAULT_FIELDS = ["consortium", "subject_submitter_id", "sex", "race", "ethnicity"]
+
+# Numeric field used for age ranges (stored in days)
+AGE_FIELD = "age_at_censor_status"
+DAYS_PER_UNIT = {"day": 1, "week": 7, "month": 30.4375, "year": 365.25}
+
+# Words that carry no filter meaning in a cohort request
+COHORT_VOCABULARY = {
+    "a", "all", "an", "and", "any", "are", "at", "between", "by", "cohort", "data", "each", "every",
+    "find", "for", "from", "get", "give", "in", "is", "list", "me", "of", "or", "patient", "patients",
+    "people", "persons", "please", "portal", "query", "return", "show", "subject", "subjects",
+    "that", "the", "their", "them", "those", "to", "was", "were", "who", "whose", "with", "within",
+    "age", "aged", "ages", "old", "years", "year", "months", "month", "weeks", "week", "days", "day",
+    "of", "have", "has", "had", "which", "sex", "race", "ethnicity", "consortium", "gender"
+}
+
+# Common words for sex values that are not spelled like the enum
+SEX_SYNONYMS = {
+    "male": "Male", "males": "Male", "men": "Male", "boys": "Male",
+    "female": "Female", "females": "Female", "women": "Female", "girls": "Female"
+}
+
+# Words that would turn a filter into an exclusion
+NEGATION_WORDS = {"not", "no", "non", "without", "except", "excluding", "exclude", "other", "than"}
+
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_UNIT = r"(?:\s*(?P<unit>years?|months?|weeks?|days?))?"
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that make a bare number range an age ("stage 2 to 4" is not one)
+AGE_WORD_RE = re.compile(r"\b(ages?|aged|old|older|younger)\b")
+
+# (pattern, kind) pairs for age conditions, tried in order
+AGE_PATTERNS = [
+    (re.compile(r"\bbetween\s+(?:the\s+)?(?:ages?\s+(?:of\s+)?)?" + _NUMBER + r"\s*(?:and|-|to)\s*" + _NUMBER + _UNIT), "range"),
+    (re.compile(r"\b(?:aged?\s+)?" + _NUMBER + r"\s*(?:-|to)\s*" + _NUMBER + _UNIT), "range"),
+    (re.compile(r"\b(?:older than|over|above|greater than|more than)\s+" + _NUMBER + _UNIT), "gt"),
+    (re.compile(r"\b(?:at least)\s+" + _NUMBER + _UNIT), "gte"),
+    (re.compile(r"\b(?:younger than|under|below|less than)\s+" + _NUMBER + _UNIT), "lt"),
+    (re.compile(r"\b(?:at most)\s+" + _NUMBER + _UNIT), "lte"),
+    (re.compile(r"\b(?:aged\s+)?" + _NUMBER + r"\s*(?P<unit>years?|months?|weeks?|days?)\s+old\b"), "exact")
+]
+
+
+def _to_days(value, unit):
+    unit = (unit or "year").rstrip("s")
+    return round(float(value) * DAYS_PER_UNIT[unit])
+
+
+def extract_age_condition(text):
+    """Extract an age condition in days from lowercased text
+
+    Returns (condition, span) in build_graphql_filter format, or (None, None).
+    Numbers without a unit count as years only when the text mentions age.
+    """
+    for pattern, kind in AGE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        unit = match.group("unit")
+        if unit is None and not AGE_WORD_RE.search(text):
+            continue
+
+        if kind == "range":
+            low, high = sorted((float(match.group(1)), float(match.group(2))))
+            condition = {"min": _to_days(low, unit), "max": _to_days(high + 1, unit) - 1}
+        elif kind == "exact":
+            value = float(match.group(1))
+            condition = {"min": _to_days(value, unit), "max": _to_days(value + 1, unit) - 1}
+        else:
+            condition = {"op": kind, "value": _to_days(match.group(1), unit)}
+        return condition, match.span()
+    return None, None
+
+
+def _choose_field(match, text):
+    """Pick the field for an enum mention
+
+    Subject-level values match case-insensitively; values of nested nodes
+    only when spelled exactly as in the schema, so words like "who" do not
+    match the "WHO" enum. A field whose name the query mentions (e.g.
+    "INRG consortium") wins, then subject-level fields. Returns
+    (field, ambiguous), or (None, False).
+    """
+    plausible = [
+        field for field in match["fields"]
+        if field["node"] in FLAT_NODES or field["value"] == match["text"]
+    ]
+    if not plausible:
+        return None, False
+    named = [field for field in plausible if field["property"].replace("_", " ") in text]
+    candidates = named or plausible
+    candidates.sort(key=lambda field: field["node"] not in FLAT_NODES)
+    distinct = {(field["node"], field["property"]) for field in candidates}
+    return candidates[0], len(distinct) > 1
+
+
+def compile_cohort_query(query, schema):
+    """Compile a cohort request into a GraphQL query without the LLM
+
+    Enum values are matched through schema.enum_index; values of the same
+    field become one IN list, different fields are ANDed, and fields below
+    subject (other than person) are filtered through their nested path. Age
+    phrases become a range on age_at_censor_status in days.
+
+    Confidence is the share of query words explained by a filter or by
+    cohort vocabulary, reduced for ambiguous values and nested filters.
+    Returns None when nothing could be compiled.
+    """
+    text = query.lower()
+    explained_spans = []  # (start, end, field) for text consumed by a filter
+    explained_words = set(COHORT_VOCABULARY)
+    penalty = 1.0
+
+    flat_criteria = {}
+    nested_criteria = {}
+
+    age_condition, age_span = extract_age_condition(text)
+    if age_condition:
+        flat_criteria[AGE_FIELD] = age_condition
+        explained_spans.append((*age_span, AGE_FIELD))
+        explained_words.update(AGE_FIELD.split("_"))
+
+    def add_value(node, prop, value, span):
+        if node in FLAT_NODES:
+            values = flat_criteria.setdefault(prop, [])
+        else:
+            values = nested_criteria.setdefault(node, {}).setdefault(prop, [])
+        if value not in values:
+            values.append(value)
+        explained_spans.append((*span, f"{node}.{prop}"))
+        explained_words.update(prop.split("_"))
+
+    for match in schema.enum_index.find_in_text(query):
+        low, high = match["span"]
+        if match["normalized"].replace(" ", "").isdigit() or (age_span and low < age_span[1] and high > age_span[0]):
+            # Numbers are handled by the age parser
+            continue
+        field, ambiguous = _choose_field(match, text)
+        if field is None:
+            continue
+        if ambiguous:
+            penalty *= 0.5
+        add_value(field["node"], field["property"], field["value"], match["span"])
+
+    for word in _TOKEN_RE.finditer(text):
+        if word.group() in SEX_SYNONYMS and not any(low <= word.start() < high for low, high, _ in explained_spans):
+            add_value("person", "sex", SEX_SYNONYMS[word.group()], word.span())
+
+    if not flat_criteria and not nested_criteria:
+        return None
+
+    # Build the filter: subject-level criteria first, then one nested block per node
+    filters = []
+    if flat_criteria:
+        flat_filter = build_graphql_filter(flat_criteria)["filter"]
+        filters.extend(flat_filter["AND"] if "AND" in flat_filter and len(flat_criteria) > 1 else [flat_filter])
+
+    fields = list(DEFAULT_FIELDS)
+    fields += [prop for prop in flat_criteria if prop not in fields]
+    for node, criteria in nested_criteria.items():
+        path = schema.graph.nested_path(node)
+        if path is None:
+            return None
+        penalty *= 0.9
+        explained_words.update(node.split("_"))
+        explained_words.update(part for field in path for part in field.split("_"))
+        filters.append(build_nested_filter(build_graphql_filter(criteria)["filter"], list(path)))
+        fields.append(build_nested_selection(list(criteria), list(path)))
+
+    # Score how much of the request the filters account for
+    words = [(m.group(), m.start()) for m in _TOKEN_RE.finditer(text)]
+    explained_spans.sort()
+    explained = 0
+    for word, start in words:
+        if any(low <= start < high for low, high, _ in explained_spans):
+            explained += 1
+            continue
+        if word in NEGATION_WORDS:
+            # Exclusions are left to the LLM
+            return None
+        if word == "or":
+            # "or" across different fields is not a plain AND of IN lists
+            before = [field for low, high, field in explained_spans if high <= start]
+            after = [field for low, high, field in explained_spans if low > start]
+            if before and after and before[-1] != after[0]:
+                return None
+        if word in explained_words:
+            explained += 1
+    confidence = round(penalty * explained / len(words), 3) if words else 0.0
+
+    summary = []
+    for prop, condition in flat_criteria.items():
+        summary.append(f"{prop} {condition}" if prop == AGE_FIELD else f"{prop} in {condition}")
+    for node, criteria in nested_criteria.items():
+        summary.extend(f"{node}.{prop} in {values}" for prop, values in criteria.items())
+
+    return {
+        "query": build_graphql_query(fields),
+        "variables": {"filter": filters[0] if len(filters) == 1 else {"AND": filters}},
+        "explanation": "Generated by rule-based fast path: subjects where " + "; ".join(summary)
+                       + (" (ages in days)" if AGE_FIELD in flat_criteria else ""),
+        "confidence": confidence
+    }
+
+
+class FastPathStats:
+    """Hit rate and latency counters for the fast path"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.fast_path_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def record_attempt(self, hit, elapsed):
+        with self._lock:
+            self.requests += 1
+            self.fast_path_seconds += elapsed
+            if hit:
+                self.hits += 1
+
+    def record_llm(self, elapsed):
+        """Record one LLM round-trip, used to estimate the latency each hit saves"""
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            avg_llm = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+            avg_fast = self.fast_path_seconds / self.requests if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.requests, 3) if self.requests else 0.0,
+                "avg_fast_path_ms": round(avg_fast * 1000, 3),
+                "avg_llm_ms": round(avg_llm * 1000, 1),
+                "estimated_saved_ms": round(self.hits * max(avg_llm - avg_fast, 0.0) * 1000, 1)
+            }
+
+
+# Global fast path statistics
+fast_path_stats = FastPathStats()
+
+
+def try_fast_path(query, schema, threshold=FAST_PATH_THRESHOLD):
+    """Return a compiled result if its confidence reaches threshold, else None"""
+    start = time.perf_counter()
+    try:
+        result = compile_cohort_query(query, schema)
+    except Exception as e:
+        print(f"Fast path failed: {str(e)}")
+        result = None
+    hit = result is not None and result["confidence"] >= threshold
+    elapsed = time.perf_counter() - start
+    fast_path_stats.record_attempt(hit, elapsed)
+
+    if result is not None:
+        stats = fast_path_stats.snapshot()
+        print(f"Fast path confidence {result['confidence']:.2f} ({'hit' if hit else 'fallback to LLM'}, {elapsed * 1000:.2f} ms); "
+              f"hit rate {stats['hit_rate']:.1%}, saved ~{stats['estimated_saved_ms'] / 1000:.1f} s")
+    return result if hit else None
+
+
+if __name__ == "__main__":
+    # Test code
+    import json
+
+    from schema_registry import SCHEMA_FILE, load_schema_version
+
+    schema = load_schema_version(SCHEMA_FILE)
+    queries = [
+        "Query subjects who are multiracial and between 0 and 18 years of age",
+        "Female patients in the INRG consortium who are Hispanic or Latino",
+        "White or Black or African American males younger than 5 years",
+        "Subjects aged 2-10 years in INSTRuCT",
+        "What proportion of patients with malignant peripheral nerve sheath tumor and Neurofibromatosis Type 1 within the data portal are females?",
+        "How many diseases are represented within the data portal?",
+        "Patients who are not Hispanic or Latino",
+        "Female or Hispanic or Latino subjects",
+        # "stage" is not an age: the range must not become an age filter
+        "Female INRG subjects in stage 2 to 4",
+    ]
+
+    for query in queries:
+        result = try_fast_path(query, schema)
+        print(f"{query!r}: {'LLM' if result is None else 'fast path'}")
+        if result:
+            print(json.dumps(result["variables"]))
+
+    # Simulate LLM latency for fallbacks to show the saved-latency report
+    for _ in range(fast_path_stats.requests - fast_path_stats.hits):
+        fast_path_stats.record_llm(2.0)
+    print(fast_path_stats.snapshot())
@@ -0,0 +1,376 @@
+import abc
+import hashlib
+import json
+import math
+import time
+
+from query_validator import GraphQLSyntaxError, parse_graphql_query
+
+LOGICAL_OPERATORS = {"AND": "AND", "and": "AND", "OR": "OR", "or": "OR"}
+IN_OPERATORS = {"IN", "in"}
+EQ_OPERATORS = {"=", "eq", "EQ"}
+NE_OPERATORS = {"!=", "ne", "NE"}
+RANGE_OPERATORS = {
+    "GT": ("low", False), "gt": ("low", False), ">": ("low", False),
+    "GTE": ("low", True), "gte": ("low", True), ">=": ("low", True),
+    "LT": ("high", False), "lt": ("high", False), "<": ("high", False),
+    "LTE": ("high", True), "lte": ("high", True), "<=": ("high", True)
+}
+NESTED_OPERATOR = "nested"
+
+
+def _canonical_value(value):
+    """Fold equal numbers to one spelling (18.0 -> 18) so they hash alike"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _range_bound(value):
+    """Get a range bound as a number, reading numeric strings; None if it isn't one"""
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return _canonical_value(value)
+
+
+def _value_sort_key(value):
+    if isinstance(value, bool):
+        return (2, str(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return (3, json.dumps(value, sort_keys=True, default=str))
+
+
+def canonical_json(value):
+    """Serialize with sorted keys and no whitespace"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class FilterNode(abc.ABC):
+    """Base class for filter AST nodes"""
+
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def to_dict(self):
+        """Get the JSON filter this node stands for"""
+
+    def sort_key(self):
+        return canonical_json(self.to_dict())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.sort_key() == other.sort_key()
+
+    def __hash__(self):
+        return hash(self.sort_key())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.sort_key()})"
+
+
+class And(FilterNode):
+    __slots__ = ("children",)
+
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def to_dict(self):
+        items = []
+        for child in self.children:
+            if isinstance(child, Range) and child.low is not None and child.high is not None:
+                # Inline both bounds instead of nesting another AND
+                items.extend(child.bound_dicts())
+            else:
+                items.append(child.to_dict())
+        return {"AND": items}
+
+
+class Or(FilterNode):
+    __slots__ = ("children",)
+
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def to_dict(self):
+        return {"OR": [child.to_dict() for child in self.children]}
+
+
+class In(FilterNode):
+    __slots__ = ("field", "values")
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = tuple(values)
+
+    def to_dict(self):
+        return {"IN": {self.field: list(self.values)}}
+
+
+class NotEqual(FilterNode):
+    __slots__ = ("field", "value")
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def to_dict(self):
+        return {"!=": {self.field: self.value}}
+
+
+class Range(FilterNode):
+    """Numeric bounds on one field; a missing bound is None"""
+
+    __slots__ = ("field", "low", "low_inclusive", "high", "high_inclusive")
+
+    def __init__(self, field, low=None, low_inclusive=True, high=None, high_inclusive=True):
+        self.field = field
+        self.low = low
+        self.low_inclusive = low_inclusive
+        self.high = high
+        self.high_inclusive = high_inclusive
+
+    def bound_dicts(self):
+        bounds = []
+        if self.low is not None:
+            bounds.append({"GTE" if self.low_inclusive else "GT": {self.field: self.low}})
+        if self.high is not None:
+            bounds.append({"LTE" if self.high_inclusive else "LT": {self.field: self.high}})
+        return bounds
+
+    def to_dict(self):
+        bounds = self.bound_dicts()
+        return bounds[0] if len(bounds) == 1 else {"AND": bounds}
+
+    def describe(self):
+        """Short form of the bounds for rewrite reports, e.g. >=730 AND <1825"""
+        bounds = []
+        if self.low is not None:
+            bounds.append(f"{'>=' if self.low_inclusive else '>'}{self.low}")
+        if self.high is not None:
+            bounds.append(f"{'<=' if self.high_inclusive else '<'}{self.high}")
+        return " AND ".join(bounds) or "any"
+
+    def intersect(self, other):
+        """Get the range satisfying both self and other"""
+        low, low_inclusive = self.low, self.low_inclusive
+        if other.low is not None and (low is None or other.low > low or (other.low == low and not other.low_inclusive)):
+            low, low_inclusive = other.low, other.low_inclusive
+        high, high_inclusive = self.high, self.high_inclusive
+        if other.high is not None and (high is None or other.high < high or (other.high == high and not other.high_inclusive)):
+            high, high_inclusive = other.high, other.high_inclusive
+        return Range(self.field, low, low_inclusive, high, high_inclusive)
+
+
+class Nested(FilterNode):
+    __slots__ = ("path", "child")
+
+    def __init__(self, path, child):
+        self.path = path
+        self.child = child
+
+    def to_dict(self):
+        children = self.child.children if isinstance(self.child, And) else (self.child,)
+        return {"nested": {"path": self.path, **And(children).to_dict()}}
+
+
+class Raw(FilterNode):
+    """Unrecognized filter kept verbatim"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return self.value
+
+
+def parse_filter(value):
+    """Parse a Guppy-style filter dict into a FilterNode tree"""
+    if not isinstance(value, dict):
+        return Raw(value)
+
+    parts = []
+    for operator, operand in value.items():
+        if operator in LOGICAL_OPERATORS and isinstance(operand, list):
+            children = [parse_filter(item) for item in operand]
+            parts.append(And(children) if LOGICAL_OPERATORS[operator] == "AND" else Or(children))
+        elif operator == NESTED_OPERATOR and isinstance(operand, dict) and "path" in operand:
+            inner = {key: item for key, item in operand.items() if key != "path"}
+            parts.append(Nested(operand["path"], parse_filter(inner)))
+        elif operator in IN_OPERATORS and isinstance(operand, dict):
+            parts.extend(
+                In(field, [_canonical_value(v) for v in (values if isinstance(values, list) else [values])])
+                for field, values in operand.items()
+            )
+        elif operator in EQ_OPERATORS and isinstance(operand, dict):
+            parts.extend(In(field, [_canonical_value(v)]) for field, v in operand.items())
+        elif operator in NE_OPERATORS and isinstance(operand, dict):
+            parts.extend(NotEqual(field, _canonical_value(v)) for field, v in operand.items())
+        elif operator in RANGE_OPERATORS and isinstance(operand, dict):
+            side, inclusive = RANGE_OPERATORS[operator]
+            for field, value in operand.items():
+                bound = _range_bound(value)
+                if bound is None:
+                    # Bounds that aren't numbers can't be ordered; keep them for the validator to report
+                    parts.append(Raw({operator: {field: value}}))
+                elif side == "low":
+                    parts.append(Range(field, low=bound, low_inclusive=inclusive))
+                else:
+                    parts.append(Range(field, high=bound, high_inclusive=inclusive))
+        elif operator not in LOGICAL_OPERATORS and operator not in RANGE_OPERATORS and operator != NESTED_OPERATOR \
+                and not isinstance(operand, dict):
+            # Shorthand equality {field: value} or {field: [values]}
+            values = operand if isinstance(operand, list) else [operand]
+            parts.append(In(operator, [_canonical_value(v) for v in values]))
+        else:
+            parts.append(Raw({operator: operand}))
+
+    return parts[0] if len(parts) == 1 else And(parts)
+
+
+def _dedupe_sorted(children):
+    unique = {child.sort_key(): child for child in children}
+    return [unique[key] for key in sorted(unique)]
+
+
+def normalize_filter(node, rewrites=None):
+    """Normalize a filter tree without changing its meaning
+
+    Nested AND/OR are flattened, single-child groups unwrapped, IN lists
+    deduplicated and sorted, bounds on the same field within an AND merged
+    into one range, and duplicate children removed. Children are sorted by
+    their canonical JSON, so equivalent filters normalize identically.
+    Each rewrite other than reordering is described in rewrites, if given.
+    """
+    if rewrites is None:
+        rewrites = []
+
+    if isinstance(node, (And, Or)):
+        group = type(node)
+        name = "AND" if group is And else "OR"
+        children = []
+        for child in node.children:
+            child = normalize_filter(child, rewrites)
+            if isinstance(child, group):
+                rewrites.append(f"dropped empty {name}" if not child.children else f"flattened nested {name}")
+                children.extend(child.children)
+            else:
+                children.append(child)
+
+        if group is And:
+            ranges = {}
+            others = []
+            for child in children:
+                if not isinstance(child, Range):
+                    others.append(child)
+                elif child.field in ranges:
+                    current = ranges[child.field]
+                    merged = current.intersect(child)
+                    # Joining a lower and an upper bound is not worth reporting; overlapping bounds are
+                    if (current.low is not None and child.low is not None) or (current.high is not None and child.high is not None):
+                        rewrites.append(f"{child.field}: {current.describe()} AND {child.describe()} -> {merged.describe()}")
+                    ranges[child.field] = merged
+                else:
+                    ranges[child.field] = child
+            children = others + list(ranges.values())
+
+        unique = _dedupe_sorted(children)
+        if len(unique) < len(children):
+            rewrites.append(f"removed {len(children) - len(unique)} duplicate condition(s) in {name}")
+        return unique[0] if len(unique) == 1 else group(unique)
+
+    if isinstance(node, In):
+        values = {canonical_json(v): v for v in node.values}
+        if len(values) < len(node.values):
+            rewrites.append(f"{node.field}: removed duplicate IN values")
+        return In(node.field, sorted(values.values(), key=_value_sort_key))
+
+    if isinstance(node, Nested):
+        return Nested(node.path, normalize_filter(node.child, rewrites))
+
+    return node
+
+
+def extract_filter(variables):
+    """Get the filter dict from a variables dict or JSON string"""
+    if isinstance(variables, str):
+        try:
+            variables = json.loads(variables) if variables.strip() else {}
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(variables, dict):
+        return None
+    return variables.get("filter")
+
+
+def canonicalize_filter(filter_value):
+    """Get the normalized filter as a Guppy filter dict"""
+    if not filter_value:
+        return {}
+    return normalize_filter(parse_filter(filter_value)).to_dict()
+
+
+def filter_hash(filter_value):
+    """Stable content hash of a filter; equivalent filters hash alike"""
+    return hashlib.sha256(canonical_json(canonicalize_filter(filter_value)).encode("utf-8")).hexdigest()[:16]
+
+
+def _canonical_selection(fields):
+    return sorted(
+        [field["name"], canonical_json(field["args"]), _canonical_selection(field["selections"])]
+        for field in fields
+    )
+
+
+def query_result_key(query, variables):
+    """Stable key for a generated query and its variables
+
+    Combines the sorted selection set with the canonical filter, so results
+    that differ only in field order, whitespace or filter layout share a key.
+    Used for response and result caches and history dedup.
+    """
+    try:
+        _, fields = parse_graphql_query(query or "")
+        selection = _canonical_selection(fields)
+    except GraphQLSyntaxError:
+        selection = " ".join((query or "").split())
+    filter_value = extract_filter(variables)
+    payload = canonical_json({"selection": selection, "filter": canonicalize_filter(filter_value) if isinstance(filter_value, dict) else filter_value})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+if __name__ == "__main__":
+    # Test code
+    from query_builder import build_graphql_filter
+
+    built = build_graphql_filter({"race": ["Multiracial"], "age_at_censor_status": {"min": 0, "max": 18}})["filter"]
+    llm_variant = {"AND": [
+        {"LTE": {"age_at_censor_status": 18.0}},
+        {"AND": [{"GTE": {"age_at_censor_status": 0}}, {"IN": {"race": ["Multiracial", "Multiracial"]}}]}
+    ]}
+    print(f"Built:      {canonical_json(built)}")
+    print(f"LLM:        {canonical_json(llm_variant)}")
+    print(f"Normalized: {canonical_json(canonicalize_filter(built))}")
+    print(f"Same hash: {filter_hash(built) == filter_hash(llm_variant)} ({filter_hash(built)})")
+
+    # Numeric strings become numbers; other bounds are kept as written
+    sloppy = {"AND": [{"GTE": {"age_at_censor_status": "5"}}, {"LTE": {"age_at_censor_status": 10}}, {"LT": {"age_at_censor_status": "ten"}}]}
+    print(f"Sloppy bounds: {canonical_json(canonicalize_filter(sloppy))}")
+
+    query_a = "query ($filter: JSON) { subject(first: 20, filter: $filter) { sex race } }"
+    query_b = "query ($filter: JSON) {\n  subject(first: 20, filter: $filter) {\n    race\n    sex\n  }\n}"
+    print(f"Same result key: {query_result_key(query_a, {'filter': built}) == query_result_key(query_b, json.dumps({'filter': llm_variant}))}")
+
+    rounds = 5000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        filter_hash(llm_variant)
+    print(f"filter_hash: {(time.perf_counter() - start) / rounds * 1_000_000:.1f} us")
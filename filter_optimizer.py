@@ -0,0 +1,322 @@
+import json
+import time
+
+from filter_ast import (
+    And, In, Nested, NotEqual, Or, Range, FilterNode,
+    extract_filter, normalize_filter, parse_filter
+)
+
+
+class Never(FilterNode):
+    """A condition no record can satisfy"""
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"NEVER": True}
+
+
+def count_nodes(node):
+    """Count AST nodes, used to report how much smaller a filter got"""
+    if isinstance(node, (And, Or)):
+        return 1 + sum(count_nodes(child) for child in node.children)
+    if isinstance(node, Nested):
+        return 1 + count_nodes(node.child)
+    return 1
+
+
+def _is_empty_range(node):
+    if node.low is None or node.high is None:
+        return False
+    return node.low > node.high or (node.low == node.high and not (node.low_inclusive and node.high_inclusive))
+
+
+class FilterOptimizer:
+    """Simplify generated filter trees before they reach the Guppy backend
+
+    Rewrites are applied bottom-up on the normalized AST:
+    - OR of IN/equals on the same field -> one IN
+    - OR of nested filters on the same path -> one nested OR
+    - overlapping numeric ranges and IN lists under AND -> their intersection
+    - empty groups -> dropped
+    - empty ranges/intersections (contradictions) -> Never, which empties
+      an AND and is dropped from an OR
+    - root-level conditions on a field of exactly one nested node -> moved
+      into that node's nested path
+    Every rewrite is described in the report.
+    """
+
+    def __init__(self, validator=None, graph=None):
+        self.root_fields = set()
+        self.field_paths = {}
+        if validator is not None and graph is not None:
+            root = validator.root
+            self.root_fields = set(validator.scopes[root].fields)
+            owners = {}
+            for node, scope in validator.scopes.items():
+                if node == root:
+                    continue
+                path = graph.nested_field(node, root)
+                if not path:
+                    continue
+                for field in scope.fields:
+                    owners.setdefault(field, []).append(path)
+            self.field_paths = {field: paths[0] for field, paths in owners.items() if len(paths) == 1}
+
+    def optimize(self, filter_value):
+        """Optimize a filter dict, returning (optimized filter dict, report)"""
+        report = {"rewrites": [], "contradiction": False, "nodes_before": 0, "nodes_after": 0}
+        if not isinstance(filter_value, dict) or not filter_value:
+            return filter_value, report
+
+        tree = parse_filter(filter_value)
+        report["nodes_before"] = count_nodes(tree)
+        normalized = normalize_filter(tree, report["rewrites"])
+
+        optimized = self._optimize(normalized, report["rewrites"], at_root=True)
+        report["rewrites"] = list(dict.fromkeys(report["rewrites"]))
+        if isinstance(optimized, Never):
+            report["contradiction"] = True
+            report["rewrites"].append("filter is contradictory: the query returns no subjects")
+            report["nodes_after"] = count_nodes(normalized)
+            return normalized.to_dict(), report
+
+        if isinstance(optimized, And) and not optimized.children:
+            report["nodes_after"] = 0
+            return {}, report
+
+        optimized = normalize_filter(optimized, report["rewrites"])
+        report["nodes_after"] = count_nodes(optimized)
+        return optimized.to_dict(), report
+
+    def _optimize(self, node, rewrites, at_root=False):
+        if isinstance(node, Nested):
+            child = self._optimize(node.child, rewrites)
+            if isinstance(child, Never):
+                return child
+            if isinstance(child, And) and not child.children:
+                rewrites.append(f"dropped nested '{node.path}' with no conditions")
+                return And([])
+            return Nested(node.path, child)
+
+        if isinstance(node, Or):
+            return self._optimize_or(node, rewrites, at_root)
+
+        if isinstance(node, And):
+            return self._optimize_and(node, rewrites, at_root)
+
+        if isinstance(node, Range) and _is_empty_range(node):
+            rewrites.append(f"range on '{node.field}' is empty")
+            return Never()
+
+        if isinstance(node, In) and not node.values:
+            rewrites.append(f"IN on '{node.field}' has no values")
+            return Never()
+
+        if at_root:
+            return self._push_into_nested(node, rewrites)
+        return node
+
+    def _push_into_nested(self, node, rewrites):
+        """Move a root-level condition on a nested node's field into its path"""
+        field = getattr(node, "field", None)
+        if field is None or field in self.root_fields or field not in self.field_paths:
+            return node
+        path = self.field_paths[field]
+        rewrites.append(f"moved condition on '{field}' into nested path '{path}'")
+        return Nested(path, node)
+
+    def _optimize_or(self, node, rewrites, at_root):
+        children = []
+        for child in node.children:
+            child = self._optimize(child, rewrites, at_root)
+            if isinstance(child, Never):
+                rewrites.append("dropped contradictory OR branch")
+                continue
+            if isinstance(child, And) and not child.children:
+                rewrites.append("OR contains an always-true branch, dropped the OR")
+                return And([])
+            children.append(child)
+
+        if not children:
+            return Never()
+
+        # OR of IN/equals on one field -> one IN
+        merged = []
+        in_by_field = {}
+        for child in children:
+            if isinstance(child, In):
+                if child.field in in_by_field:
+                    existing = in_by_field[child.field]
+                    existing.values = existing.values + tuple(v for v in child.values if v not in existing.values)
+                    rewrites.append(f"collapsed OR of values on '{child.field}' into IN")
+                    continue
+                child = In(child.field, child.values)
+                in_by_field[child.field] = child
+            merged.append(child)
+        children = merged
+
+        # OR of nested filters on one path -> one nested OR
+        merged = []
+        nested_by_path = {}
+        for child in children:
+            if isinstance(child, Nested):
+                if child.path in nested_by_path:
+                    nested_by_path[child.path].append(child.child)
+                    rewrites.append(f"merged OR of nested '{child.path}' filters into one nested filter")
+                    continue
+                nested_by_path[child.path] = [child.child]
+            merged.append(child)
+        children = [
+            Nested(child.path, self._optimize_or(Or(nested_by_path[child.path]), rewrites, False))
+            if isinstance(child, Nested) and len(nested_by_path[child.path]) > 1 else child
+            for child in merged
+        ]
+
+        return children[0] if len(children) == 1 else Or(children)
+
+    def _optimize_and(self, node, rewrites, at_root):
+        children = []
+        for child in node.children:
+            # Root-level leaves are pushed down below, grouped by nested path
+            child = self._optimize(child, rewrites)
+            if isinstance(child, Never):
+                return child
+            if isinstance(child, And):
+                if not child.children:
+                    rewrites.append("dropped always-true condition from AND")
+                children.extend(child.children)
+            else:
+                children.append(child)
+
+        ranges = {}
+        in_lists = {}
+        not_equal = {}
+        others = []
+        for child in children:
+            if isinstance(child, Range):
+                if child.field in ranges:
+                    rewrites.append(f"intersected ranges on '{child.field}'")
+                    child = ranges[child.field].intersect(child)
+                ranges[child.field] = child
+            elif isinstance(child, In):
+                if child.field in in_lists:
+                    values = tuple(v for v in in_lists[child.field].values if v in child.values)
+                    rewrites.append(f"intersected IN lists on '{child.field}'")
+                    child = In(child.field, values)
+                in_lists[child.field] = child
+            elif isinstance(child, NotEqual):
+                not_equal.setdefault(child.field, []).append(child)
+            else:
+                others.append(child)
+
+        for field, range_node in ranges.items():
+            if _is_empty_range(range_node):
+                rewrites.append(f"range on '{field}' is empty")
+                return Never()
+            if field in in_lists:
+                kept = tuple(
+                    v for v in in_lists[field].values
+                    if not isinstance(v, (int, float)) or self._in_range(v, range_node)
+                )
+                if len(kept) != len(in_lists[field].values):
+                    rewrites.append(f"removed IN values on '{field}' outside its range")
+                    in_lists[field] = In(field, kept)
+
+        for field, in_node in list(in_lists.items()):
+            if field in not_equal:
+                excluded = {item.value for item in not_equal.pop(field)}
+                in_lists[field] = In(field, tuple(v for v in in_node.values if v not in excluded))
+                rewrites.append(f"folded != on '{field}' into its IN list")
+            if not in_lists[field].values:
+                rewrites.append(f"conditions on '{field}' cannot all hold")
+                return Never()
+
+        children = others + list(ranges.values()) + list(in_lists.values())
+        children += [item for items in not_equal.values() for item in items]
+
+        if at_root:
+            # Conditions on the same nested node must hold for the same record
+            kept = []
+            pushed = {}
+            for child in children:
+                field = getattr(child, "field", None)
+                if field is not None and field not in self.root_fields and field in self.field_paths:
+                    pushed.setdefault(self.field_paths[field], []).append(child)
+                    rewrites.append(f"moved condition on '{field}' into nested path '{self.field_paths[field]}'")
+                else:
+                    kept.append(child)
+            children = kept + [
+                Nested(path, group[0] if len(group) == 1 else And(group)) for path, group in pushed.items()
+            ]
+
+        return children[0] if len(children) == 1 else And(children)
+
+    @staticmethod
+    def _in_range(value, range_node):
+        if range_node.low is not None and (value < range_node.low or (value == range_node.low and not range_node.low_inclusive)):
+            return False
+        if range_node.high is not None and (value > range_node.high or (value == range_node.high and not range_node.high_inclusive)):
+            return False
+        return True
+
+
+def build_filter_optimizer(validator, graph):
+    """Build the filter optimizer for a loaded schema"""
+    return FilterOptimizer(validator, graph)
+
+
+def optimize_result(result, optimizer):
+    """Optimize the filter inside a generated result in place and return the report"""
+    variables = result.get("variables")
+    filter_value = extract_filter(variables)
+    if not isinstance(filter_value, dict):
+        return {"rewrites": [], "contradiction": False, "nodes_before": 0, "nodes_after": 0}
+
+    try:
+        optimized, report = optimizer.optimize(filter_value)
+    except Exception as e:
+        # Leave a filter the optimizer can't handle as generated; the validator judges it
+        print(f"Filter optimization failed, keeping the filter unchanged: {str(e)}")
+        return {"rewrites": [], "contradiction": False, "nodes_before": 0, "nodes_after": 0}
+    if report["rewrites"]:
+        parsed = json.loads(variables) if isinstance(variables, str) else dict(variables)
+        parsed["filter"] = optimized
+        result["variables"] = json.dumps(parsed) if isinstance(variables, str) else parsed
+        print(f"Filter optimized ({report['nodes_before']} -> {report['nodes_after']} nodes): {report['rewrites']}")
+    return report
+
+
+if __name__ == "__main__":
+    # Test code
+    from schema_registry import SCHEMA_FILE, load_schema_version
+
+    schema = load_schema_version(SCHEMA_FILE)
+    optimizer = build_filter_optimizer(schema.validator, schema.graph)
+
+    examples = {
+        "OR of equals": {"OR": [{"race": "White"}, {"=": {"race": "Asian"}}, {"IN": {"race": ["Multiracial"]}}]},
+        "overlapping ranges": {"AND": [
+            {"GTE": {"age_at_censor_status": 0}}, {"LTE": {"age_at_censor_status": 6939}},
+            {"AND": [{"GTE": {"age_at_censor_status": 365}}, {"LT": {"age_at_censor_status": 10000}}]},
+            {"AND": []}
+        ]},
+        "contradiction": {"AND": [{"IN": {"sex": ["Male"]}}, {"IN": {"sex": ["Female"]}}]},
+        "push into nested": {"AND": [{"IN": {"consortium": ["INRG"]}}, {"IN": {"stage_system": ["Ann Arbor"]}}, {"IN": {"stage": ["Stage II"]}}]},
+        "OR of nested": {"OR": [
+            {"nested": {"path": "stagings", "AND": [{"IN": {"stage": ["Stage II"]}}]}},
+            {"nested": {"path": "stagings", "AND": [{"IN": {"stage": ["Stage III"]}}]}}
+        ]},
+        "null and string bounds": {"AND": [{"GTE": {"age_at_censor_status": None}}, {"LTE": {"age_at_censor_status": "6939"}}]},
+    }
+    for name, filter_value in examples.items():
+        optimized, report = optimizer.optimize(filter_value)
+        print(f"{name}: {json.dumps(optimized)}")
+        print(f"  {report}")
+        print(f"  validation: {schema.validator.validate_filter(optimized)}")
+
+    rounds = 2000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        optimizer.optimize(examples["overlapping ranges"])
+    print(f"optimize: {(time.perf_counter() - start) / rounds * 1_000_000:.0f} us/filter")
@@ -0,0 +1,235 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# "openai" or "fake"; LLM_CASSETTE wraps either in record/replay
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_CASSETTE = os.getenv("LLM_CASSETTE")
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "auto")
+
+# Fake backend: fixture table and timing
+LLM_FIXTURES = os.getenv("LLM_FIXTURES", "llm_fixtures.json")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "1.0"))
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.2"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "60"))
+
+# Characters per streamed token, roughly what the OpenAI tokenizer produces
+CHARS_PER_TOKEN = 4
+
+_USER_QUERY_RE = re.compile(r"^User query: (.*)$", re.MULTILINE)
+
+
+def prompt_user_query(prompt_text):
+    """Get the user query line of a prompt, or the whole prompt"""
+    match = _USER_QUERY_RE.search(prompt_text)
+    return match.group(1) if match else prompt_text
+
+
+class LLMBackend(abc.ABC):
+    """Interface the handlers use: the async half of a LangChain chat model
+
+    ainvoke(prompt) returns a message with .content; astream(prompt) yields
+    chunks with .content. ChatOpenAI already provides both.
+    """
+
+    model_name = "backend"
+
+    @abc.abstractmethod
+    async def ainvoke(self, prompt_text):
+        """Return the whole response message"""
+
+    @abc.abstractmethod
+    async def astream(self, prompt_text):
+        """Yield the response in chunks"""
+        yield
+
+
+class FakeLLM(LLMBackend):
+    """Offline stand-in answering from a fixture table
+
+    Each fixture has a regex matched (case-insensitively) against the
+    prompt's user query and the response to return; the first match wins
+    and the default response is used otherwise. The first token arrives
+    after latency +/- jitter seconds and the rest at tokens_per_second.
+    """
+
+    model_name = "fake"
+
+    def __init__(self, fixtures, default, latency=FAKE_LLM_LATENCY, jitter=FAKE_LLM_JITTER,
+                 tokens_per_second=FAKE_LLM_TOKENS_PER_SECOND, seed=None):
+        self.fixtures = [(re.compile(item["match"], re.IGNORECASE), item["response"]) for item in fixtures]
+        self.default = default
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_fixture_file(cls, path=LLM_FIXTURES, **kwargs):
+        with open(path, "r") as f:
+            table = json.load(f)
+        return cls(table["fixtures"], table["default"], **kwargs)
+
+    def respond(self, prompt_text):
+        """Get the fixture response text for a prompt"""
+        user_query = prompt_user_query(prompt_text)
+        for pattern, response in self.fixtures:
+            if pattern.search(user_query):
+                break
+        else:
+            response = self.default
+        return response if isinstance(response, str) else json.dumps(response, indent=2)
+
+    def _first_token_delay(self):
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    async def ainvoke(self, prompt_text):
+        content = self.respond(prompt_text)
+        tokens = len(content) / CHARS_PER_TOKEN
+        await asyncio.sleep(self._first_token_delay() + tokens / self.tokens_per_second)
+        return AIMessage(content=content)
+
+    async def astream(self, prompt_text):
+        content = self.respond(prompt_text)
+        await asyncio.sleep(self._first_token_delay())
+        for start in range(0, len(content), CHARS_PER_TOKEN):
+            yield AIMessageChunk(content=content[start:start + CHARS_PER_TOKEN])
+            await asyncio.sleep(1.0 / self.tokens_per_second)
+
+
+class CassetteMissError(Exception):
+    """Replay mode found no recording for a prompt"""
+
+
+class CassetteLLM(LLMBackend):
+    """Record/replay layer around another backend
+
+    Responses are stored in a JSON cassette keyed by a hash of the prompt.
+    Modes: "record" always calls the wrapped backend and stores the answer,
+    "replay" only answers from the cassette, and "auto" replays what is
+    recorded and records the rest.
+    """
+
+    def __init__(self, inner, path, mode=LLM_CASSETTE_MODE):
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.inner = inner
+        self.path = path
+        self.mode = mode
+        self.model_name = getattr(inner, "model_name", type(inner).__name__)
+        self._lock = threading.Lock()
+        self.recordings = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.recordings = json.load(f)
+
+    @staticmethod
+    def key(prompt_text):
+        return hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()[:24]
+
+    def _recorded(self, prompt_text):
+        if self.mode == "record":
+            return None
+        entry = self.recordings.get(self.key(prompt_text))
+        if entry is None and self.mode == "replay":
+            raise CassetteMissError(f"No recording for prompt with user query: {prompt_user_query(prompt_text)[:80]}")
+        return entry
+
+    def _record(self, prompt_text, content):
+        with self._lock:
+            self.recordings[self.key(prompt_text)] = {"user_query": prompt_user_query(prompt_text), "content": content}
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.recordings, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+    async def ainvoke(self, prompt_text):
+        entry = self._recorded(prompt_text)
+        if entry is not None:
+            return AIMessage(content=entry["content"])
+        response = await self.inner.ainvoke(prompt_text)
+        self._record(prompt_text, response.content)
+        return response
+
+    async def astream(self, prompt_text):
+        entry = self._recorded(prompt_text)
+        if entry is not None:
+            content = entry["content"]
+            for start in range(0, len(content), CHARS_PER_TOKEN):
+                yield AIMessageChunk(content=content[start:start + CHARS_PER_TOKEN])
+            return
+        parts = []
+        async for chunk in self.inner.astream(prompt_text):
+            parts.append(chunk.content)
+            yield chunk
+        self._record(prompt_text, "".join(parts))
+
+
+def create_llm(backend=LLM_BACKEND, cassette=LLM_CASSETTE, **openai_kwargs):
+    """Create the configured LLM backend; openai_kwargs go to ChatOpenAI"""
+    if backend == "fake":
+        llm = FakeLLM.from_fixture_file()
+    elif backend == "openai":
+        from langchain_openai import ChatOpenAI
+        llm = ChatOpenAI(**openai_kwargs)
+    else:
+        raise ValueError(f"Unknown LLM backend: {backend}")
+
+    if cassette:
+        llm = CassetteLLM(llm, cassette)
+    print(f"LLM backend: {backend}" + (f" (cassette {cassette}, {LLM_CASSETTE_MODE})" if cassette else ""))
+    return llm
+
+
+def create_embeddings(backend=LLM_BACKEND):
+    """Create the embedding model matching the configured LLM backend"""
+    if backend == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=256)
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+
+if __name__ == "__main__":
+    # Test code
+    import tempfile
+    import time
+
+    from prompt_builder import create_enhanced_prompt
+
+    async def main():
+        fake = FakeLLM.from_fixture_file(latency=0.2, jitter=0.05, seed=1)
+        prompt = create_enhanced_prompt("What are the INRGSS stages represented within the data portal?", {})
+        start = time.perf_counter()
+        response = await fake.ainvoke(prompt)
+        print(f"ainvoke {time.perf_counter() - start:.2f}s: {json.loads(response.content)['explanation']}")
+
+        start = time.perf_counter()
+        first_token = None
+        async for chunk in fake.astream(prompt):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+        print(f"astream first token {first_token:.2f}s, total {time.perf_counter() - start:.2f}s")
+
+        path = os.path.join(tempfile.mkdtemp(), "cassette.json")
+        recorder = CassetteLLM(fake, path, mode="record")
+        await recorder.ainvoke(prompt)
+        player = CassetteLLM(None, path, mode="replay")
+        start = time.perf_counter()
+        replayed = await player.ainvoke(prompt)
+        print(f"replay {time.perf_counter() - start:.4f}s, same: {replayed.content == response.content}")
+        try:
+            await player.ainvoke("User query: never recorded")
+        except CassetteMissError as e:
+            print(f"Replay miss: {e}")
+
+    asyncio.run(main())
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+from langchain_core.messages import AIMessage
+
+from fast_path import fast_path_stats
+from prompt_builder import estimate_tokens
+from rate_limiter import PRIORITY_API, PRIORITY_NAMES, RateLimiter
+from single_flight import SingleFlight
+
+# Upper bound on one LLM call, including queue wait and retries
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Retries of rate-limited or failed calls; each retry queues in the rate limiter again
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BACKOFF = 1.0
+
+# Completion size assumed when reserving tokens, corrected once the answer is in
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("EXPECTED_COMPLETION_TOKENS", "400"))
+
+# How often a waiting request checks whether its client has gone away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class LLMLatencyStats:
+    """Time to first token, total generation time and queue wait of LLM calls
+
+    Streamed calls report both; for non-streamed calls the first token
+    arrives with the full response, so only the total is recorded. Time
+    spent waiting in the rate limiter is kept apart, per priority.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.window = window
+        self.calls = 0
+        self.retries = 0
+        self.first_token = deque(maxlen=window)
+        self.total = deque(maxlen=window)
+        self.queue_wait = {name: deque(maxlen=window) for name in PRIORITY_NAMES.values()}
+
+    def record(self, total, first_token=None):
+        with self._lock:
+            self.calls += 1
+            self.total.append(total)
+            if first_token is not None:
+                self.first_token.append(first_token)
+
+    def record_queue_wait(self, priority, seconds):
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        with self._lock:
+            self.queue_wait.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @staticmethod
+    def _summary(values):
+        if not values:
+            return {"avg_s": 0.0, "p50_s": 0.0, "p95_s": 0.0}
+        ordered = sorted(values)
+        return {
+            "avg_s": round(sum(ordered) / len(ordered), 3),
+            "p50_s": round(ordered[len(ordered) // 2], 3),
+            "p95_s": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "streamed_calls": len(self.first_token),
+                "first_token": self._summary(self.first_token),
+                "total": self._summary(self.total),
+                "queue_wait": {name: self._summary(waits) for name, waits in self.queue_wait.items()}
+            }
+
+
+llm_latency_stats = LLMLatencyStats()
+
+# Identical prompts in flight at the same time share one LLM call
+llm_flights = SingleFlight("LLM")
+
+# Requests- and tokens-per-minute limits shared by every call in this process (not across processes)
+llm_rate_limiter = RateLimiter()
+
+
+class LLMTimeoutError(Exception):
+    """The LLM did not answer within the request timeout"""
+
+
+class ClientDisconnectedError(Exception):
+    """The HTTP client went away before its response was ready"""
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying a failed call, or None if it shouldn't be retried"""
+    if attempt >= LLM_MAX_RETRIES:
+        return None
+    backoff = LLM_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.8, 1.2)
+    if isinstance(error, openai.RateLimitError):
+        # The provider's limit is lower than ours or shared with other clients:
+        # hold every queued call, not just this one
+        try:
+            retry_after = float(error.response.headers.get("retry-after", 0))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 0.0
+        llm_rate_limiter.throttle(retry_after)
+        return max(retry_after, backoff)
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return backoff
+    return None
+
+
+async def rate_limited(prompt_text, call, priority=PRIORITY_API, user="anonymous", retryable=lambda: True):
+    """Await call() once the rate limiter has room, retrying transient failures
+
+    Each attempt queues in the limiter again, so retries count against the
+    same budget as new calls. retryable() says whether a failed attempt
+    may be repeated (not once streamed tokens have reached the user).
+    """
+    prompt_tokens = estimate_tokens(prompt_text)
+    estimated = prompt_tokens + EXPECTED_COMPLETION_TOKENS
+    attempt = 0
+    while True:
+        waited = await llm_rate_limiter.acquire(estimated, priority, user)
+        llm_latency_stats.record_queue_wait(priority, waited)
+        if waited >= 1.0:
+            print(f"LLM call queued {waited:.2f}s ({PRIORITY_NAMES.get(priority, priority)}, user {user})")
+        response = None
+        try:
+            response = await call()
+        except Exception as e:
+            delay = retry_delay(e, attempt) if retryable() else None
+            if delay is None:
+                raise
+            error = e
+        else:
+            return response
+        finally:
+            # Failed, timed-out and cancelled attempts are charged for the prompt only
+            used = prompt_tokens + (estimate_tokens(response.content) if response is not None else 0)
+            llm_rate_limiter.release(estimated, used)
+        attempt += 1
+        llm_latency_stats.record_retry()
+        print(f"LLM call failed ({type(error).__name__}), retry {attempt}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def ainvoke_llm(llm, prompt_text, timeout=LLM_TIMEOUT, priority=PRIORITY_API, user="anonymous"):
+    """Call the LLM through its async API, bounded by a timeout
+
+    The event loop stays free for other requests while the call is in
+    flight. Cancelling the awaiting task cancels the HTTP call as well.
+    The call waits its turn in the shared rate limiter first.
+    """
+    async def call():
+        start = time.perf_counter()
+        response = await llm.ainvoke(prompt_text)
+        elapsed = time.perf_counter() - start
+        fast_path_stats.record_llm(elapsed)
+        llm_latency_stats.record(elapsed)
+        return response
+
+    try:
+        return await asyncio.wait_for(rate_limited(prompt_text, call, priority, user), timeout)
+    except asyncio.TimeoutError:
+        raise LLMTimeoutError(f"LLM did not respond within {timeout:g}s")
+
+
+async def astream_llm(llm, prompt_text, on_token, timeout=LLM_TIMEOUT, priority=PRIORITY_API, user="anonymous"):
+    """Stream the LLM response, awaiting on_token(text) for every chunk
+
+    Returns the full response as a message, like ainvoke_llm. Time to first
+    token is what the user waits before output appears, so it is recorded
+    separately from total generation time.
+    """
+    parts = []
+
+    async def call():
+        start = time.perf_counter()
+        first_token = None
+        async for chunk in llm.astream(prompt_text):
+            if not chunk.content:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(chunk.content)
+            await on_token(chunk.content)
+        elapsed = time.perf_counter() - start
+        fast_path_stats.record_llm(elapsed)
+        llm_latency_stats.record(elapsed, first_token)
+        print(f"LLM stream: first token {first_token or 0:.2f}s, total {elapsed:.2f}s")
+        return AIMessage(content="".join(parts))
+
+    try:
+        return await asyncio.wait_for(rate_limited(prompt_text, call, priority, user, retryable=lambda: not parts), timeout)
+    except asyncio.TimeoutError:
+        raise LLMTimeoutError(f"LLM did not finish within {timeout:g}s")
+
+
+def prompt_key(llm, prompt_text):
+    """Key identical prompts sent to the same model"""
+    model = getattr(llm, "model_name", type(llm).__name__)
+    return hashlib.sha256(f"{model}\0{prompt_text}".encode("utf-8")).hexdigest()[:16]
+
+
+async def ainvoke_llm_shared(llm, prompt_text, label=None, timeout=LLM_TIMEOUT, priority=PRIORITY_API, user="anonymous"):
+    """ainvoke_llm, sharing one call among concurrent identical prompts
+
+    The shared call is queued with the priority and user of the caller
+    that started it.
+    """
+    return await llm_flights.run(
+        prompt_key(llm, prompt_text), lambda: ainvoke_llm(llm, prompt_text, timeout, priority, user), label
+    )
+
+
+async def astream_llm_shared(llm, prompt_text, on_token, label=None, timeout=LLM_TIMEOUT, priority=PRIORITY_API, user="anonymous"):
+    """astream_llm, sharing one call among concurrent identical prompts
+
+    Tokens go to the caller that started the call; callers that join it
+    get the full response when it completes.
+    """
+    return await llm_flights.run(
+        prompt_key(llm, prompt_text), lambda: astream_llm(llm, prompt_text, on_token, timeout, priority, user), label
+    )
+
+
+async def cancel_on_disconnect(request, coroutine, poll_interval=DISCONNECT_POLL_INTERVAL):
+    """Await a coroutine, cancelling it if the client disconnects first"""
+    task = asyncio.ensure_future(coroutine)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("Client disconnected, cancelling request")
+                raise ClientDisconnectedError()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+if __name__ == "__main__":
+    # Test code
+    from types import SimpleNamespace
+
+    import httpx
+
+    class SlowLLM:
+        def __init__(self, delay):
+            self.delay = delay
+
+        async def ainvoke(self, prompt_text):
+            await asyncio.sleep(self.delay)
+            return SimpleNamespace(content=prompt_text.upper())
+
+        async def astream(self, prompt_text):
+            await asyncio.sleep(self.delay)
+            for word in prompt_text.upper().split():
+                await asyncio.sleep(self.delay / 10)
+                yield SimpleNamespace(content=word + " ")
+
+    async def main():
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(ainvoke_llm(SlowLLM(0.2), f"prompt {i}") for i in range(50)))
+        print(f"50 concurrent calls: {time.perf_counter() - start:.2f}s, last: {responses[-1].content}")
+        try:
+            await ainvoke_llm(SlowLLM(1.0), "slow", timeout=0.1)
+        except LLMTimeoutError as e:
+            print(f"Timeout: {e}")
+
+        async def on_token(text):
+            pass
+
+        streamed = await astream_llm(SlowLLM(0.2), "a streamed prompt of several words", on_token)
+        print(f"Streamed: {streamed.content!r}")
+
+        class FlakyLLM(SlowLLM):
+            failures = 2
+
+            async def ainvoke(self, prompt_text):
+                if self.failures:
+                    self.failures -= 1
+                    raise openai.APIConnectionError(request=httpx.Request("POST", "http://llm"))
+                return await super().ainvoke(prompt_text)
+
+        global LLM_RETRY_BACKOFF
+        LLM_RETRY_BACKOFF = 0.05
+        print(f"After retries: {(await ainvoke_llm(FlakyLLM(0.1), 'flaky')).content}")
+        print(llm_latency_stats.snapshot())
+
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+# Local stand-in for the OpenAI chat completions API
+FAKE_LLM_PORT = 8765
+APP_PORT = 8766
+
+FAKE_COMPLETION = {
+    "query": "query ($filter: JSON) {\n  subject(accessibility: accessible, offset: 0, first: 20, filter: $filter) {\n    consortium\n    subject_submitter_id\n    sex\n  }\n}",
+    "variables": {"filter": {"IN": {"consortium": ["INRG"]}}},
+    "explanation": "Subjects in the INRG consortium."
+}
+
+fake_llm = FastAPI()
+fake_llm_delay = 1.0
+
+
+def fake_chunk(body, delta, finish_reason=None):
+    chunk = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def fake_stream(body, content):
+    """Server-sent events: the first token after a fifth of the delay, the rest spread over the remainder"""
+    await asyncio.sleep(fake_llm_delay / 5)
+    yield fake_chunk(body, {"role": "assistant", "content": ""})
+    pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+    for piece in pieces:
+        yield fake_chunk(body, {"content": piece})
+        await asyncio.sleep(fake_llm_delay * 0.8 / len(pieces))
+    yield fake_chunk(body, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+@fake_llm.post("/v1/chat/completions")
+async def fake_chat_completion(body: dict):
+    if body.get("stream"):
+        return StreamingResponse(fake_stream(body, json.dumps(FAKE_COMPLETION)), media_type="text/event-stream")
+    await asyncio.sleep(fake_llm_delay)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(FAKE_COMPLETION)},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+def start_server(app, port):
+    """Run a uvicorn server in a background thread and wait until it accepts requests"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(target, total, concurrency, elapsed, latencies, failures):
+    print(f"{target}: {total} requests, concurrency {concurrency}: {elapsed:.2f}s total, {total / elapsed:.1f} req/s, {failures} failed")
+    print(f"latency p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s, max {max(latencies):.2f}s")
+    print(f"serial lower bound would be {total * fake_llm_delay:.1f}s")
+
+
+async def run_load(total, concurrency):
+    """Send total /convert requests, at most concurrency at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one_request(client, i):
+        nonlocal failures
+        # Questions the fast path doesn't answer, so every request reaches the LLM
+        text = f"How many diseases are represented within the data portal? (run {i})"
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"http://127.0.0.1:{APP_PORT}/convert", json={"text": text})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request(client, i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    report("/convert", total, concurrency, elapsed, latencies, failures)
+
+
+async def run_chainlit_load(total, concurrency):
+    """Drive the Chainlit message handler directly, one session per message"""
+    import chainlit as cl
+    from chainlit.context import init_http_context
+    import chainlit_app
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one_message(i):
+        nonlocal failures
+        text = f"What are the INRGSS stages represented within the data portal? (run {i})"
+        async with semaphore:
+            # Each task gets its own Chainlit context and user session
+            init_http_context()
+            cl.user_session.set("session_id", f"load-test-{i}")
+            start = time.perf_counter()
+            try:
+                await chainlit_app.main(cl.Message(content=text))
+            except Exception as e:
+                print(f"Message {i} failed: {str(e)}")
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_message(i) for i in range(total)))
+    report("chainlit main", total, concurrency, time.perf_counter() - start, latencies, failures)
+
+
+async def check_disconnect():
+    """Drop a request mid-flight; the server should cancel its LLM call"""
+    try:
+        async with httpx.AsyncClient(timeout=fake_llm_delay / 4) as client:
+            await client.post(f"http://127.0.0.1:{APP_PORT}/convert", json={"text": "How many diseases are represented? (disconnect)"})
+    except httpx.TimeoutException:
+        print("Client gave up early; the server should log that it cancelled the request")
+    await asyncio.sleep(1.0)
+
+
+async def check_streaming():
+    """Stream one completion and report time to first token against total time"""
+    from llm_backends import create_llm
+    from llm_client import astream_llm
+    from stream_parser import StreamingResultParser
+
+    parser = StreamingResultParser()
+    updates = 0
+
+    async def on_token(text):
+        nonlocal updates
+        updates += parser.feed(text)
+
+    response = await astream_llm(create_llm(model="gpt-3.5-turbo", temperature=0), "User query: stream test", on_token)
+    print(f"Streamed {len(response.content)} chars, {updates} parser updates, complete fields: {sorted(parser.complete)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the converter against a local fake LLM")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=1.0, help="Fake LLM latency in seconds")
+    parser.add_argument("--backend", choices=["http", "fake"], default="http",
+                        help="http: the OpenAI client against a local fake server; fake: the in-process fixture backend")
+    parser.add_argument("--target", choices=["api", "chainlit"], default="api",
+                        help="api: /convert over HTTP; chainlit: the Chainlit message handler")
+    args = parser.parse_args()
+    fake_llm_delay = args.delay
+
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("SCHEMA_WATCH_INTERVAL", "0")
+    if args.backend == "http":
+        # Point the app's OpenAI client at the fake server before it is created
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{FAKE_LLM_PORT}/v1"
+        start_server(fake_llm, FAKE_LLM_PORT)
+    else:
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["FAKE_LLM_LATENCY"] = str(args.delay)
+    # Keep benchmark answers out of the real caches and ChromaDB
+    benchmark_dir = tempfile.mkdtemp(prefix="load-test-")
+    os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(benchmark_dir, "responses.sqlite"))
+    os.environ.setdefault("CHROMA_PERSIST_DIRECTORY", os.path.join(benchmark_dir, "chroma_db"))
+
+    if args.target == "api":
+        from app import app
+        start_server(app, APP_PORT)
+        asyncio.run(run_load(args.requests, args.concurrency))
+        asyncio.run(check_disconnect())
+    else:
+        asyncio.run(run_chainlit_load(args.requests, args.concurrency))
+    asyncio.run(check_streaming())
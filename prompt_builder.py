@@ -1,10 +1,131 @@
 import json
+import os
+import re
 
-def create_enhanced_prompt(user_query, schema_info, conversation_history=None):
+from schema_model import PropertySpec, property_type_label, schema_json_default
+
+# Approximate token budget for the schema section of a prompt; "0" or "none" disables compaction
+_schema_token_budget = os.getenv("SCHEMA_TOKEN_BUDGET", "1500").strip().lower()
+SCHEMA_TOKEN_BUDGET = None if _schema_token_budget in ("", "0", "none") else int(_schema_token_budget)
+
+# Bump when a prompt template changes so cached responses are not reused
+PROMPT_TEMPLATE_VERSION = "2"
+
+# Enum values listed per property before the list is shortened
+MAX_ENUM_VALUES = 8
+
+SCHEMA_LEGEND = "(one line per property: `name: type`; `enum(a|b|...)` lists allowed values, `+N more` marks omitted ones)"
+
+def estimate_tokens(text):
+    """Roughly estimate token count (about 4 characters per token for English/JSON)"""
+    return len(text) // 4 + 1
+
+def _normalize(text):
+    return " " + " ".join(re.findall(r"\w+", str(text).lower())) + " "
+
+def _property_type(details):
+    """Get a short type label for a property spec or resolved property dict"""
+    return details.type if isinstance(details, PropertySpec) else property_type_label(details)
+
+def _format_property(prop, details, query_norm, max_enum_values):
+    """Format one property in dense notation, keeping enum values matched by the query"""
+    if isinstance(details, PropertySpec):
+        enum_values = details.enum
+    else:
+        enum_values = details.get("enum") if isinstance(details, dict) else None
+    if not enum_values:
+        return f"{prop}: {_property_type(details)}"
+    
+    matched = [value for value in enum_values if _normalize(value) in query_norm]
+    shown = matched + [value for value in enum_values if value not in matched][:max(max_enum_values - len(matched), 0)]
+    omitted = len(enum_values) - len(shown)
+    more = f" +{omitted} more" if omitted else ""
+    return f"{prop}: enum({'|'.join(str(value) for value in shown)}{more})"
+
+def _render_schema(schema_info, query_norm, max_enum_values):
+    lines = []
+    for node, properties in schema_info.items():
+        lines.append(f"{node}:")
+        for prop, details in (properties or {}).items():
+            lines.append("  " + _format_property(prop, details, query_norm, max_enum_values))
+    return "\n".join(lines)
+
+def compact_schema(schema_info, user_query="", token_budget=SCHEMA_TOKEN_BUDGET):
+    """Compact a schema slice into dense notation within a token budget
+    
+    Descriptions are dropped and long enums keep the values mentioned in the
+    query. If the result is still over budget, enums are shortened further and
+    then trailing properties are dropped, starting from the last (lowest
+    ranked) node. Returns (schema_str, stats).
+    """
+    original_tokens = estimate_tokens(json.dumps(schema_info, indent=2, default=schema_json_default))
+    query_norm = _normalize(user_query)
+    
+    schema_str = ""
+    for max_enum_values in (MAX_ENUM_VALUES, 3, 0):
+        schema_str = _render_schema(schema_info, query_norm, max_enum_values)
+        if estimate_tokens(schema_str) <= token_budget:
+            break
+    
+    dropped = 0
+    if estimate_tokens(schema_str) > token_budget:
+        trimmed = {node: dict(properties or {}) for node, properties in schema_info.items()}
+        for node in reversed(list(trimmed)):
+            while trimmed[node] and estimate_tokens(schema_str) > token_budget:
+                trimmed[node].popitem()
+                dropped += 1
+                schema_str = _render_schema(trimmed, query_norm, 0)
+    
+    compact_tokens = estimate_tokens(schema_str)
+    stats = {
+        "original_tokens": original_tokens,
+        "compact_tokens": compact_tokens,
+        "ratio": round(compact_tokens / original_tokens, 3) if original_tokens else 1.0,
+        "dropped_properties": dropped
+    }
+    return schema_str, stats
+
+def format_schema_info(schema_info, user_query, token_budget, compaction_stats=None):
+    """Format schema information for the prompt, compacting it unless token_budget is None"""
+    if token_budget is None:
+        return json.dumps(schema_info, indent=2, default=schema_json_default)
+    
+    schema_str, stats = compact_schema(schema_info, user_query, token_budget)
+    print(f"Schema compaction: {stats['original_tokens']} -> {stats['compact_tokens']} tokens "
+          f"(ratio {stats['ratio']:.3f}, dropped {stats['dropped_properties']} properties)")
+    if compaction_stats is not None:
+        compaction_stats.update(stats)
+    return f"{SCHEMA_LEGEND}\n{schema_str}"
+
+def format_nested_paths(nested_paths):
+    """Format node nesting paths under subject for the prompt"""
+    if not nested_paths:
+        return ""
+    
+    lines = [f"- {node}: {'.'.join(path) if path else 'subject'}" for node, path in nested_paths.items()]
+    return """
+Nesting paths under subject (use these exact field names for nested selections and as `nested` filter paths):
+""" + "\n".join(lines) + "\n"
+
+def format_detected_values(detected_values):
+    """Format enum values found in the query for the prompt"""
+    if not detected_values:
+        return ""
+    
+    lines = []
+    for node, properties in detected_values.items():
+        for prop, values in properties.items():
+            lines.append(f"- {node}.{prop}: {', '.join(values)}")
+    return """
+Enum values mentioned in the query (use these exact values in filters):
+""" + "\n".join(lines) + "\n"
+
+def create_enhanced_prompt(user_query, schema_info, conversation_history=None, nested_paths=None, detected_values=None,
+                           token_budget=SCHEMA_TOKEN_BUDGET, compaction_stats=None):
     """Create enhanced prompt template"""
     
     # Format schema information as string
-    schema_str = json.dumps(schema_info, indent=2)
+    schema_str = format_schema_info(schema_info, user_query, token_budget, compaction_stats)
     
     # Add conversation history
     history_str = ""
@@ -14,6 +135,12 @@ Conversation history:
 {conversation_history}
 """
     
+    # Add precomputed nesting paths so the hierarchy is not guessed
+    nested_str = format_nested_paths(nested_paths)
+    
+    # Add enum values already matched against the schema
+    values_str = format_detected_values(detected_values)
+    
     # Build prompt template
     template = f"""You are a professional GraphQL query converter. Please convert the user's natural language query into the corresponding GraphQL query.
 
@@ -21,7 +148,7 @@ User query: {user_query}
 
 PCDC Schema information:
 {schema_str}
-{history_str}
+{nested_str}{values_str}{history_str}
 Please construct the GraphQL query according to the following structure:
 1. Use variables like `$filter` for dynamic parameterization
 2. Use operators such as `AND`, `IN`, `GTE`, `LTE` to build complex filter conditions
@@ -30,6 +157,8 @@ Please construct the GraphQL query according to the following structure:
 5. Always use subject as the root node, with other entities nested within it to maintain relationships
 6. Return both the query and variables separately
 
+Ages such as age_at_censor_status are in days: 0-18 years of age is 0 to 6939 days.
+
 Example for a simple query "Subjects who are multiracial and between 0-18 years of age":
 
 query ($filter: JSON) {{
@@ -46,7 +175,7 @@ Variables:
 {{ "filter": {{ "AND": [
       {{ "IN": {{ "race": ["Multiracial"] }}}},
       {{ "AND": [{{"GTE": {{"age_at_censor_status": 0}}}}, 
-                {{"LTE": {{"age_at_censor_status": 18}}}}]}}
+                {{"LTE": {{"age_at_censor_status": 6939}}}}]}}
     ]
 }}}}
 
@@ -59,15 +188,15 @@ query ($filter: JSON) {{
     sex
     race
     ethnicity
-    lab_results {{
-      lab_test_name
-      lab_result_value
+    labs {{
+      lab_test
+      lab_result_numeric
       lab_result_unit
     }}
     disease_characteristics {{
-      disease_phase
-      disease_type
-      primary_site
+      disease_site
+      bulk_disease
+      detection_method
     }}
   }}
 }}
@@ -76,7 +205,7 @@ Variables:
 {{ "filter": {{ "AND": [
       {{ "IN": {{ "race": ["Multiracial"] }}}},
       {{ "AND": [{{"GTE": {{"age_at_censor_status": 0}}}}, 
-                {{"LTE": {{"age_at_censor_status": 18}}}}]}}
+                {{"LTE": {{"age_at_censor_status": 6939}}}}]}}
     ]
 }}}}
 
@@ -89,11 +218,12 @@ Please return the result in JSON format, including the following fields:
     
     return template
 
-def create_nested_query_prompt(user_query, schema_info, node_type, conversation_history=None):
+def create_nested_query_prompt(user_query, schema_info, node_type, conversation_history=None,
+                               token_budget=SCHEMA_TOKEN_BUDGET, compaction_stats=None):
     """Create nested query prompt template"""
     
     # Format schema information as string
-    schema_str = json.dumps(schema_info, indent=2)
+    schema_str = format_schema_info(schema_info, user_query, token_budget, compaction_stats)
     
     # Add conversation history
     history_str = ""
@@ -130,7 +260,7 @@ query ($filter: JSON) {{
     sex
     race
     ethnicity
-    histologies {{
+    histologys {{
       histology_grade
     }}
   }}
@@ -142,7 +272,7 @@ Variables:
     "AND": [
       {{
         "nested": {{
-          "path": "histologies",
+          "path": "histologys",
           "AND": [{{"IN": {{"histology_grade": ["Differentiating"]}}}}]
         }}
       }}
@@ -159,6 +289,36 @@ Please return the result in JSON format, including the following fields:
     
     return template
 
+# Labels of the result parts a repair prompt can carry
+REPAIR_FRAGMENT_LABELS = {"query": "GraphQL query", "variables": "Variables", "response": "Model output"}
+
+def create_repair_prompt(user_query, fragment, errors, hints=None):
+    """Create a prompt asking to fix only the broken parts of a generated result
+    
+    fragment maps "query", "variables" or "response" (raw output nothing
+    could be read from) to its text. No schema or history is sent; hints
+    carry the few schema facts the errors need.
+    """
+    parts_str = "\n\n".join(f"{REPAIR_FRAGMENT_LABELS[name]}:\n{text}" for name, text in fragment.items())
+    errors_str = "\n".join(f"- {error}" for error in errors)
+    hints_str = ""
+    if hints:
+        hints_str = "\nSchema hints:\n" + "\n".join(f"- {hint}" for hint in hints) + "\n"
+    fields = [name for name in ("query", "variables") if name in fragment] or ["query", "variables"]
+    fields_str = " and ".join(f'"{name}"' for name in fields)
+    
+    return f"""You generated a GraphQL query for the PCDC data portal, but part of it is broken. Fix only what the errors below describe and keep everything else unchanged.
+
+User query: {user_query}
+
+{parts_str}
+
+Errors:
+{errors_str}
+{hints_str}
+Return only a JSON object with the field(s) {fields_str}; variables must be a JSON object.
+"""
+
 if __name__ == "__main__":
     # Test code
     test_schema = {
@@ -179,7 +339,25 @@ if __name__ == "__main__":
     # Test nested query prompt
     nested_prompt = create_nested_query_prompt(
         "Query subjects with histology grade of Differentiating", 
-        {"subject": test_schema["subject"], "histologies": {"histology_grade": None}},
-        "histologies"
+        {"subject": test_schema["subject"], "histologys": {"histology_grade": None}},
+        "histology"
+    )
+    print("\n\n" + nested_prompt)
+    
+    repair_prompt = create_repair_prompt(
+        test_query,
+        {"variables": '{"filter": {"IN": {"race": ["Multiracal"]}}}'},
+        ["Invalid value 'Multiracal' for 'subject.race'"],
+        ["Allowed values for 'subject.race' close to 'Multiracal': Multiracial"]
     )
-    print("\n\n" + nested_prompt) 
\ No newline at end of file
+    print(f"\n\n{repair_prompt}\nRepair prompt: ~{estimate_tokens(repair_prompt)} tokens, full prompt: ~{estimate_tokens(prompt)} tokens")
+    
+    # Test compaction on a real schema slice
+    from schema_parser import extract_relevant_schema
+    from schema_snapshot import load_pcdc_schema
+    
+    node_properties, term_mappings = load_pcdc_schema("pcdc-schema-prod-20250114.json")
+    for query in ["Which adverse events of grade 3 were reported?", "Patients in the INRG consortium with Ann Arbor Stage II disease"]:
+        relevant_schema = extract_relevant_schema(query, node_properties)
+        schema_str, stats = compact_schema(relevant_schema, query)
+        print(f"\n{query}\n{stats}\n{schema_str[:600]}") 
\ No newline at end of file
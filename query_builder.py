@@ -1,6 +1,12 @@
 import json
 import re
 
+from filter_ast import And, extract_filter, normalize_filter, parse_filter
+from query_validator import GraphQLSyntaxError, parse_graphql_query
+
+# Node types checked when no schema graph is available
+DEFAULT_NODE_TYPES = ["subject", "disease_characteristic", "staging", "lab", "vital", "medical_history"]
+
 def build_graphql_filter(criteria):
     """Build GraphQL filter based on criteria"""
     filters = []
@@ -58,9 +64,26 @@ def extract_query_conditions(query):
     
     return conditions
 
+def build_nested_selection(fields, nested_path):
+    """Wrap node fields in the selection path that nests them under subject"""
+    selection = "\n".join(fields)
+    for field in reversed(nested_path):
+        selection = f"{field} {{\n  " + selection.replace("\n", "\n  ") + "\n}"
+    return selection
+
+def build_nested_filter(node_filter, nested_path):
+    """Wrap a node-level filter in nested blocks for each level of its path"""
+    if not nested_path:
+        return node_filter
+    
+    nested_filter = node_filter
+    for depth in range(len(nested_path), 0, -1):
+        nested_filter = {"nested": {"path": ".".join(nested_path[:depth]), "AND": [nested_filter]}}
+    return nested_filter
+
 def build_graphql_query(fields, filter_var="$filter"):
     """Build GraphQL query"""
-    fields_str = "\n    ".join(fields)
+    fields_str = "\n    ".join(field.replace("\n", "\n    ") for field in fields)
     query = f"""query ({filter_var}: JSON) {{
   subject(accessibility: accessible, offset: 0, first: 20, filter: {filter_var}) {{
     {fields_str}
@@ -68,11 +91,20 @@ def build_graphql_query(fields, filter_var="$filter"):
 }}"""
     return query
 
-def analyze_query_complexity(query):
+def find_mentioned_nodes(query, node_types):
+    """Find node types mentioned in the query, accepting spaces for underscores"""
+    query_lower = query.lower()
+    return [
+        node for node in node_types
+        if node in query_lower or node.replace("_", " ") in query_lower
+    ]
+
+def analyze_query_complexity(query, node_types=None):
     """Analyze query complexity"""
     # Check if multiple node types are involved
-    node_types = ["subject", "disease_characteristic", "staging", "lab", "vital", "medical_history"]
-    node_count = sum(1 for node in node_types if node in query.lower())
+    if node_types is None:
+        node_types = DEFAULT_NODE_TYPES
+    node_count = len(find_mentioned_nodes(query, node_types))
     
     # Check if complex conditions are present
     complex_conditions = ["and", "or", "not", "greater than", "less than", "between"]
@@ -83,23 +115,22 @@ def analyze_query_complexity(query):
     else:
         return "simple"
 
-def decompose_query(query):
+def decompose_query(query, schema_graph=None):
     """Decompose complex query into multiple related parts
     
     Instead of creating separate independent queries, this creates a structured 
     representation of a single query with multiple nested parts, ensuring the 
     results are related through subject IDs.
+    
+    When a schema graph is given, every schema node is considered and the
+    nesting path of each related node under subject is included.
     """
     # Identify the main query parts
-    node_types = ["subject", "disease_characteristic", "staging", "lab", "vital", "medical_history"]
+    node_types = schema_graph.nodes if schema_graph else DEFAULT_NODE_TYPES
     
     # Always start with subject as the primary node if complex query involves multiple entities
     primary_node = "subject"
-    related_nodes = []
-    
-    for node_type in node_types:
-        if node_type != "subject" and node_type in query.lower():
-            related_nodes.append(node_type)
+    related_nodes = [node for node in find_mentioned_nodes(query, node_types) if node != primary_node]
     
     # Format a query that ensures relationships are maintained
     # The primary query will be for subjects with the filtering conditions
@@ -110,32 +141,121 @@ def decompose_query(query):
         "full_query": query  # Keep the original query for context
     }
     
+    if schema_graph:
+        query_parts["nested_paths"] = {
+            node: list(schema_graph.nested_path(node, primary_node) or [])
+            for node in related_nodes
+        }
+    
     return query_parts
 
-def combine_results(results, original_query):
-    """Process results maintaining relationships between entities
+def build_sub_queries(query_parts):
+    """Split decomposed query parts into one sub-query per node
+    
+    The primary node keeps the full query; each related node gets its own
+    sub-query carrying its nesting path under the primary node.
+    """
+    nested_paths = query_parts.get("nested_paths", {})
+    sub_queries = [{"node": query_parts["primary_node"], "query": query_parts["full_query"], "nested_path": []}]
+    for node in query_parts["related_nodes"]:
+        sub_queries.append({
+            "node": node,
+            "query": query_parts["full_query"],
+            "nested_path": nested_paths.get(node, [])
+        })
+    return sub_queries
+
+def _render_value(value):
+    """Render a parsed argument value back to GraphQL syntax"""
+    if isinstance(value, tuple):
+        return f"${value[1]}" if value[0] == "$" else value[1]
+    if isinstance(value, list):
+        return "[" + ", ".join(_render_value(item) for item in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key}: {_render_value(item)}" for key, item in value.items()) + "}"
+    return json.dumps(value)
+
+def _render_field(field):
+    """Render a parsed field and its selections as GraphQL lines"""
+    text = f"{field['alias']}: {field['name']}" if field["alias"] else field["name"]
+    if field["args"]:
+        text += "(" + ", ".join(f"{key}: {_render_value(value)}" for key, value in field["args"].items()) + ")"
+    if field["selections"]:
+        inner = "\n".join(_render_field(child) for child in field["selections"])
+        text += " {\n  " + inner.replace("\n", "\n  ") + "\n}"
+    return text
+
+def merge_selections(target, selections):
+    """Union selections into target, merging fields with the same response key"""
+    by_key = {field["alias"] or field["name"]: field for field in target}
+    for field in selections:
+        key = field["alias"] or field["name"]
+        if key not in by_key:
+            by_key[key] = {**field, "selections": []}
+            target.append(by_key[key])
+        merge_selections(by_key[key]["selections"], field["selections"])
+    return target
+
+def combine_results(results, original_query, root="subject"):
+    """Merge sub-query results into one query on the root node
     
-    Instead of simply merging separate results, this ensures that relationships
-    between entities are maintained by focusing on the hierarchical structure
-    of the query.
+    Selection sets under the root are unioned (fields with the same name are
+    merged recursively, so nested nodes collect all their requested fields)
+    and the filters are ANDed and normalized into one filter, the only
+    variable of the combined query. Results that are not parseable queries
+    on the root are skipped.
     """
-    # In the improved implementation, the results should already be structured correctly
-    # with the primary node (usually subject) containing nested related nodes
+    valid = [result for result in results or [] if isinstance(result, dict) and result.get("query")]
+    if len(valid) == 1:
+        return valid[0]
     
-    # For now, we'll just take the first result if available since that should
-    # contain the properly structured data
-    if results and len(results) > 0:
-        primary_result = results[0]
+    selections = []
+    filters = []
+    explanations = []
+    merged_count = 0
+    for result in valid:
+        try:
+            _, fields = parse_graphql_query(result["query"])
+        except GraphQLSyntaxError as e:
+            print(f"Skipping sub-query result with invalid GraphQL: {str(e)}")
+            continue
+        root_fields = [field for field in fields if field["name"] == root]
+        if not root_fields:
+            print(f"Skipping sub-query result without a {root} root field")
+            continue
+        
+        for field in root_fields:
+            merge_selections(selections, field["selections"])
         
-        # Check if we have a proper GraphQL query in the result
-        if isinstance(primary_result, dict) and "query" in primary_result:
-            return primary_result
+        variables = result.get("variables") or {}
+        if isinstance(variables, str):
+            try:
+                variables = json.loads(variables) if variables.strip() else {}
+            except json.JSONDecodeError:
+                variables = {}
+        filter_value = extract_filter(variables)
+        if isinstance(filter_value, dict) and filter_value:
+            filters.append(parse_filter(filter_value))
+        if result.get("explanation"):
+            explanations.append(result["explanation"])
+        merged_count += 1
+    
+    if merged_count == 0:
+        # Fallback to empty result structure if no valid results
+        return {
+            "query": "",
+            "variables": {},
+            "explanation": "No valid query could be generated."
+        }
     
-    # Fallback to empty result structure if no valid results
+    # The rebuilt operation declares only $filter, so other variables are dropped
+    combined_filter = normalize_filter(And(filters)).to_dict() if filters else {}
+    if combined_filter == {"AND": []}:
+        combined_filter = {}
     return {
-        "query": "",
-        "variables": {},
-        "explanation": "No valid query could be generated."
+        "query": build_graphql_query([_render_field(field) for field in selections]),
+        "variables": {"filter": combined_filter},
+        "explanation": " ".join(explanations) or f"Combined query for: {original_query}"
     }
 
 if __name__ == "__main__":
@@ -156,4 +276,20 @@ if __name__ == "__main__":
     
     if complexity == "complex":
         query_parts = decompose_query(test_query)
-        print(f"Decomposed query parts: {query_parts}") 
\ No newline at end of file
+        print(f"Decomposed query parts: {query_parts}")
+        print(f"Sub-queries: {[sub_query['node'] for sub_query in build_sub_queries(query_parts)]}")
+    
+    # Test merging a subject sub-result with a nested node sub-result
+    merged = combine_results([
+        {"query": query, "variables": json.dumps(filter_json), "explanation": "Multiracial subjects aged 0-18."},
+        {"query": build_graphql_query(["subject_submitter_id", build_nested_selection(["lab_test"], ["labs"])]),
+         "variables": {"filter": build_nested_filter({"IN": {"lab_test": ["LDH"]}}, ["labs"])},
+         "explanation": "Their LDH labs."}
+    ], test_query)
+    print(f"Merged query: {merged['query']}")
+    print(f"Merged variables: {json.dumps(merged['variables'])}")
+    
+    # Test nested selection and filter for a node two levels below subject
+    nested_path = ["timings", "labs"]
+    print(build_graphql_query(fields[:2] + [build_nested_selection(["lab_test_name", "lab_result_value"], nested_path)]))
+    print(json.dumps(build_nested_filter({"IN": {"lab_test_name": ["LDH"]}}, nested_path), indent=2)) 
\ No newline at end of file
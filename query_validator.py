@@ -0,0 +1,438 @@
+import json
+import re
+import time
+
+ROOT_NODE = "subject"
+
+# Nodes whose fields are selectable and filterable directly on subject
+FLAT_NODES = ("subject", "person")
+
+# Fields the subject index exposes beyond the schema properties
+EXTRA_ROOT_FIELDS = {"subject_submitter_id"}
+
+# Meta fields accepted on any node
+META_FIELDS = {"__typename", "_totalCount"}
+
+ROOT_ARGUMENTS = {"accessibility", "offset", "first", "filter", "sort", "format"}
+ACCESSIBILITY_VALUES = {"accessible", "unaccessible", "all"}
+
+LOGICAL_OPERATORS = {"AND", "OR", "and", "or"}
+VALUE_OPERATORS = {"IN", "in", "=", "eq", "EQ", "!=", "ne", "NE"}
+RANGE_OPERATORS = {"GT", "GTE", "LT", "LTE", "gt", "gte", "lt", "lte", ">", ">=", "<", "<="}
+NESTED_OPERATOR = "nested"
+
+NUMERIC_TYPES = {"number", "integer"}
+
+_TOKEN_RE = re.compile(r'''
+    (?P<skip>[\s,]+|\#[^\n]*)
+  | (?P<spread>\.\.\.)
+  | (?P<punct>[{}():!$\[\]=@])
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+''', re.VERBOSE)
+
+
+class GraphQLSyntaxError(Exception):
+    """Raised when a generated query cannot be parsed"""
+    pass
+
+
+def tokenize_graphql(text):
+    """Split a GraphQL document into (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        match = _TOKEN_RE.match(text, pos)
+        if not match:
+            raise GraphQLSyntaxError(f"Unexpected character {text[pos]!r} at offset {pos}")
+        kind = match.lastgroup
+        if kind != "skip":
+            tokens.append((kind, match.group()))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser for the query subset the converter generates
+
+    Produces fields as {"name", "alias", "args", "selections"} dicts.
+    Argument values are parsed into Python values, with variables kept as
+    ("$", name) tuples and enum literals as ("enum", name) tuples.
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize_graphql(text)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, value=None, kind=None):
+        token = self.peek()
+        if (value is not None and token[1] != value) or (kind is not None and token[0] != kind):
+            expected = value or kind
+            raise GraphQLSyntaxError(f"Expected {expected!r} but found {token[1]!r}")
+        self.pos += 1
+        return token[1]
+
+    def parse_document(self):
+        variables = {}
+        if self.peek()[1] in ("query", "mutation", "subscription"):
+            operation = self.take()
+            if operation != "query":
+                raise GraphQLSyntaxError(f"Only queries are supported, found {operation}")
+            if self.peek()[0] == "name":
+                self.take()
+            if self.peek()[1] == "(":
+                variables = self.parse_variable_definitions()
+        elif self.peek()[1] == "fragment":
+            raise GraphQLSyntaxError("Fragments are not supported")
+
+        selections = self.parse_selection_set()
+        if self.peek()[0] is not None:
+            raise GraphQLSyntaxError(f"Unexpected {self.peek()[1]!r} after the query")
+        return variables, selections
+
+    def parse_variable_definitions(self):
+        variables = {}
+        self.take("(")
+        while self.peek()[1] != ")":
+            self.take("$")
+            name = self.take(kind="name")
+            self.take(":")
+            var_type = self.parse_type()
+            if self.peek()[1] == "=":
+                self.take("=")
+                self.parse_value()
+            variables[name] = var_type
+        self.take(")")
+        return variables
+
+    def parse_type(self):
+        if self.peek()[1] == "[":
+            self.take("[")
+            inner = self.parse_type()
+            self.take("]")
+            var_type = f"[{inner}]"
+        else:
+            var_type = self.take(kind="name")
+        if self.peek()[1] == "!":
+            self.take("!")
+            var_type += "!"
+        return var_type
+
+    def parse_selection_set(self):
+        self.take("{")
+        selections = []
+        while self.peek()[1] != "}":
+            if self.peek()[0] is None:
+                raise GraphQLSyntaxError("Unclosed selection set")
+            if self.peek()[0] == "spread":
+                raise GraphQLSyntaxError("Fragments are not supported")
+            selections.append(self.parse_field())
+        self.take("}")
+        return selections
+
+    def parse_field(self):
+        name = self.take(kind="name")
+        alias = None
+        if self.peek()[1] == ":":
+            self.take(":")
+            alias, name = name, self.take(kind="name")
+
+        args = {}
+        if self.peek()[1] == "(":
+            self.take("(")
+            while self.peek()[1] != ")":
+                arg_name = self.take(kind="name")
+                self.take(":")
+                args[arg_name] = self.parse_value()
+            self.take(")")
+
+        while self.peek()[1] == "@":
+            # Directives are accepted and ignored
+            self.take("@")
+            self.take(kind="name")
+            if self.peek()[1] == "(":
+                depth = 0
+                while True:
+                    value = self.take()
+                    depth += value == "("
+                    depth -= value == ")"
+                    if depth == 0:
+                        break
+
+        selections = self.parse_selection_set() if self.peek()[1] == "{" else []
+        return {"name": name, "alias": alias, "args": args, "selections": selections}
+
+    def parse_value(self):
+        kind, value = self.peek()
+        if value == "$":
+            self.take("$")
+            return ("$", self.take(kind="name"))
+        if value == "[":
+            self.take("[")
+            items = []
+            while self.peek()[1] != "]":
+                items.append(self.parse_value())
+            self.take("]")
+            return items
+        if value == "{":
+            self.take("{")
+            fields = {}
+            while self.peek()[1] != "}":
+                key = self.take(kind="name")
+                self.take(":")
+                fields[key] = self.parse_value()
+            self.take("}")
+            return fields
+        self.pos += 1
+        if kind == "string":
+            return json.loads(value)
+        if kind == "number":
+            return float(value) if any(c in value for c in ".eE") else int(value)
+        if kind == "name":
+            return {"true": True, "false": False, "null": None}.get(value, ("enum", value))
+        raise GraphQLSyntaxError(f"Unexpected value {value!r}")
+
+
+def parse_graphql_query(text):
+    """Parse a query into (variable definitions, root fields)"""
+    return _Parser(text).parse_document()
+
+
+class _NodeScope:
+    """Precompiled field information for one selectable level"""
+
+    __slots__ = ("node", "fields", "enums", "numeric", "nested")
+
+    def __init__(self, node, properties_by_node, nested):
+        self.node = node
+        self.fields = set()
+        self.enums = {}
+        self.numeric = set()
+        for properties in properties_by_node:
+            for prop, spec in properties.items():
+                if spec.is_link:
+                    continue
+                self.fields.add(prop)
+                if spec.enum:
+                    self.enums[prop] = frozenset(spec.enum)
+                if set(spec.type.split("|")) & NUMERIC_TYPES:
+                    self.numeric.add(prop)
+        self.nested = nested
+
+
+class QueryValidator:
+    """Validate generated queries and filter variables against the schema
+
+    Field names, nested fields and enum sets are compiled into per-node
+    scopes once per schema version, so validating a query is a tokenizer
+    pass plus dict and set lookups.
+    """
+
+    def __init__(self, node_properties, graph, root=ROOT_NODE):
+        self.root = root
+        self.scopes = {}
+        for node, properties in node_properties.items():
+            nested = dict((field, target) for target, field in graph.edges.get(node, {}).items())
+            properties_by_node = [properties]
+            if node == root:
+                properties_by_node += [node_properties[flat] for flat in FLAT_NODES if flat != root and flat in node_properties]
+            self.scopes[node] = _NodeScope(node, properties_by_node, nested)
+        if root in self.scopes:
+            self.scopes[root].fields |= EXTRA_ROOT_FIELDS
+
+    def validate(self, query, variables=None):
+        """Validate a query string and its variables
+
+        Returns a list of error strings; an empty list means the query is valid.
+        """
+        errors = []
+        try:
+            declared, selections = parse_graphql_query(query or "")
+        except GraphQLSyntaxError as e:
+            return [f"Syntax error: {str(e)}"]
+
+        if isinstance(variables, str):
+            try:
+                variables = json.loads(variables) if variables.strip() else {}
+            except json.JSONDecodeError as e:
+                return [f"Variables are not valid JSON: {str(e)}"]
+        variables = variables or {}
+        if not isinstance(variables, dict):
+            return ["Variables must be a JSON object"]
+
+        if not selections:
+            errors.append("Query selects no fields")
+        for field in selections:
+            if field["name"] != self.root:
+                errors.append(f"Unknown root field '{field['name']}' (expected '{self.root}')")
+                continue
+            self._validate_root_arguments(field["args"], declared, variables, errors)
+            self._validate_selections(self.root, field["selections"], self.root, errors)
+
+        for name in variables:
+            if name not in declared:
+                errors.append(f"Variable '${name}' is not declared in the query")
+        return errors
+
+    def _validate_root_arguments(self, args, declared, variables, errors):
+        for name, value in args.items():
+            if name not in ROOT_ARGUMENTS:
+                errors.append(f"Unknown argument '{name}' on '{self.root}'")
+                continue
+            if isinstance(value, tuple) and value[0] == "$":
+                if value[1] not in declared:
+                    errors.append(f"Variable '${value[1]}' is used but not declared")
+                value = variables.get(value[1])
+            if name == "accessibility" and value is not None:
+                literal = value[1] if isinstance(value, tuple) else value
+                if literal not in ACCESSIBILITY_VALUES:
+                    errors.append(f"Invalid accessibility '{literal}'")
+            elif name == "filter" and value:
+                self.validate_filter(value, errors=errors)
+
+    def _validate_selections(self, node, selections, path, errors):
+        scope = self.scopes[node]
+        for field in selections:
+            name = field["name"]
+            if name in scope.nested:
+                if not field["selections"]:
+                    errors.append(f"Nested field '{path}.{name}' needs a selection set")
+                else:
+                    self._validate_selections(scope.nested[name], field["selections"], f"{path}.{name}", errors)
+            elif name in scope.fields or name in META_FIELDS:
+                if field["selections"]:
+                    errors.append(f"Field '{path}.{name}' is a scalar and cannot have a selection set")
+            else:
+                errors.append(f"Unknown field '{name}' on '{node}' (at {path})")
+
+    def validate_filter(self, filter_value, node=None, errors=None):
+        """Validate a filter object against the fields of node (root by default)"""
+        errors = [] if errors is None else errors
+        node = node or self.root
+        scope = self.scopes[node]
+
+        if not isinstance(filter_value, dict):
+            errors.append(f"Filter must be an object, got {type(filter_value).__name__}")
+            return errors
+
+        for operator, operand in filter_value.items():
+            if operator in LOGICAL_OPERATORS:
+                if not isinstance(operand, list):
+                    errors.append(f"'{operator}' expects a list of filters")
+                    continue
+                for item in operand:
+                    self.validate_filter(item, node, errors)
+            elif operator == NESTED_OPERATOR:
+                self._validate_nested_filter(operand, node, errors)
+            elif operator in VALUE_OPERATORS or operator in RANGE_OPERATORS:
+                if not isinstance(operand, dict) or not operand:
+                    errors.append(f"'{operator}' expects an object of field: value")
+                    continue
+                for field, value in operand.items():
+                    self._validate_condition(scope, operator, field, value, errors)
+            elif operator in scope.fields:
+                # Shorthand equality {field: value}
+                self._validate_condition(scope, "=", operator, operand, errors)
+            else:
+                errors.append(f"Unknown filter operator or field '{operator}' on '{node}'")
+        return errors
+
+    def _validate_nested_filter(self, operand, node, errors):
+        if not isinstance(operand, dict) or not isinstance(operand.get("path"), str):
+            errors.append("'nested' expects an object with a 'path'")
+            return
+
+        # Nested paths are dotted field paths from the root node
+        target = self.root
+        for part in operand["path"].split("."):
+            target = self.scopes[target].nested.get(part)
+            if target is None:
+                errors.append(f"Unknown nested path '{operand['path']}'")
+                return
+
+        inner = {key: value for key, value in operand.items() if key != "path"}
+        if not inner:
+            errors.append(f"Nested filter on '{operand['path']}' has no conditions")
+        self.validate_filter(inner, target, errors)
+
+    def _validate_condition(self, scope, operator, field, value, errors):
+        if field not in scope.fields:
+            errors.append(f"Unknown filter field '{field}' on '{scope.node}'")
+            return
+
+        if operator in RANGE_OPERATORS:
+            if field not in scope.numeric:
+                errors.append(f"'{operator}' needs a numeric field, '{scope.node}.{field}' is not numeric")
+            elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"'{operator}' on '{field}' needs a number, got {value!r}")
+            return
+
+        allowed = scope.enums.get(field)
+        if allowed is None:
+            return
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if item not in allowed:
+                errors.append(f"Invalid value {item!r} for '{scope.node}.{field}'")
+
+
+def build_query_validator(node_properties, graph):
+    """Compile a query validator for a loaded schema"""
+    return QueryValidator(node_properties, graph)
+
+
+if __name__ == "__main__":
+    # Test code
+    from schema_registry import SCHEMA_FILE, load_schema_version
+
+    schema = load_schema_version(SCHEMA_FILE)
+    start = time.perf_counter()
+    validator = build_query_validator(schema.node_properties, schema.graph)
+    print(f"Compiled validator for {len(validator.scopes)} nodes in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    valid_query = """query ($filter: JSON) {
+  subject(accessibility: accessible, offset: 0, first: 20, filter: $filter) {
+    consortium
+    subject_submitter_id
+    sex
+    race
+    stagings {
+      stage_system
+      stage
+    }
+  }
+}"""
+    valid_variables = {"filter": {"AND": [
+        {"IN": {"race": ["Multiracial"]}},
+        {"AND": [{"GTE": {"age_at_censor_status": 0}}, {"LTE": {"age_at_censor_status": 6939}}]},
+        {"nested": {"path": "stagings", "AND": [{"IN": {"stage": ["Stage II"]}}]}}
+    ]}}
+    chat_history_query = """query {
+  people(filter: {race: "Multiracial", age_gte: 0, age_lte: 18}) {
+    consortium
+    submitterId
+    sex
+  }
+}"""
+    bad_variables = {"filter": {"AND": [
+        {"IN": {"race": ["multiracial"]}},
+        {"GTE": {"sex": 3}},
+        {"nested": {"path": "lab_results", "AND": [{"IN": {"lab_test_name": ["LDH"]}}]}}
+    ]}}
+
+    print(f"Valid query errors: {validator.validate(valid_query, valid_variables)}")
+    print(f"chat_history query errors: {validator.validate(chat_history_query)}")
+    print(f"Bad variables errors: {validator.validate(valid_query, bad_variables)}")
+    print(f"Syntax errors: {validator.validate('query { subject { sex }')}")
+
+    rounds = 2000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        validator.validate(valid_query, valid_variables)
+    print(f"Validation: {(time.perf_counter() - start) / rounds * 1_000_000:.0f} us/query")
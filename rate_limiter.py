@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# This process's share of the provider limits; every process enforces its own, 0 disables a limit
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "3500"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "90000"))
+
+# Queue priorities, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_API = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_API: "api", PRIORITY_BATCH: "batch"}
+
+
+class TokenBucket:
+    """Capacity refilled continuously at limit per minute; a limit of 0 never runs out"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        if self.capacity:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount, now):
+        """Correct an estimate; a negative amount takes more"""
+        if self.capacity:
+            self._refill(now)
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, now):
+        if self.capacity:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute limiter with a priority queue, shared within one process
+
+    Callers wait in acquire() until both buckets have room for their call.
+    Higher priorities always go first. Within a priority, users are served
+    in fair-share order: each user's calls are tagged with the tokens that
+    user has already queued (start-time fair queueing), so a user sending
+    many calls interleaves with the others instead of going ahead of them.
+    """
+
+    def __init__(self, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._user_finish = {}
+        self._timer = None
+        self.granted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.throttled = 0
+
+    async def acquire(self, tokens, priority=PRIORITY_API, user="anonymous"):
+        """Wait for room to make a call of about tokens tokens, returning the wait in seconds"""
+        start = time.perf_counter()
+        if not self._queue and self._room(tokens) == 0.0:
+            self._grant(tokens)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            start_tag = max(self._virtual_time, self._user_finish.get(user, 0.0))
+            self._user_finish[user] = start_tag + tokens
+            heapq.heappush(self._queue, (priority, start_tag, next(self._sequence), tokens, waiter))
+            self._dispatch()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as the caller gave up; return the capacity
+                    now = time.monotonic()
+                    self.requests.give_back(1, now)
+                    self.tokens.give_back(tokens, now)
+                    self._reschedule()
+                raise
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        self.granted[name] = self.granted.get(name, 0) + 1
+        return time.perf_counter() - start
+
+    def _room(self, tokens):
+        now = time.monotonic()
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _grant(self, tokens):
+        now = time.monotonic()
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+    def _dispatch(self):
+        """Wake queued callers while there is room, then sleep until the head fits"""
+        self._timer = None
+        while self._queue:
+            priority, start_tag, _, tokens, waiter = self._queue[0]
+            if waiter.done():
+                heapq.heappop(self._queue)
+                continue
+            delay = self._room(tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, start_tag)
+            self._grant(tokens)
+            waiter.set_result(None)
+        # Everyone has been served; start the fair-share tags afresh
+        self._user_finish.clear()
+        self._virtual_time = 0.0
+
+    def _reschedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._queue:
+            self._dispatch()
+
+    def release(self, estimated, actual):
+        """Correct the token bucket once a call's real size is known"""
+        if estimated != actual:
+            self.tokens.give_back(estimated - actual, time.monotonic())
+            self._reschedule()
+
+    def throttle(self, seconds=0.0):
+        """The provider rejected a call: stop granting until the buckets refill"""
+        now = time.monotonic()
+        self.requests.drain(now)
+        self.tokens.drain(now)
+        if seconds and self.requests.capacity:
+            self.requests.level = -seconds * self.requests.rate
+        self.throttled += 1
+        self._reschedule()
+
+    def snapshot(self):
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {
+            "rpm_limit": self.requests.capacity,
+            "tpm_limit": self.tokens.capacity,
+            "requests_available": round(self.requests.level, 1) if self.requests.capacity else None,
+            "tokens_available": round(self.tokens.level) if self.tokens.capacity else None,
+            "queued": sum(1 for entry in self._queue if not entry[4].done()),
+            "throttled": self.throttled,
+            "granted": dict(self.granted)
+        }
+
+
+if __name__ == "__main__":
+    # Test code
+    async def main():
+        # 120 requests per minute, starting empty: one call every half second
+        limiter = RateLimiter(rpm=120, tpm=0)
+        limiter.requests.level = 0
+        order = []
+
+        async def call(user, priority, i):
+            await limiter.acquire(100, priority, user)
+            order.append(f"{user}{i}")
+
+        # A heavy batch user queues 6 calls, then a light batch user and an interactive user arrive
+        tasks = [asyncio.create_task(call("heavy", PRIORITY_BATCH, i)) for i in range(6)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(call("light", PRIORITY_BATCH, i)) for i in range(2)]
+        tasks += [asyncio.create_task(call("chat", PRIORITY_INTERACTIVE, 0))]
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        print(f"Served in {time.perf_counter() - start:.1f}s: {order}")
+        print(limiter.snapshot())
+
+        # Token limit: 600 tokens per minute fits one 500-token call, then waits
+        limiter = RateLimiter(rpm=0, tpm=600)
+        print(f"First wait {await limiter.acquire(500):.2f}s")
+        limiter.release(500, 100)
+        print(f"After a smaller actual size, second wait {await limiter.acquire(500):.2f}s")
+
+    asyncio.run(main())
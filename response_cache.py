@@ -0,0 +1,202 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from filter_ast import canonical_json
+from prompt_builder import PROMPT_TEMPLATE_VERSION
+from schema_model import schema_json_default
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache/responses.sqlite")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MEMORY_SIZE = int(os.getenv("RESPONSE_CACHE_MEMORY_SIZE", "512"))
+RESPONSE_CACHE_MAX_ROWS = int(os.getenv("RESPONSE_CACHE_MAX_ROWS", "20000"))
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def schema_slice_hash(schema_slice):
+    """Content hash of the schema slice a prompt was built from"""
+    return _digest(json.dumps(schema_slice, sort_keys=True, separators=(",", ":"), default=schema_json_default))[:16]
+
+
+def response_cache_key(standardized_query, schema_slice, conversation_history="", template_version=PROMPT_TEMPLATE_VERSION):
+    """Key a generated response by everything its prompt was built from
+
+    The standardized query, the schema slice, the prompt template version
+    and the conversation history sent with it; whitespace and case of the
+    query are ignored.
+    """
+    payload = {
+        "query": " ".join(standardized_query.lower().split()),
+        "schema": schema_slice_hash(schema_slice),
+        "template": template_version,
+        "history": _digest(conversation_history or "")[:16]
+    }
+    return _digest(canonical_json(payload))[:32]
+
+
+class ResponseCache:
+    """Two-tier cache of generated results: an in-process LRU over SQLite
+
+    Entries expire after ttl seconds. The memory tier holds the most
+    recently used memory_size entries; the SQLite tier is shared by all
+    workers and trimmed to max_rows, least recently used first. Each entry
+    records the schema nodes its prompt covered, so a schema reload drops
+    only entries built from nodes that changed.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL,
+                 memory_size=RESPONSE_CACHE_MEMORY_SIZE, max_rows=RESPONSE_CACHE_MAX_ROWS):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                         "expired": 0, "evicted": 0, "invalidated": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, nodes TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key):
+        """Get a copy of the cached result for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return copy.deepcopy(entry[1])
+                del self._memory[key]
+
+            row = self._db.execute("SELECT result, nodes, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            if row[2] <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            result = json.loads(row[0])
+            self._remember(key, row[2], result, set(json.loads(row[1])))
+            self.counters["disk_hits"] += 1
+            return copy.deepcopy(result)
+
+    def put(self, key, result, nodes=()):
+        """Cache a result, tagged with the schema nodes its prompt covered"""
+        now = time.time()
+        expires_at = now + self.ttl
+        nodes = sorted(set(nodes))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, result, nodes, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(result), json.dumps(nodes), expires_at, now)
+            )
+            self._remember(key, expires_at, copy.deepcopy(result), set(nodes))
+            self.counters["stores"] += 1
+
+            count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_rows:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (count - self.max_rows,)
+                )
+                self.counters["evicted"] += count - self.max_rows
+
+    def _remember(self, key, expires_at, result, nodes):
+        self._memory[key] = (expires_at, result, nodes)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def invalidate(self, node_types=None):
+        """Drop entries built from any of node_types, or everything"""
+        with self._lock:
+            if node_types is None:
+                removed = self._db.execute("DELETE FROM responses").rowcount
+                self._memory.clear()
+            else:
+                node_types = set(node_types)
+                if not node_types:
+                    return 0
+                stale = [
+                    key for key, nodes in self._db.execute("SELECT key, nodes FROM responses")
+                    if node_types & set(json.loads(nodes))
+                ]
+                self._db.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in stale])
+                for key in [key for key, entry in self._memory.items() if node_types & entry[2]]:
+                    del self._memory[key]
+                removed = len(stale)
+            self.counters["invalidated"] += removed
+        if removed:
+            print(f"Response cache: invalidated {removed} entries")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            }
+
+
+if __name__ == "__main__":
+    # Test code
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "responses.sqlite")
+    cache = ResponseCache(path, ttl=60, memory_size=2, max_rows=3)
+    schema_slice = {"subject": {"race": {"type": "string"}}, "person": {"sex": {"type": "string"}}}
+    key = response_cache_key("Query subjects who are multiracial", schema_slice)
+    print(f"Same key for spacing/case: {key == response_cache_key('query subjects  who are MULTIRACIAL', schema_slice)}")
+    print(f"Different key with history: {key != response_cache_key('Query subjects who are multiracial', schema_slice, 'User: hi')}")
+
+    result = {"query": "query { subject { race } }", "variables": {"filter": {}}, "explanation": "All subjects"}
+    print(f"Miss: {cache.get(key)}")
+    cache.put(key, result, schema_slice)
+    print(f"Hit: {cache.get(key) == result}")
+
+    # A second instance over the same file sees the entry through SQLite
+    other = ResponseCache(path, ttl=60)
+    print(f"Disk hit in another worker: {other.get(key) == result}")
+
+    for i in range(4):
+        cache.put(f"key-{i}", result, ["lab"])
+    print(f"Invalidated lab entries: {cache.invalidate(['lab'])}")
+    print(cache.stats())
+
+    rounds = 10000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        cache.get("key-3")
+    print(f"Memory hit: {(time.perf_counter() - start) / rounds * 1_000_000:.1f} us")
+    cache.put("key-disk", result)
+    start = time.perf_counter()
+    for _ in range(1000):
+        cache._memory.clear()
+        cache.get("key-disk")
+    print(f"Disk hit: {(time.perf_counter() - start) / 1000 * 1_000_000:.1f} us")
@@ -0,0 +1,171 @@
+import difflib
+import json
+import os
+import re
+import threading
+
+from filter_optimizer import optimize_result
+from prompt_builder import create_repair_prompt, estimate_tokens
+from stream_parser import parse_result
+
+# Repair prompts sent for one result before it is returned as is; 0 disables repair
+RESULT_REPAIR_ATTEMPTS = int(os.getenv("RESULT_REPAIR_ATTEMPTS", "1"))
+
+# Longest raw response sent for repair when no query could be read from it
+MAX_REPAIR_RESPONSE_CHARS = 4000
+
+# Validator errors about the filter variables; everything else concerns the query
+_VARIABLES_ERROR_RE = re.compile(
+    r"^(Variables are not valid JSON|Filter must|Unknown filter|Unknown nested path|Nested filter|'|Invalid value)"
+)
+_UNKNOWN_NAME_RE = re.compile(r"'(\w+)' on '(\w+)'")
+_INVALID_VALUE_RE = re.compile(r"^Invalid value (.+) for '(\w+)\.(\w+)'")
+
+
+class RepairStats:
+    """How often generated results needed repair and how often it worked"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.repaired = 0
+        self.improved = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+
+    def record(self, prompt_tokens, errors_before, errors_after):
+        with self._lock:
+            self.attempts += 1
+            self.prompt_tokens += prompt_tokens
+            if errors_after == 0:
+                self.repaired += 1
+            elif errors_after < errors_before:
+                self.improved += 1
+            else:
+                self.failed += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "repaired": self.repaired,
+                "improved": self.improved,
+                "failed": self.failed,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.attempts) if self.attempts else 0
+            }
+
+
+repair_stats = RepairStats()
+
+
+def broken_fragment(result, validation_errors, raw_response=""):
+    """Pick the parts of a result the validation errors point at, or None
+
+    When no query could be read at all, the raw response is the fragment.
+    """
+    if not result.get("query"):
+        raw_response = raw_response.strip()
+        return {"response": raw_response[:MAX_REPAIR_RESPONSE_CHARS]} if raw_response else None
+
+    fragment = {}
+    if any(not _VARIABLES_ERROR_RE.match(error) for error in validation_errors):
+        fragment["query"] = result["query"]
+    if any(_VARIABLES_ERROR_RE.match(error) for error in validation_errors):
+        variables = result.get("variables")
+        fragment["variables"] = variables if isinstance(variables, str) else json.dumps(variables)
+    return fragment
+
+
+def repair_hints(validation_errors, validator, limit=40):
+    """Schema facts the errors need: close field names and allowed enum values"""
+    hints = []
+    for error in validation_errors:
+        match = _INVALID_VALUE_RE.match(error)
+        if match:
+            value, node, field = match.groups()
+            allowed = sorted(validator.scopes[node].enums.get(field, ())) if node in validator.scopes else []
+            close = difflib.get_close_matches(value.strip("'\""), allowed, 5, 0.4)
+            if close:
+                hints.append(f"Allowed values for '{node}.{field}' close to {value}: {', '.join(close)}")
+            elif allowed:
+                hints.append(f"Allowed values for '{node}.{field}': {', '.join(allowed[:limit])}")
+            continue
+        match = _UNKNOWN_NAME_RE.search(error)
+        if match and match.group(2) in validator.scopes:
+            name, node = match.groups()
+            scope = validator.scopes[node]
+            known = sorted(scope.fields | set(scope.nested))
+            close = difflib.get_close_matches(name, known, 5, 0.5)
+            if close:
+                hints.append(f"Fields on '{node}' close to '{name}': {', '.join(close)}")
+            else:
+                hints.append(f"Fields on '{node}': {', '.join(known[:limit])}")
+    return list(dict.fromkeys(hints))
+
+
+async def repair_result(result, validation_errors, schema, user_query, call_llm, raw_response=""):
+    """Ask the LLM to fix only the broken parts of a generated result
+
+    call_llm(prompt_text) is awaited for each repair prompt. A repaired
+    result is kept only if it has fewer validation errors. Returns the
+    result and its validation errors.
+    """
+    for _ in range(RESULT_REPAIR_ATTEMPTS):
+        fragment = broken_fragment(result, validation_errors, raw_response)
+        if not fragment:
+            break
+        prompt_text = create_repair_prompt(user_query, fragment, validation_errors, repair_hints(validation_errors, schema.validator))
+        prompt_tokens = estimate_tokens(prompt_text)
+        print(f"Repairing {', '.join(fragment)} (~{prompt_tokens} token prompt) for {len(validation_errors)} errors")
+        try:
+            response = await call_llm(prompt_text)
+        except Exception as e:
+            print(f"Repair call failed: {str(e)}")
+            break
+
+        fixed = parse_result(response.content)
+        candidate = dict(result)
+        for field in ("query", "variables"):
+            if (field in fragment or "response" in fragment) and fixed.get(field):
+                candidate[field] = fixed[field]
+        if "response" in fragment and fixed.get("explanation"):
+            candidate["explanation"] = fixed["explanation"]
+        optimize_result(candidate, schema.filter_optimizer)
+        errors = schema.validator.validate(candidate.get("query", ""), candidate.get("variables"))
+        repair_stats.record(prompt_tokens, len(validation_errors), len(errors))
+        if len(errors) >= len(validation_errors) and not (candidate.get("query") and not result.get("query")):
+            print(f"Repair did not help: {errors}")
+            break
+        print(f"Repair left {len(errors)} of {len(validation_errors)} errors")
+        result, validation_errors = candidate, errors
+        if not validation_errors:
+            break
+    return result, validation_errors
+
+
+if __name__ == "__main__":
+    # Test code
+    import asyncio
+    from types import SimpleNamespace
+
+    from schema_registry import SCHEMA_FILE, load_schema_version
+
+    schema = load_schema_version(SCHEMA_FILE)
+    broken = {
+        "query": "query ($filter: JSON) { subject(first: 20, filter: $filter) { sex racee } }",
+        "variables": {"filter": {"IN": {"race": ["Multiracal"]}}},
+        "explanation": "Multiracial subjects"
+    }
+    errors = schema.validator.validate(broken["query"], broken["variables"])
+    print(f"Errors: {errors}")
+    print(f"Fragment: {broken_fragment(broken, errors)}")
+    print(f"Hints: {repair_hints(errors, schema.validator)}")
+
+    async def fake_llm(prompt_text):
+        print(prompt_text)
+        return SimpleNamespace(content="Here you go:\n```json\n{'query': 'query ($filter: JSON) { subject(first: 20, filter: $filter) { sex race } }', "
+                                       "'variables': {'filter': {'IN': {'race': ['Multiracial']}}},}\n```")
+
+    repaired, remaining = asyncio.run(repair_result(broken, errors, schema, "Multiracial subjects", fake_llm))
+    print(f"Repaired: {repaired}, remaining errors: {remaining}")
+    print(repair_stats.snapshot())
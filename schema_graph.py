@@ -0,0 +1,115 @@
+import json
+import time
+from collections import deque
+
+ROOT_NODE = "subject"
+
+
+def iter_links(links):
+    """Yield link definitions, flattening gen3 link subgroups"""
+    for link in links or []:
+        if "subgroup" in link:
+            yield from iter_links(link["subgroup"])
+        elif "target_type" in link:
+            yield link
+
+
+class SchemaGraph:
+    """Node graph built from schema links with precomputed nesting paths
+
+    Each link adds two edges: child -> parent through the link name
+    (e.g. lab.subjects) and parent -> child through the backref
+    (e.g. subject.labs). Shortest field paths between every pair of nodes are
+    computed once, so nesting lookups are plain dict reads.
+    """
+
+    def __init__(self, node_links, root=ROOT_NODE):
+        self.root = root
+        self.edges = {}
+
+        for node, links in node_links.items():
+            self.edges.setdefault(node, {})
+            for link in iter_links(links):
+                target = link["target_type"]
+                self.edges.setdefault(target, {})
+                if target == node:
+                    continue
+                self.edges[node].setdefault(target, link["name"])
+                if link.get("backref"):
+                    self.edges[target].setdefault(node, link["backref"])
+
+        self.paths = {node: self._shortest_paths(node) for node in self.edges}
+
+    def _shortest_paths(self, source):
+        """Breadth-first search returning node -> tuple of field names"""
+        paths = {source: ()}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for neighbor in sorted(self.edges[node]):
+                if neighbor not in paths:
+                    paths[neighbor] = paths[node] + (self.edges[node][neighbor],)
+                    queue.append(neighbor)
+        return paths
+
+    @property
+    def nodes(self):
+        return list(self.edges)
+
+    def path(self, source, target):
+        """Get the field path from source to target, or None if unreachable"""
+        return self.paths.get(source, {}).get(target)
+
+    def nested_path(self, node, root=None):
+        """Get the field path that nests node under the root node"""
+        return self.path(root or self.root, node)
+
+    def nested_field(self, node, root=None):
+        """Get the dotted nested path for node, e.g. 'timings.labs'"""
+        path = self.nested_path(node, root)
+        return ".".join(path) if path else None
+
+    def nested_paths(self, root=None):
+        """Get nesting paths for every reachable node"""
+        return dict(self.paths.get(root or self.root, {}))
+
+
+def extract_node_links(schema):
+    """Extract node -> links from a loaded PCDC schema"""
+    return {
+        key.split('.')[0]: value.get("links", [])
+        for key, value in schema.items()
+        if ".yaml" in key and not key.startswith("_") and isinstance(value, dict)
+    }
+
+
+def load_schema_graph(schema_file):
+    """Load the schema link graph through the schema snapshot"""
+    # Imported here to avoid a cycle: the snapshot compiler uses extract_node_links
+    from schema_snapshot import open_schema_snapshot
+
+    try:
+        node_links = open_schema_snapshot(schema_file).node_links
+    except Exception as e:
+        print(f"Schema snapshot unavailable, reading links from JSON: {str(e)}")
+        try:
+            with open(schema_file, 'r') as f:
+                node_links = extract_node_links(json.load(f))
+        except Exception as e:
+            print(f"Failed to load schema links: {str(e)}")
+            node_links = {}
+
+    return SchemaGraph(node_links)
+
+
+if __name__ == "__main__":
+    # Test code
+    start = time.perf_counter()
+    graph = load_schema_graph("pcdc-schema-prod-20250114.json")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"Built graph with {len(graph.nodes)} nodes in {elapsed_ms:.2f} ms")
+
+    nested = graph.nested_paths()
+    print(f"Nodes reachable from {graph.root}: {len(nested)}")
+    for node in ["lab", "histology", "survival_characteristic", "person", "project", "timing"]:
+        print(f"  {node}: {graph.nested_field(node)}")
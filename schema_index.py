@@ -0,0 +1,362 @@
+import math
+import re
+import time
+
+from schema_model import property_spec
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Values that are too common in plain English to count as a mention unless
+# they appear with the exact capitalisation used in the schema (e.g. "ALL")
+GENERIC_VALUES = {"all", "none", "other", "yes", "no", "unknown", "not reported", "not applicable", "na", "n a"}
+
+_TERMINAL = "\0"
+
+
+def normalize_value(value):
+    """Normalize an enum value or query phrase for index lookups"""
+    return " ".join(_TOKEN_RE.findall(str(value).lower()))
+
+
+class EnumValueIndex:
+    """Inverted index of enum values -> (node, property) pairs
+
+    Lookups are a single dict access on the normalized value. For free text,
+    a token trie over all values finds every mentioned value in one
+    left-to-right pass over the query.
+    """
+
+    def __init__(self, node_properties):
+        entries = {}
+        for node, properties in node_properties.items():
+            for prop, details in properties.items():
+                for value in property_spec(prop, details).enum:
+                    normalized = normalize_value(value)
+                    if normalized:
+                        entries.setdefault(normalized, []).append((node, prop, value))
+
+        self.entries = {normalized: tuple(found) for normalized, found in entries.items()}
+        self.fields = {
+            normalized: tuple(dict.fromkeys((node, prop) for node, prop, _ in found))
+            for normalized, found in self.entries.items()
+        }
+
+        # Token trie: token -> child node, _TERMINAL marks the end of a value
+        self.trie = {}
+        for normalized in self.entries:
+            node = self.trie
+            for token in normalized.split(" "):
+                node = node.setdefault(token, {})
+            node[_TERMINAL] = normalized
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, value):
+        """Get the (node, property) pairs that accept value"""
+        return self.fields.get(normalize_value(value), ())
+
+    def find_in_text(self, text, include_generic=False):
+        """Find every enum value mentioned in text in a single pass
+
+        Matches are leftmost-longest and non-overlapping, so "Ann Arbor Stage II"
+        wins over the shorter "Stage II". Each match lists the schema fields it
+        belongs to along with the exact enum spelling for each field.
+        """
+        tokens = [(m.group().lower(), m.start(), m.end()) for m in _TOKEN_RE.finditer(text)]
+        matches = []
+
+        i = 0
+        while i < len(tokens):
+            node = self.trie
+            longest = None
+            j = i
+            while j < len(tokens) and tokens[j][0] in node:
+                node = node[tokens[j][0]]
+                j += 1
+                if _TERMINAL in node:
+                    longest = (node[_TERMINAL], j)
+
+            if longest:
+                normalized, end = longest
+                start_char, end_char = tokens[i][1], tokens[end - 1][2]
+                mention = text[start_char:end_char]
+                if include_generic or self._is_specific(normalized, mention):
+                    matches.append({
+                        "text": mention,
+                        "normalized": normalized,
+                        "span": (start_char, end_char),
+                        "fields": [
+                            {"node": found_node, "property": prop, "value": value}
+                            for found_node, prop, value in self.entries[normalized]
+                        ]
+                    })
+                i = end
+            else:
+                i += 1
+
+        return matches
+
+    def _is_specific(self, normalized, mention):
+        if normalized not in GENERIC_VALUES and not normalized.isdigit():
+            return True
+        # Generic words only count when written exactly like a non-lowercase enum value
+        return any(value == mention and not value.islower() for _, _, value in self.entries[normalized])
+
+    def group_matches(self, matches):
+        """Group matches into node -> property -> [enum values] for filter prefill"""
+        grouped = {}
+        for match in matches:
+            for field in match["fields"]:
+                values = grouped.setdefault(field["node"], {}).setdefault(field["property"], [])
+                if field["value"] not in values:
+                    values.append(field["value"])
+        return grouped
+
+
+def build_enum_index(node_properties):
+    """Build the inverted enum value index for a loaded schema"""
+    return EnumValueIndex(node_properties)
+
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "many", "of", "on", "or", "the", "to", "what", "which", "who", "with", "within", "do",
+    "query", "find", "show", "get", "list", "all", "any", "their", "there", "this", "that"
+}
+
+# Field weights for property documents
+NODE_NAME_WEIGHT = 4.0
+PROPERTY_NAME_WEIGHT = 3.0
+ENUM_VALUE_WEIGHT = 2.0
+TERM_NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Bonus for a property whose full enum value appears in the query
+ENUM_MATCH_BONUS = 8.0
+
+
+def _stem(token):
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics (including underscores) and stem
+
+    Bare numbers are dropped: they are filter values, not schema concepts.
+    """
+    return [
+        _stem(token) for token in _WORD_RE.findall(str(text).lower())
+        if token not in STOPWORDS and not token.isdigit()
+    ]
+
+
+class SchemaSearchIndex:
+    """Scored inverted index over node names, properties, descriptions and enums
+
+    Every (node, property) pair and every node name is a document. A query only
+    touches the postings of its own tokens, so lookup cost depends on the query
+    and the matching postings rather than on the size of the schema.
+    """
+
+    def __init__(self, node_properties, enum_index=None, root="subject"):
+        self.root = root
+        self.enum_index = enum_index or EnumValueIndex(node_properties)
+        self.node_order = {node: list(properties) for node, properties in node_properties.items()}
+        self.docs = []
+        postings = {}
+
+        def add_document(doc, weighted_fields):
+            doc_id = len(self.docs)
+            self.docs.append(doc)
+            weights = {}
+            for text, weight in weighted_fields:
+                for token in set(tokenize(text)):
+                    weights[token] = weights.get(token, 0.0) + weight
+            for token, weight in weights.items():
+                postings.setdefault(token, []).append((doc_id, weight))
+
+        for node, properties in node_properties.items():
+            add_document((node, None), [(node, NODE_NAME_WEIGHT)])
+            for prop, details in properties.items():
+                spec = property_spec(prop, details)
+                if spec.is_link:
+                    # Link references to other nodes carry no searchable content
+                    continue
+                # Each field counts once per token, so long enum lists do not dominate
+                add_document((node, prop), [
+                    (prop, PROPERTY_NAME_WEIGHT),
+                    (spec.description, DESCRIPTION_WEIGHT),
+                    (" ".join(spec.enum), ENUM_VALUE_WEIGHT),
+                    (" ".join(spec.terms), TERM_NAME_WEIGHT)
+                ])
+
+        # Precompute idf-weighted postings so scoring is a plain sum
+        total = len(self.docs)
+        self.postings = {
+            token: tuple((doc_id, weight * (math.log((total + 1) / (len(entries) + 1)) + 1.0)) for doc_id, weight in entries)
+            for token, entries in postings.items()
+        }
+
+    def score(self, query):
+        """Score nodes and properties for a query
+
+        Returns node name scores, property scores and the set of
+        (node, property) pairs whose enum values appear in the query.
+        """
+        node_scores = {}
+        property_scores = {}
+
+        for token in set(tokenize(query)):
+            for doc_id, weight in self.postings.get(token, ()):
+                node, prop = self.docs[doc_id]
+                if prop is None:
+                    node_scores[node] = node_scores.get(node, 0.0) + weight
+                else:
+                    key = (node, prop)
+                    property_scores[key] = property_scores.get(key, 0.0) + weight
+
+        matched_fields = {
+            (field["node"], field["property"])
+            for match in self.enum_index.find_in_text(query)
+            for field in match["fields"]
+        }
+        for key in matched_fields:
+            property_scores[key] = property_scores.get(key, 0.0) + ENUM_MATCH_BONUS
+
+        return node_scores, property_scores, matched_fields
+
+    def search(self, query, max_nodes=5):
+        """Rank nodes for a query
+
+        A node scores its name match plus its best property and a share of
+        the next two, so one strong field outranks many weak description hits.
+        """
+        node_scores, property_scores, matched_fields = self.score(query)
+        enum_nodes = {node for node, _ in matched_fields}
+
+        by_node = {}
+        for (node, prop), score in property_scores.items():
+            by_node.setdefault(node, []).append((score, prop))
+
+        ranked = []
+        for node in set(node_scores) | set(by_node):
+            props = sorted(by_node.get(node, []), reverse=True)
+            top = [score for score, _ in props[:3]]
+            total = node_scores.get(node, 0.0) + (top[0] if top else 0.0) + 0.5 * sum(top[1:])
+            ranked.append({
+                "node": node,
+                "score": round(total, 3),
+                "name_match": node in node_scores,
+                "enum_match": node in enum_nodes,
+                "properties": [(prop, round(score, 3)) for score, prop in props]
+            })
+
+        ranked.sort(key=lambda item: (-item["score"], item["node"]))
+        return ranked[:max_nodes]
+
+    def extract(self, query, node_properties, max_nodes=4, max_properties=40, max_properties_per_node=20, min_relative_score=0.3):
+        """Build a ranked, budget-limited schema slice for a query
+
+        The root node is always included in full. Nodes named in the query
+        contribute their matched properties first and are then filled up in
+        schema order; other nodes contribute only matched properties. Nodes
+        with an exact enum value match come first since they carry concrete
+        filters; other nodes scoring below min_relative_score of the best
+        node are left out.
+        """
+        relevant_schema = {}
+        budget = max_properties
+
+        root_properties = node_properties.get(self.root, {})
+        relevant_schema[self.root] = root_properties
+        budget -= len(root_properties)
+
+        ranked = [item for item in self.search(query, max_nodes=len(self.node_order)) if item["node"] != self.root]
+        cutoff = ranked[0]["score"] * min_relative_score if ranked else 0.0
+        ranked.sort(key=lambda item: not item["enum_match"])
+
+        for item in ranked:
+            node = item["node"]
+            if budget <= 0 or len(relevant_schema) > max_nodes:
+                break
+            if item["score"] < cutoff and not item["enum_match"]:
+                continue
+
+            properties = node_properties.get(node, {})
+            selected = [prop for prop, _ in item["properties"]]
+            if item["name_match"]:
+                selected += [prop for prop in self.node_order.get(node, []) if prop not in selected]
+
+            limit = min(budget, max_properties_per_node)
+            relevant_schema[node] = {prop: properties[prop] for prop in selected[:limit] if prop in properties}
+            budget -= len(relevant_schema[node])
+
+        return relevant_schema
+
+
+def build_search_index(node_properties, enum_index=None):
+    """Build the schema retrieval index for a loaded schema"""
+    return SchemaSearchIndex(node_properties, enum_index)
+
+
+# Search index built for the most recently used node_properties object
+_search_index_cache = {"node_properties": None, "index": None}
+
+
+def get_search_index(node_properties, enum_index=None):
+    """Get the search index for node_properties, building it once per schema load"""
+    if _search_index_cache["node_properties"] is not node_properties:
+        _search_index_cache["index"] = build_search_index(node_properties, enum_index)
+        _search_index_cache["node_properties"] = node_properties
+    return _search_index_cache["index"]
+
+
+if __name__ == "__main__":
+    # Test code
+    from schema_snapshot import load_pcdc_schema
+
+    node_properties, term_mappings = load_pcdc_schema("pcdc-schema-prod-20250114.json")
+
+    start = time.perf_counter()
+    enum_index = build_enum_index(node_properties)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Indexed {len(enum_index)} distinct enum values in {build_ms:.2f} ms")
+
+    print(f"INRG -> {enum_index.lookup('INRG')}")
+
+    test_query = "How many patients in the INRG consortium with Ann Arbor Stage II disease are Female, in all studies?"
+    start = time.perf_counter()
+    matches = enum_index.find_in_text(test_query)
+    find_us = (time.perf_counter() - start) * 1_000_000
+    print(f"Found {len(matches)} values in {find_us:.1f} us")
+    for match in matches:
+        print(f"  {match['text']!r} -> {[(f['node'], f['property']) for f in match['fields']]}")
+    print(f"Grouped: {enum_index.group_matches(matches)}")
+
+    # Test scored schema retrieval
+    start = time.perf_counter()
+    search_index = build_search_index(node_properties, enum_index)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Indexed {len(search_index.docs)} documents, {len(search_index.postings)} tokens in {build_ms:.2f} ms")
+
+    for query in [
+        test_query,
+        "Which adverse events of grade 3 were reported?",
+        "Subjects whose histology shows Schwannian stroma-poor neuroblastoma",
+        "Overall survival status of patients",
+    ]:
+        start = time.perf_counter()
+        ranked = search_index.search(query, max_nodes=3)
+        search_us = (time.perf_counter() - start) * 1_000_000
+        print(f"{query!r} ({search_us:.0f} us)")
+        for item in ranked:
+            print(f"  {item['node']}: {item['score']} {[prop for prop, _ in item['properties'][:4]]}")
+        relevant_schema = search_index.extract(query, node_properties)
+        print(f"  slice: { {node: len(props) for node, props in relevant_schema.items()} }")
@@ -0,0 +1,207 @@
+import sys
+import time
+from collections.abc import Mapping
+
+_intern = sys.intern
+
+
+def property_type_label(details):
+    """Get a short type label for a resolved property dict"""
+    if not isinstance(details, dict):
+        return "any"
+    if "anyOf" in details:
+        return "link"
+    prop_type = details.get("type")
+    if isinstance(prop_type, list):
+        prop_type = "|".join(t for t in prop_type if t != "null") or "null"
+    if not prop_type and "oneOf" in details:
+        prop_type = "|".join(sorted({str(option.get("format") or option.get("type")) for option in details["oneOf"] if isinstance(option, dict) and option.get("type") != "null"}))
+    return prop_type or "string"
+
+
+class PropertySpec:
+    """One schema property with only the fields retrieval and prompting use
+
+    Strings are interned, so names, enum values and descriptions repeated
+    across nodes (e.g. "Unknown", "Not Reported") are stored once per process.
+    Link properties keep only is_link; their anyOf payload is not retained.
+    """
+
+    __slots__ = ("name", "type", "description", "enum", "terms", "is_link")
+
+    def __init__(self, name, type="string", description="", enum=(), terms=(), is_link=False):
+        self.name = name
+        self.type = type
+        self.description = description
+        self.enum = enum
+        self.terms = terms
+        self.is_link = is_link
+
+    @classmethod
+    def from_dict(cls, name, details):
+        """Build a spec from a resolved property dict"""
+        if not isinstance(details, dict):
+            return cls(_intern(name), "any")
+        terms = tuple(
+            _intern(str(term["termDef"].get("term", "")))
+            for term in details.get("term", []) or []
+            if isinstance(term, dict) and isinstance(term.get("termDef"), dict)
+        )
+        return cls(
+            _intern(name),
+            _intern(property_type_label(details)),
+            _intern(str(details.get("description") or details.get("Description") or "")),
+            tuple(_intern(str(value)) for value in details.get("enum", []) or []),
+            terms,
+            "anyOf" in details
+        )
+
+    def to_dict(self):
+        """Get a JSON-serializable dict for prompts and logs"""
+        details = {"type": self.type}
+        if self.description:
+            details["description"] = self.description
+        if self.enum:
+            details["enum"] = list(self.enum)
+        if self.terms:
+            details["term"] = list(self.terms)
+        return details
+
+    def __eq__(self, other):
+        if not isinstance(other, PropertySpec):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"PropertySpec({self.name!r}, type={self.type!r}, enum={len(self.enum)} values)"
+
+
+class NodeSpec(dict):
+    """Property name -> PropertySpec dict for one schema node
+
+    Subclasses dict so property lookups stay C-level dict reads.
+    """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name, properties):
+        super().__init__(properties)
+        self.name = name
+
+    def __repr__(self):
+        return f"NodeSpec({self.name!r}, {len(self)} properties)"
+
+
+def property_spec(prop, details):
+    """Get a PropertySpec for a property given as a spec or a resolved dict"""
+    return details if isinstance(details, PropertySpec) else PropertySpec.from_dict(prop, details)
+
+
+def build_schema_model(node_properties):
+    """Convert node -> property dicts into node -> NodeSpec"""
+    return {
+        _intern(node): NodeSpec(_intern(node), {
+            _intern(prop): property_spec(prop, details) for prop, details in properties.items()
+        })
+        for node, properties in node_properties.items()
+    }
+
+
+class SchemaModel(Mapping):
+    """Node -> NodeSpec mapping converted one node at a time on first access
+
+    Wraps any node -> properties mapping, such as the lazily decoded
+    snapshot mapping, so nodes a version never reads are never decoded.
+    """
+
+    def __init__(self, node_properties):
+        self._source = node_properties
+        self._nodes = {}
+
+    def __getitem__(self, node):
+        spec = self._nodes.get(node)
+        if spec is None:
+            node = _intern(node)
+            spec = NodeSpec(node, {
+                _intern(prop): property_spec(prop, details) for prop, details in self._source[node].items()
+            })
+            # Racing threads build equal specs; the first one stored wins
+            spec = self._nodes.setdefault(node, spec)
+        return spec
+
+    def __iter__(self):
+        return iter(self._source)
+
+    def __len__(self):
+        return len(self._source)
+
+    def __contains__(self, node):
+        return node in self._source
+
+    def __repr__(self):
+        return f"SchemaModel({len(self._nodes)} of {len(self)} nodes built)"
+
+
+def schema_json_default(obj):
+    """json.dumps default hook for schema slices built from NodeSpec/PropertySpec"""
+    if isinstance(obj, PropertySpec):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if __name__ == "__main__":
+    # Benchmark memory and lookup speed against the raw dict representation
+    import gc
+    import json
+    import tracemalloc
+
+    from schema_snapshot import load_pcdc_schema
+
+    schema_file = "pcdc-schema-prod-20250114.json"
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        result = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return result, size
+
+    def load_raw():
+        node_properties, _ = load_pcdc_schema(schema_file)
+        return {node: dict(properties) for node, properties in node_properties.items()}
+
+    raw, raw_bytes = measure(load_raw)
+    model, model_bytes = measure(lambda: build_schema_model(load_raw()))
+    print(f"Raw property dicts: {raw_bytes / 1024:.0f} KiB")
+    print(f"NodeSpec/PropertySpec: {model_bytes / 1024:.0f} KiB ({model_bytes / raw_bytes:.2f}x)")
+
+    raw_details = [details for properties in raw.values() for details in properties.values()]
+    specs = [spec for properties in model.values() for spec in properties.values()]
+    rounds = 2000
+
+    # Fields read per property by index building, slicing and prompt compaction
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for details in raw_details:
+            details.get("enum")
+            details.get("description", "")
+            "anyOf" in details
+            details.get("type")
+    dict_ns = (time.perf_counter() - start) / (rounds * len(raw_details)) * 1e9
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for spec in specs:
+            spec.enum
+            spec.description
+            spec.is_link
+            spec.type
+    spec_ns = (time.perf_counter() - start) / (rounds * len(specs)) * 1e9
+
+    print(f"Dict field access: {dict_ns:.0f} ns/property")
+    print(f"Slot field access: {spec_ns:.0f} ns/property ({dict_ns / spec_ns:.2f}x)")
+    print(json.dumps({"person": {"race": model["person"]["race"]}}, default=schema_json_default)[:160])
@@ -1,5 +1,68 @@
 import json
-import re
+
+from schema_index import get_search_index
+from schema_resolver import resolve_schema
+from term_matcher import TermMatcher
+
+def build_schema_mappings(schema):
+    """Build node properties and term mappings from a loaded PCDC schema"""
+    # Extract all nodes and properties
+    node_properties = {}
+    term_mappings = {}
+    
+    # Check schema structure
+    if "subject.yaml" in schema:
+        # Expand $ref entries once so downstream code only sees resolved properties
+        resolved_schema = resolve_schema(schema)
+        
+        # Process yaml format schema
+        for key, value in resolved_schema.items():
+            node_type = key.split('.')[0]
+            if "properties" in value:
+                raw_properties = schema[key].get("properties", {})
+                node_properties[node_type] = {}
+                for prop, details in value["properties"].items():
+                    if prop not in ["type", "id", "project_id", "created_datetime", "updated_datetime", "state"]:
+                        node_properties[node_type][prop] = details
+                        
+                        # Build term mappings
+                        if "enum" in details:
+                            term_mappings[prop] = details["enum"]
+                        
+                        # Term ids only exist on the raw reference entries
+                        raw_details = raw_properties.get(prop)
+                        if isinstance(raw_details, dict):
+                            for term in raw_details.get("term", []):
+                                if isinstance(term, dict) and "$ref" in term:
+                                    term_name = term["$ref"].split('/')[-1]
+                                    term_mappings[term_name] = prop
+    else:
+        # Use hardcoded subject schema as fallback
+        node_properties["subject"] = {
+            "consortium": {"enum": ["INSTRuCT", "MaGIC", "INRG", "NODAL", "INTERACT", "HIBISCUS", "ALL"]},
+            "sex": {"enum": ["Female", "Male", "Other", "Unknown", "Not Reported"]},
+            "race": {"enum": ["American Indian or Alaska Native", "Asian", "Black or African American", "Native Hawaiian or Other Pacific Islander", "White", "Multiple races", "Other", "Unknown", "Not Reported"]},
+            "ethnicity": {"enum": ["Hispanic or Latino", "Not Hispanic or Latino", "Unknown", "Not Reported"]},
+            "age_at_censor_status": {"type": ["number"]}
+        }
+        
+        # Add basic term mappings
+        term_mappings = {
+            "male": "sex",
+            "female": "sex",
+            "men": "sex",
+            "women": "sex",
+            "age": "age_at_censor_status",
+            "years old": "age_at_censor_status",
+            "multiracial": "race",
+            "white": "race",
+            "black": "race",
+            "asian": "race",
+            "hispanic": "ethnicity",
+            "latino": "ethnicity"
+        }
+    
+    return node_properties, term_mappings
 
 def parse_pcdc_schema(schema_file):
     """Parse PCDC schema and build property mappings"""
@@ -7,57 +70,7 @@ def parse_pcdc_schema(schema_file):
         with open(schema_file, 'r') as f:
             schema = json.load(f)
         
-        # Extract all nodes and properties
-        node_properties = {}
-        term_mappings = {}
-        
-        # Check schema structure
-        if "subject.yaml" in schema:
-            # Process yaml format schema
-            for key, value in schema.items():
-                if ".yaml" in key:
-                    node_type = key.split('.')[0]
-                    if "properties" in value:
-                        node_properties[node_type] = {}
-                        for prop, details in value["properties"].items():
-                            if prop not in ["type", "id", "project_id", "created_datetime", "updated_datetime", "state"]:
-                                node_properties[node_type][prop] = details
-                                
-                                # Build term mappings
-                                if "enum" in details:
-                                    term_mappings[prop] = details["enum"]
-                                if "term" in details:
-                                    for term in details.get("term", []):
-                                        if isinstance(term, dict) and "$ref" in term:
-                                            term_name = term["$ref"].split('/')[-1]
-                                            term_mappings[term_name] = prop
-        else:
-            # Use hardcoded subject schema as fallback
-            node_properties["subject"] = {
-                "consortium": {"enum": ["INSTRuCT", "MaGIC", "INRG", "NODAL", "INTERACT", "HIBISCUS", "ALL"]},
-                "sex": {"enum": ["Female", "Male", "Other", "Unknown", "Not Reported"]},
-                "race": {"enum": ["American Indian or Alaska Native", "Asian", "Black or African American", "Native Hawaiian or Other Pacific Islander", "White", "Multiple races", "Other", "Unknown", "Not Reported"]},
-                "ethnicity": {"enum": ["Hispanic or Latino", "Not Hispanic or Latino", "Unknown", "Not Reported"]},
-                "age_at_censor_status": {"type": ["number"]}
-            }
-            
-            # Add basic term mappings
-            term_mappings = {
-                "male": "sex",
-                "female": "sex",
-                "men": "sex",
-                "women": "sex",
-                "age": "age_at_censor_status",
-                "years old": "age_at_censor_status",
-                "multiracial": "race",
-                "white": "race",
-                "black": "race",
-                "asian": "race",
-                "hispanic": "ethnicity",
-                "latino": "ethnicity"
-            }
-        
-        return node_properties, term_mappings
+        return build_schema_mappings(schema)
     except Exception as e:
         print(f"Failed to parse PCDC schema: {str(e)}")
         # Return basic schema as fallback
@@ -84,16 +97,22 @@ def parse_pcdc_schema(schema_file):
             "latino": "ethnicity"
         }
 
-def extract_relevant_schema(query, node_properties):
-    """Extract relevant schema information based on query"""
-    relevant_schema = {}
+def extract_relevant_schema(query, node_properties, enum_index=None, max_nodes=4, max_properties=40,
+                            mode="index", vector_index=None, search_index=None):
+    """Extract relevant schema information based on query
     
-    # Check node types mentioned in the query
-    node_types = ["subject", "disease_characteristic", "staging", "lab", "vital", "medical_history"]
-    
-    for node_type in node_types:
-        if node_type in query.lower():
-            relevant_schema[node_type] = node_properties.get(node_type, {})
+    In "index" mode, ranks every node by matches on node names, property
+    names, descriptions and enum values (including enum values found by
+    enum_index). In "vector" mode, takes the properties most similar to the
+    query by cosine similarity from vector_index. Both return a budget-limited
+    slice with subject always included. Pass search_index to use the index
+    built for a specific schema version instead of the cached one.
+    """
+    if mode == "vector" and vector_index is not None:
+        relevant_schema = vector_index.extract(query, node_properties, max_nodes=max_nodes, max_properties=max_properties)
+    else:
+        search_index = search_index or get_search_index(node_properties, enum_index)
+        relevant_schema = search_index.extract(query, node_properties, max_nodes=max_nodes, max_properties=max_properties)
     
     # If no relevant nodes found, default to subject node
     if not relevant_schema:
@@ -101,38 +120,49 @@ def extract_relevant_schema(query, node_properties):
     
     return relevant_schema
 
-def standardize_terms(user_input, term_mappings):
+# Common term mappings, applied before the mappings extracted from the schema
+COMMON_TERM_MAPPINGS = {
+    "male": "sex",
+    "female": "sex",
+    "men": "sex",
+    "women": "sex",
+    "age": "age_at_censor_status",
+    "years old": "age_at_censor_status",
+    "multiracial": "race",
+    "white": "race",
+    "black": "race",
+    "asian": "race",
+    "hispanic": "ethnicity",
+    "latino": "ethnicity"
+}
+
+# Matcher built for the most recently used term_mappings object
+_term_matcher_cache = {"term_mappings": None, "matcher": None}
+
+def get_term_mapping_pairs(term_mappings):
+    """Get (term, mapped term) pairs in the order they are applied"""
+    pairs = list(COMMON_TERM_MAPPINGS.items())
+    pairs.extend((term, mapped_term) for term, mapped_term in term_mappings.items() if isinstance(mapped_term, str))
+    return pairs
+
+def build_term_matcher(term_mappings):
+    """Build the single-pass term matcher for a loaded schema"""
+    return TermMatcher(get_term_mapping_pairs(term_mappings))
+
+def get_term_matcher(term_mappings):
+    """Get the term matcher for term_mappings, building it once per schema load"""
+    if _term_matcher_cache["term_mappings"] is not term_mappings:
+        _term_matcher_cache["matcher"] = build_term_matcher(term_mappings)
+        _term_matcher_cache["term_mappings"] = term_mappings
+    return _term_matcher_cache["matcher"]
+
+def standardize_terms(user_input, term_mappings, matcher=None):
     """Standardize user input terms to PCDC schema terms"""
-    standardized_input = user_input
-    
-    # Common term mappings
-    common_mappings = {
-        "male": "sex",
-        "female": "sex",
-        "men": "sex",
-        "women": "sex",
-        "age": "age_at_censor_status",
-        "years old": "age_at_censor_status",
-        "multiracial": "race",
-        "white": "race",
-        "black": "race",
-        "asian": "race",
-        "hispanic": "ethnicity",
-        "latino": "ethnicity"
-    }
-    
-    # Apply common mappings
-    for term, mapped_term in common_mappings.items():
-        pattern = re.compile(r'\b' + term + r'\b', re.IGNORECASE)
-        standardized_input = pattern.sub(f"{term} ({mapped_term})", standardized_input)
-    
-    # Apply mappings extracted from schema
-    for term, mapped_term in term_mappings.items():
-        if isinstance(mapped_term, str):
-            pattern = re.compile(r'\b' + term + r'\b', re.IGNORECASE)
-            standardized_input = pattern.sub(f"{term} ({mapped_term})", standardized_input)
+    if matcher is None:
+        matcher = get_term_matcher(term_mappings)
     
-    return standardized_input
+    # Annotate common and schema terms in a single pass
+    return matcher.annotate(user_input)
 
 if __name__ == "__main__":
     # Test code
@@ -0,0 +1,249 @@
+import asyncio
+import fnmatch
+import glob
+import json
+import os
+import threading
+import time
+
+from schema_graph import SchemaGraph, extract_node_links
+from schema_index import build_enum_index, build_search_index
+from schema_model import SchemaModel
+from schema_parser import build_term_matcher, parse_pcdc_schema
+from schema_snapshot import hash_schema_file, open_schema_snapshot
+from schema_vectors import load_schema_vector_index
+from query_validator import build_query_validator
+from filter_optimizer import build_filter_optimizer
+
+SCHEMA_FILE = os.getenv("PCDC_SCHEMA_FILE", "pcdc-schema-prod-20250114.json")
+SCHEMA_FILE_PATTERN = os.getenv("PCDC_SCHEMA_PATTERN", "pcdc-schema-prod-*.json")
+
+
+class SchemaVersion:
+    """One loaded schema together with every structure derived from it
+
+    A version is never modified after it is built. Request handlers take the
+    current version once and use it until they finish, so a reload never
+    changes the schema underneath an in-flight request.
+    """
+
+    def __init__(self, schema_file, source_hash, node_properties, term_mappings, node_links):
+        self.schema_file = schema_file
+        self.source_hash = source_hash
+        self.version = source_hash[:12] if source_hash else "fallback"
+        self.loaded_at = time.time()
+
+        # Compact slotted specs replace the decoded property dicts, built per node on first use
+        self.node_properties = SchemaModel(node_properties)
+        self.term_mappings = term_mappings
+        self.node_links = node_links
+
+        # Nodes without links still belong in the graph
+        self.graph = SchemaGraph({**{node: [] for node in self.node_properties}, **node_links})
+        self.enum_index = build_enum_index(self.node_properties)
+        self.search_index = build_search_index(self.node_properties, self.enum_index)
+        self.term_matcher = build_term_matcher(term_mappings)
+        self.vector_index = load_schema_vector_index(schema_file, self.node_properties)
+        self.validator = build_query_validator(self.node_properties, self.graph)
+        self.filter_optimizer = build_filter_optimizer(self.validator, self.graph)
+
+    def describe(self):
+        """Summarize the version for logs and admin endpoints"""
+        return {
+            "schema_file": self.schema_file,
+            "version": self.version,
+            "node_count": len(self.node_properties),
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at))
+        }
+
+
+def load_schema_version(schema_file):
+    """Load a schema version through its snapshot, falling back to parsing the JSON"""
+    try:
+        snapshot = open_schema_snapshot(schema_file)
+        return SchemaVersion(schema_file, snapshot.source_hash, snapshot.node_properties,
+                             snapshot.term_mappings, snapshot.node_links)
+    except Exception as e:
+        print(f"Schema snapshot unavailable, parsing JSON directly: {str(e)}")
+
+    node_properties, term_mappings = parse_pcdc_schema(schema_file)
+    try:
+        source_hash = hash_schema_file(schema_file)
+        with open(schema_file, 'r') as f:
+            node_links = extract_node_links(json.load(f))
+    except Exception as e:
+        print(f"Failed to read schema links: {str(e)}")
+        source_hash = None
+        node_links = {}
+    return SchemaVersion(schema_file, source_hash, node_properties, term_mappings, node_links)
+
+
+def diff_schema_versions(old, new):
+    """Diff two schema versions node by node, and property by property for nodes in both"""
+    old_nodes = set(old.node_properties)
+    new_nodes = set(new.node_properties)
+
+    changed = []
+    added_properties = {}
+    removed_properties = {}
+    changed_properties = {}
+    for node in sorted(old_nodes & new_nodes):
+        old_props = old.node_properties[node]
+        new_props = new.node_properties[node]
+        links_changed = old.node_links.get(node) != new.node_links.get(node)
+        if old_props == new_props and not links_changed:
+            continue
+        changed.append(node)
+        if set(new_props) - set(old_props):
+            added_properties[node] = sorted(set(new_props) - set(old_props))
+        if set(old_props) - set(new_props):
+            removed_properties[node] = sorted(set(old_props) - set(new_props))
+        modified = sorted(prop for prop in set(old_props) & set(new_props) if old_props[prop] != new_props[prop])
+        if modified:
+            changed_properties[node] = modified
+    added = sorted(new_nodes - old_nodes)
+    removed = sorted(old_nodes - new_nodes)
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "added_properties": added_properties,
+        "removed_properties": removed_properties,
+        "changed_properties": changed_properties,
+        "changed_nodes": sorted(set(added) | set(removed) | set(changed))
+    }
+
+
+class SchemaRegistry:
+    """Holds the current schema version and swaps in reloaded versions atomically"""
+
+    def __init__(self, schema_file=SCHEMA_FILE):
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._current = load_schema_version(schema_file)
+
+    def current(self):
+        """Get the schema version new requests should use"""
+        return self._current
+
+    def add_listener(self, callback):
+        """Register callback(diff, old_version, new_version), called after every swap
+
+        Caches derived from schema nodes use this to drop only the entries
+        for nodes listed in diff["changed_nodes"].
+        """
+        self._listeners.append(callback)
+
+    def reload(self, schema_file=None):
+        """Load a schema file, diff it against the current version and swap it in"""
+        with self._reload_lock:
+            old = self._current
+            schema_file = schema_file or old.schema_file
+
+            # Build the new version outside the swap lock; requests keep using the old one
+            new = load_schema_version(schema_file)
+            if new.source_hash and new.source_hash == old.source_hash:
+                return {"status": "unchanged", **old.describe()}
+
+            diff = diff_schema_versions(old, new)
+            with self._lock:
+                self._current = new
+
+            for callback in self._listeners:
+                try:
+                    callback(diff, old, new)
+                except Exception as e:
+                    print(f"Schema reload listener failed: {str(e)}")
+
+            print(f"Reloaded PCDC schema {old.version} -> {new.version}, changed nodes: {diff['changed_nodes']}")
+            if diff["removed"] or diff["removed_properties"]:
+                print(f"Removed from the schema: nodes {diff['removed']}, properties {diff['removed_properties']}")
+            return {"status": "reloaded", "previous_version": old.version, **new.describe(), **diff}
+
+    async def reload_async(self, schema_file=None):
+        """Reload in a worker thread so the event loop keeps serving requests"""
+        return await asyncio.to_thread(self.reload, schema_file)
+
+
+def is_allowed_schema_file(schema_file):
+    """Check that schema_file is an existing schema in the working directory"""
+    return (
+        os.path.basename(schema_file) == schema_file
+        and fnmatch.fnmatch(schema_file, SCHEMA_FILE_PATTERN)
+        and os.path.isfile(schema_file)
+    )
+
+
+class SchemaWatcher:
+    """Polls for new or modified schema files and reloads them in the background"""
+
+    def __init__(self, registry, pattern=SCHEMA_FILE_PATTERN, interval=30):
+        self.registry = registry
+        self.pattern = pattern
+        self.interval = interval
+        self._last_seen = self._latest_file_state()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _latest_file_state(self):
+        files = sorted(glob.glob(self.pattern))
+        if not files:
+            return None
+        latest = files[-1]
+        stat = os.stat(latest)
+        return (latest, stat.st_mtime, stat.st_size)
+
+    def check(self):
+        """Reload if the newest matching schema file appeared or changed"""
+        state = self._latest_file_state()
+        if state and state != self._last_seen:
+            self._last_seen = state
+            return self.registry.reload(state[0])
+        return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Schema watcher error: {str(e)}")
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self.interval and self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="schema-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    # Test code
+    import shutil
+    import tempfile
+
+    registry = SchemaRegistry(SCHEMA_FILE)
+    print(f"Loaded: {registry.current().describe()}")
+
+    # Simulate deploying a new schema with one modified node
+    with open(SCHEMA_FILE, 'r') as f:
+        schema = json.load(f)
+    schema["lab.yaml"]["properties"]["lab_test"]["description"] = "Updated description"
+    schema["lab.yaml"]["properties"].pop("lab_result_numeric", None)
+
+    tmp_dir = tempfile.mkdtemp()
+    new_file = os.path.join(tmp_dir, os.path.basename(SCHEMA_FILE))
+    with open(new_file, 'w') as f:
+        json.dump(schema, f)
+
+    in_flight = registry.current()
+    registry.add_listener(lambda diff, old, new: print(f"Invalidate caches for: {diff['changed_nodes']}"))
+    report = registry.reload(new_file)
+    print(f"Reload report: {report}")
+    print(f"In-flight request still sees old version: {in_flight.version}, new requests see: {registry.current().version}")
+
+    shutil.rmtree(tmp_dir)
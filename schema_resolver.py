@@ -0,0 +1,125 @@
+import json
+import time
+
+
+class SchemaRefError(Exception):
+    """Raised when a $ref cannot be resolved or forms a cycle"""
+
+
+class SchemaResolver:
+    """Resolves $ref pointers across PCDC schema documents
+
+    Every reference target is resolved once and cached, so all properties that
+    point at the same definition or term share one resolved object instead of
+    each holding a copy. Resolved values must be treated as read-only.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._cache = {}
+        self._resolving = []
+
+    def resolve_document(self, doc_name):
+        """Resolve every reference inside one schema document"""
+        return self._resolve_target(doc_name, "")
+
+    def resolve_ref(self, ref, base_doc):
+        """Resolve a $ref string relative to the document it appears in"""
+        doc_name, _, pointer = ref.partition('#')
+        return self._resolve_target(doc_name or base_doc, pointer)
+
+    def get_term(self, term_id):
+        """Get the resolved _terms.yaml entry for a term id such as ncit_C61538"""
+        return self._resolve_target("_terms.yaml", f"/{term_id}")
+
+    def resolve(self, value, base_doc):
+        """Return a copy of value with all references expanded"""
+        if isinstance(value, dict):
+            ref = value.get("$ref")
+            if isinstance(ref, str):
+                target = self.resolve_ref(ref, base_doc)
+                siblings = {k: self.resolve(v, base_doc) for k, v in value.items() if k != "$ref"}
+                if not siblings:
+                    # Plain reference, share the cached target
+                    return target
+                if not isinstance(target, dict):
+                    raise SchemaRefError(f"Cannot merge properties into non-object $ref: {ref}")
+                # Sibling keys refine the target; nested values stay shared
+                merged = dict(target)
+                merged.update(siblings)
+                return merged
+            return {k: self.resolve(v, base_doc) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item, base_doc) for item in value]
+        return value
+
+    def _resolve_target(self, doc_name, pointer):
+        key = (doc_name, pointer)
+        if key in self._cache:
+            return self._cache[key]
+
+        if key in self._resolving:
+            cycle = self._resolving[self._resolving.index(key):] + [key]
+            raise SchemaRefError("Circular $ref: " + " -> ".join(f"{d}#{p}" for d, p in cycle))
+
+        self._resolving.append(key)
+        try:
+            resolved = self.resolve(self._lookup(doc_name, pointer), doc_name)
+        finally:
+            self._resolving.pop()
+
+        self._cache[key] = resolved
+        return resolved
+
+    def _lookup(self, doc_name, pointer):
+        if doc_name not in self.schema:
+            raise SchemaRefError(f"Unknown schema document: {doc_name}")
+
+        target = self.schema[doc_name]
+        for part in pointer.split('/')[1:]:
+            part = part.replace("~1", "/").replace("~0", "~")
+            if isinstance(target, dict) and part in target:
+                target = target[part]
+            elif isinstance(target, list) and part.isdigit() and int(part) < len(target):
+                target = target[int(part)]
+            else:
+                raise SchemaRefError(f"Unresolvable $ref: {doc_name}#{pointer}")
+        return target
+
+
+def resolve_schema(schema):
+    """Resolve all node documents of a PCDC schema into a reference-free model"""
+    resolver = SchemaResolver(schema)
+    return {
+        key: resolver.resolve_document(key)
+        for key in schema
+        if ".yaml" in key and not key.startswith("_")
+    }
+
+
+if __name__ == "__main__":
+    # Test code
+    with open("pcdc-schema-prod-20250114.json", 'r') as f:
+        schema = json.load(f)
+
+    start = time.perf_counter()
+    resolver = SchemaResolver(schema)
+    resolved = {key: resolver.resolve_document(key) for key in schema if ".yaml" in key and not key.startswith("_")}
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"Resolved {len(resolved)} nodes in {elapsed_ms:.2f} ms, cached targets: {len(resolver._cache)}")
+
+    unresolved = json.dumps(resolved).count('"$ref"')
+    print(f"Remaining $ref entries: {unresolved}")
+
+    consortium = resolved["subject.yaml"]["properties"]["consortium"]
+    print(f"consortium term: {consortium['term'][0]['termDef']['term']}")
+    print(f"ncit_C168949: {resolver.get_term('ncit_C168949')['termDef']['term']}")
+
+    # Shared subtrees: both nodes point at the same resolved definition object
+    print(f"Shared datetime definition: {resolved['lab.yaml']['properties']['created_datetime'] is resolved['vital.yaml']['properties']['created_datetime']}")
+
+    cyclic = {"a.yaml": {"x": {"$ref": "#/y"}, "y": {"$ref": "#/x"}}}
+    try:
+        SchemaResolver(cyclic).resolve_document("a.yaml")
+    except SchemaRefError as e:
+        print(f"Cycle detected: {str(e)}")
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time
+from collections.abc import Mapping
+
+from schema_graph import extract_node_links
+from schema_parser import build_schema_mappings, parse_pcdc_schema
+
+# Snapshot file layout:
+#   magic (8 bytes) | format version, header length (<II) | JSON header | payload
+# The header records the source content hash and the (offset, length) of every
+# marshalled section inside the payload, so nodes can be decoded one at a time.
+SNAPSHOT_MAGIC = b"PCDCSNAP"
+SNAPSHOT_FORMAT_VERSION = 3
+SNAPSHOT_DIR = os.getenv("SCHEMA_SNAPSHOT_DIR", "schema_cache")
+
+_PREAMBLE = struct.Struct("<II")
+
+
+def hash_schema_file(schema_file):
+    """Return the SHA-256 of the schema file contents"""
+    with open(schema_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_snapshot_path(schema_file, source_hash, snapshot_dir=SNAPSHOT_DIR):
+    """Get snapshot path for a schema file with the given content hash"""
+    stem = os.path.splitext(os.path.basename(schema_file))[0]
+    filename = f"{stem}.{source_hash[:16]}.v{SNAPSHOT_FORMAT_VERSION}.{sys.implementation.cache_tag}.snap"
+    return os.path.join(snapshot_dir, filename)
+
+
+def compile_schema_snapshot(schema_file, snapshot_dir=SNAPSHOT_DIR):
+    """Parse the schema once and write it as a binary snapshot, returning its path"""
+    with open(schema_file, 'rb') as f:
+        raw = f.read()
+    source_hash = hashlib.sha256(raw).hexdigest()
+
+    # Errors propagate here: a fallback schema must never be persisted
+    schema = json.loads(raw)
+    node_properties, term_mappings = build_schema_mappings(schema)
+    node_links = extract_node_links(schema)
+
+    payload = bytearray()
+
+    def add_section(value):
+        data = marshal.dumps(value)
+        offset = len(payload)
+        payload.extend(data)
+        return [offset, len(data)]
+
+    header = {
+        "source_file": os.path.basename(schema_file),
+        "source_hash": source_hash,
+        "cache_tag": sys.implementation.cache_tag,
+        "nodes": {node: add_section(props) for node, props in node_properties.items()},
+        "term_mappings": add_section(term_mappings),
+        "node_links": add_section(node_links)
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = get_snapshot_path(schema_file, source_hash, snapshot_dir)
+
+    # Write to a temporary file and rename so concurrent workers never read a partial snapshot
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_PREAMBLE.pack(SNAPSHOT_FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+class SnapshotNodeProperties(Mapping):
+    """Read-only node -> properties mapping decoded lazily from a snapshot"""
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._decoded = {}
+
+    def __getitem__(self, node_type):
+        if node_type not in self._decoded:
+            offset, length = self._snapshot.nodes[node_type]
+            self._decoded[node_type] = self._snapshot.read_section(offset, length)
+        return self._decoded[node_type]
+
+    def __iter__(self):
+        return iter(self._snapshot.nodes)
+
+    def __len__(self):
+        return len(self._snapshot.nodes)
+
+    def __contains__(self, node_type):
+        return node_type in self._snapshot.nodes
+
+
+class SchemaSnapshot:
+    """Memory-mapped schema snapshot shared between worker processes
+
+    The file is mapped read-only, so every worker on the host shares the same
+    page-cache pages. Nodes are only decoded when they are first accessed.
+    """
+
+    def __init__(self, path, expected_hash=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a schema snapshot: {path}")
+
+        start = len(SNAPSHOT_MAGIC)
+        version, header_length = _PREAMBLE.unpack_from(self._mmap, start)
+        if version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version: {version}")
+
+        header_start = start + _PREAMBLE.size
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        if header["cache_tag"] != sys.implementation.cache_tag:
+            raise ValueError(f"Snapshot compiled for {header['cache_tag']}")
+        if expected_hash and header["source_hash"] != expected_hash:
+            raise ValueError("Snapshot does not match schema file contents")
+
+        self.source_hash = header["source_hash"]
+        self.nodes = header["nodes"]
+        self._payload_start = header_start + header_length
+
+        self.node_properties = SnapshotNodeProperties(self)
+        self.term_mappings = self.read_section(*header["term_mappings"])
+        self.node_links = self.read_section(*header["node_links"])
+
+    def read_section(self, offset, length):
+        """Decode one marshalled section of the payload"""
+        start = self._payload_start + offset
+        return marshal.loads(self._mmap[start:start + length])
+
+
+def open_schema_snapshot(schema_file, snapshot_dir=SNAPSHOT_DIR):
+    """Open the snapshot for the current schema contents, compiling it if missing"""
+    source_hash = hash_schema_file(schema_file)
+    path = get_snapshot_path(schema_file, source_hash, snapshot_dir)
+
+    if not os.path.exists(path):
+        path = compile_schema_snapshot(schema_file, snapshot_dir)
+        print(f"Compiled schema snapshot: {path}")
+
+    try:
+        return SchemaSnapshot(path, expected_hash=source_hash)
+    except ValueError as e:
+        # Stale or corrupt snapshot, rebuild it once
+        print(f"Rebuilding schema snapshot: {str(e)}")
+        path = compile_schema_snapshot(schema_file, snapshot_dir)
+        return SchemaSnapshot(path, expected_hash=source_hash)
+
+
+def load_pcdc_schema(schema_file, snapshot_dir=SNAPSHOT_DIR):
+    """Load node properties and term mappings through the schema snapshot"""
+    try:
+        snapshot = open_schema_snapshot(schema_file, snapshot_dir)
+        return snapshot.node_properties, snapshot.term_mappings
+    except Exception as e:
+        print(f"Schema snapshot unavailable, parsing JSON directly: {str(e)}")
+        return parse_pcdc_schema(schema_file)
+
+
+if __name__ == "__main__":
+    # Compile the snapshot ahead of time and compare startup cost
+    schema_file = sys.argv[1] if len(sys.argv) > 1 else "pcdc-schema-prod-20250114.json"
+
+    path = compile_schema_snapshot(schema_file)
+    print(f"Snapshot written: {path} ({os.path.getsize(path)} bytes)")
+
+    start = time.perf_counter()
+    node_properties, term_mappings = parse_pcdc_schema(schema_file)
+    parse_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    snapshot_properties, snapshot_terms = load_pcdc_schema(schema_file)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    print(f"JSON parse: {parse_ms:.2f} ms, snapshot open: {load_ms:.2f} ms")
+    print(f"Node count: {len(snapshot_properties)}, term mappings count: {len(snapshot_terms)}")
+
+    start = time.perf_counter()
+    identical = all(snapshot_properties[node] == props for node, props in node_properties.items())
+    decode_ms = (time.perf_counter() - start) * 1000
+    print(f"Decoded all nodes in {decode_ms:.2f} ms, identical to JSON parse: {identical and snapshot_terms == term_mappings}")
@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+
+from schema_model import property_spec
+from schema_snapshot import SNAPSHOT_DIR, hash_schema_file
+
+# Bump when the embedding scheme changes so persisted matrices are rebuilt
+VECTOR_INDEX_VERSION = 2
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashedNgramEmbedder:
+    """Offline text embedder using hashed word and character n-gram features
+
+    Features are hashed with CRC32 (stable across processes) into a fixed
+    number of signed buckets, weighted by log term frequency and IDF, and
+    L2-normalized so a dot product is cosine similarity.
+    """
+
+    def __init__(self, dim=1024, char_ngrams=(3, 4, 5), idf=None):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.idf = idf if idf is not None else np.ones(dim, dtype=np.float32)
+
+    def features(self, text):
+        """Get feature counts for text"""
+        counts = {}
+        for word in _WORD_RE.findall(str(text).lower()):
+            counts[word] = counts.get(word, 0) + 1
+            padded = f" {word} "
+            for n in self.char_ngrams:
+                for i in range(len(padded) - n + 1):
+                    gram = padded[i:i + n]
+                    counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    def _raw_vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in self.features(text).items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dim] += sign * (1.0 + np.log(count))
+        return vector
+
+    def fit(self, texts):
+        """Compute bucket IDF weights from a corpus and return its embedding matrix"""
+        raw = np.stack([self._raw_vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        df = np.count_nonzero(raw, axis=0)
+        self.idf = (np.log((len(texts) + 1) / (df + 1)) + 1.0).astype(np.float32)
+        return self._normalize(raw * self.idf)
+
+    def embed(self, text):
+        """Embed a single text"""
+        return self._normalize((self._raw_vector(text) * self.idf)[None, :])[0]
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32)
+
+
+def property_text(node, prop, details):
+    """Build the text embedded for one schema property"""
+    spec = property_spec(prop, details)
+    parts = [node.replace("_", " "), prop.replace("_", " "), spec.description]
+    parts.extend(spec.enum[:50])
+    parts.extend(spec.terms)
+    return " ".join(parts)
+
+
+class SchemaVectorIndex:
+    """Dense matrix of schema property embeddings queried by cosine similarity"""
+
+    def __init__(self, keys, matrix, embedder, root="subject"):
+        self.keys = keys
+        self.matrix = matrix
+        self.embedder = embedder
+        self.root = root
+
+    @classmethod
+    def build(cls, node_properties, dim=1024):
+        """Embed every property of a loaded schema"""
+        keys = []
+        texts = []
+        for node, properties in node_properties.items():
+            for prop, details in properties.items():
+                if property_spec(prop, details).is_link:
+                    continue
+                keys.append((node, prop))
+                texts.append(property_text(node, prop, details))
+
+        embedder = HashedNgramEmbedder(dim=dim)
+        matrix = embedder.fit(texts)
+        return cls(keys, matrix, embedder)
+
+    def save(self, path):
+        """Persist the matrix and embedder weights as .npz"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(VECTOR_INDEX_VERSION),
+            matrix=self.matrix,
+            idf=self.embedder.idf,
+            char_ngrams=np.array(self.embedder.char_ngrams),
+            nodes=np.array([node for node, _ in self.keys]),
+            props=np.array([prop for _, prop in self.keys])
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a persisted index"""
+        with np.load(path) as data:
+            if int(data["version"]) != VECTOR_INDEX_VERSION:
+                raise ValueError(f"Unsupported vector index version: {int(data['version'])}")
+            matrix = data["matrix"]
+            embedder = HashedNgramEmbedder(
+                dim=matrix.shape[1],
+                char_ngrams=tuple(int(n) for n in data["char_ngrams"]),
+                idf=data["idf"]
+            )
+            keys = list(zip(data["nodes"].tolist(), data["props"].tolist()))
+        return cls(keys, matrix, embedder)
+
+    def search(self, query, top_k=20):
+        """Get the top_k (node, property, score) matches with one matrix product"""
+        if not self.keys:
+            return []
+        scores = self.matrix @ self.embedder.embed(query)
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i][0], self.keys[i][1], float(scores[i])) for i in top if scores[i] > 0]
+
+    def extract(self, query, node_properties, max_nodes=4, max_properties=40, top_k=20):
+        """Build a schema slice from the top_k most similar properties, grouped by node"""
+        relevant_schema = {self.root: node_properties.get(self.root, {})}
+        budget = max_properties - len(relevant_schema[self.root])
+
+        for node, prop, _ in self.search(query, top_k):
+            if budget <= 0:
+                break
+            if node not in relevant_schema:
+                if len(relevant_schema) > max_nodes:
+                    continue
+                relevant_schema[node] = {}
+            if prop not in relevant_schema[node]:
+                relevant_schema[node][prop] = node_properties.get(node, {}).get(prop)
+                budget -= 1
+
+        return relevant_schema
+
+
+def get_vector_index_path(schema_file, source_hash, snapshot_dir=SNAPSHOT_DIR):
+    """Get the .npz path stored next to the schema snapshot"""
+    stem = os.path.splitext(os.path.basename(schema_file))[0]
+    return os.path.join(snapshot_dir, f"{stem}.{source_hash[:16]}.vectors.v{VECTOR_INDEX_VERSION}.npz")
+
+
+def load_schema_vector_index(schema_file, node_properties, snapshot_dir=SNAPSHOT_DIR):
+    """Load the persisted vector index for the schema, building and saving it if missing"""
+    path = None
+    try:
+        path = get_vector_index_path(schema_file, hash_schema_file(schema_file), snapshot_dir)
+        if os.path.exists(path):
+            return SchemaVectorIndex.load(path)
+    except Exception as e:
+        print(f"Rebuilding schema vector index: {str(e)}")
+
+    index = SchemaVectorIndex.build(node_properties)
+    if path:
+        try:
+            index.save(path)
+            print(f"Saved schema vector index: {path}")
+        except Exception as e:
+            print(f"Failed to save schema vector index: {str(e)}")
+    return index
+
+
+if __name__ == "__main__":
+    # Test code
+    from schema_snapshot import load_pcdc_schema
+
+    schema_file = "pcdc-schema-prod-20250114.json"
+    node_properties, term_mappings = load_pcdc_schema(schema_file)
+
+    start = time.perf_counter()
+    index = SchemaVectorIndex.build(node_properties)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Embedded {len(index.keys)} properties into {index.matrix.shape} in {build_ms:.1f} ms")
+
+    path = get_vector_index_path(schema_file, hash_schema_file(schema_file))
+    index.save(path)
+    start = time.perf_counter()
+    index = load_schema_vector_index(schema_file, node_properties)
+    print(f"Loaded {path} in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    for query in ["Which adverse events of grade 3 were reported?", "overall survival status", "patients who are multiracial"]:
+        start = time.perf_counter()
+        results = index.search(query, top_k=5)
+        search_us = (time.perf_counter() - start) * 1_000_000
+        print(f"{query!r} ({search_us:.0f} us)")
+        for node, prop, score in results:
+            print(f"  {node}.{prop}: {score:.3f}")
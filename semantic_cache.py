@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from filter_ast import query_result_key
+
+# "off", "shadow" (look up and compare with the LLM answer, never serve) or "on"
+SEMANTIC_CACHE_MODE = os.getenv("SEMANTIC_CACHE_MODE", "shadow")
+
+# Minimum cosine similarity between the question and a stored response
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# Stored questions checked per lookup
+SEMANTIC_CACHE_CANDIDATES = 3
+
+# ChromaDB collection holding the cached questions, apart from the chat history
+SEMANTIC_CACHE_COLLECTION = "semantic_cache"
+
+
+def semantic_cache_metadata(standardized_query, result, schema):
+    """Metadata stored with a cached question: the result to serve for it"""
+    return {
+        "standardized_query": standardized_query,
+        "result_json": json.dumps(result),
+        "schema_version": schema.version
+    }
+
+
+class SemanticCache:
+    """Answer questions from validated answers to similar earlier questions
+
+    The standardized question alone is embedded, both when a validated LLM
+    answer is stored and when looking one up, so questions are compared
+    with questions. chroma_manager should own a collection of its own
+    (SEMANTIC_CACHE_COLLECTION). A candidate is used when its similarity
+    reaches the threshold and its query still validates against the
+    current schema. In shadow mode candidates are only compared with the
+    LLM's answer, to measure the would-be hit rate and accuracy.
+    """
+
+    def __init__(self, chroma_manager, mode=SEMANTIC_CACHE_MODE, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.chroma_manager = chroma_manager
+        self.mode = mode if mode in ("off", "shadow", "on") else "off"
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.candidates = 0
+        self.served = 0
+        self.validation_rejects = 0
+        self.compared = 0
+        self.agreed = 0
+        self.lookup_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def store(self, standardized_query, result, schema):
+        """Store a validated answer to a question that doesn't depend on earlier messages
+
+        Blocking (it embeds the question); call it from a worker thread.
+        """
+        question = " ".join(standardized_query.split())
+        doc_id = hashlib.sha256(f"{schema.version}\0{question.lower()}".encode("utf-8")).hexdigest()[:24]
+        return self.chroma_manager.store_text(question, semantic_cache_metadata(question, result, schema), doc_id)
+
+    def lookup(self, standardized_query, schema):
+        """Find a reusable result for the question, or None
+
+        Blocking (it embeds the question); call it from a worker thread.
+        """
+        start = time.perf_counter()
+        candidate = None
+        try:
+            matches = self.chroma_manager.search_similar_responses(
+                " ".join(standardized_query.split()), k=SEMANTIC_CACHE_CANDIDATES
+            )
+            for match in sorted(matches, key=lambda item: item.get("cosine_similarity", 0.0), reverse=True):
+                if match.get("cosine_similarity", 0.0) < self.threshold:
+                    break
+                result = json.loads(match["metadata"]["result_json"])
+                if schema.validator.validate(result.get("query", ""), result.get("variables")):
+                    with self._lock:
+                        self.validation_rejects += 1
+                    continue
+                print(f"Semantic cache candidate ({match['cosine_similarity']:.3f}): "
+                      f"{match['metadata'].get('standardized_query', '')[:80]}")
+                candidate = result
+                break
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {str(e)}")
+
+        with self._lock:
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - start
+            if candidate is not None:
+                self.candidates += 1
+                if self.mode == "on":
+                    self.served += 1
+        return candidate
+
+    def record_shadow(self, candidate, llm_result):
+        """Compare a shadow-mode candidate with the answer the LLM gave"""
+        if candidate is None:
+            return
+        agreed = query_result_key(candidate.get("query", ""), candidate.get("variables")) == \
+            query_result_key(llm_result.get("query", ""), llm_result.get("variables"))
+        with self._lock:
+            self.compared += 1
+            self.agreed += agreed
+        stats = self.stats()
+        print(f"Semantic cache (shadow): candidate {'matches' if agreed else 'differs from'} the LLM answer; "
+              f"would-hit rate {stats['candidate_rate']:.1%}, accuracy {stats['shadow_accuracy']:.1%}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "candidates": self.candidates,
+                "candidate_rate": self.candidates / self.lookups if self.lookups else 0.0,
+                "served": self.served,
+                "validation_rejects": self.validation_rejects,
+                "shadow_compared": self.compared,
+                "shadow_accuracy": self.agreed / self.compared if self.compared else 0.0,
+                "avg_lookup_s": round(self.lookup_seconds / self.lookups, 3) if self.lookups else 0.0
+            }
+
+
+if __name__ == "__main__":
+    # Test code
+    from ChromaDB.chroma_manager_mock import ChromaDBManager as MockChromaDBManager
+    from schema_registry import SCHEMA_FILE, load_schema_version
+
+    schema = load_schema_version(SCHEMA_FILE)
+    manager = MockChromaDBManager(collection_name=SEMANTIC_CACHE_COLLECTION)
+    stored = {
+        "query": "query ($filter: JSON) { subject(first: 20, filter: $filter) { race } }",
+        "variables": {"filter": {"IN": {"race": ["Multiracial"]}}},
+        "explanation": "Multiracial subjects"
+    }
+    cache = SemanticCache(manager, mode="shadow", threshold=0.7)
+    cache.store("Query subjects who are multiracial", stored, schema)
+
+    candidate = cache.lookup("Query the subjects who are multiracial", schema)
+    cache.record_shadow(candidate, stored)
+    print(f"Unrelated question: {cache.lookup('How many diseases are in the portal?', schema)}")
+    print(cache.stats())
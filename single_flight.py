@@ -0,0 +1,113 @@
+import asyncio
+import copy
+from collections import Counter
+
+# Labels kept in the per-key coalescing counts
+MAX_TRACKED_KEYS = 1000
+
+
+class _Flight:
+    __slots__ = ("task", "label", "waiters")
+
+    def __init__(self, task, label):
+        self.task = task
+        self.label = label
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Share one in-flight computation among concurrent callers with the same key
+
+    The first caller for a key starts the work; callers arriving before it
+    finishes wait on the same task and get a copy of its result. An error
+    or cancellation of the work reaches every waiter. A waiter that is
+    cancelled itself stops waiting without affecting the others, and the
+    work is cancelled once nobody is waiting for it any more.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self.started = 0
+        self.coalesced = 0
+        self.coalesced_by_key = Counter()
+
+    async def run(self, key, factory, label=None):
+        """Await factory() for key, sharing it with concurrent callers"""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(asyncio.ensure_future(factory()), label or key)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            self.coalesced_by_key[flight.label] += 1
+            if len(self.coalesced_by_key) > MAX_TRACKED_KEYS:
+                self.coalesced_by_key = Counter(dict(self.coalesced_by_key.most_common(MAX_TRACKED_KEYS // 2)))
+            print(f"{self.name}: joined in-flight call for {flight.label!r} ({flight.waiters + 1} waiting)")
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # The last waiter gave up; nobody needs the result any more
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+        return result if leader else copy.deepcopy(result)
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "in_flight": {flight.label: flight.waiters for flight in self._flights.values()},
+            "top_coalesced": dict(self.coalesced_by_key.most_common(10))
+        }
+
+
+if __name__ == "__main__":
+    # Test code
+    async def main():
+        flights = SingleFlight("demo")
+        calls = 0
+
+        async def slow_answer(value):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.2)
+            if value == "boom":
+                raise ValueError("backend failed")
+            return {"answer": value}
+
+        results = await asyncio.gather(*(flights.run("q", lambda: slow_answer("42"), "same question") for _ in range(10)))
+        print(f"10 waiters, {calls} call, all equal: {all(r == results[0] for r in results)}")
+
+        errors = await asyncio.gather(*(flights.run("e", lambda: slow_answer("boom")) for _ in range(3)), return_exceptions=True)
+        print(f"Errors reach every waiter: {[type(e).__name__ for e in errors]}")
+
+        # One waiter cancelled: the other still gets the result
+        first = asyncio.ensure_future(flights.run("c", lambda: slow_answer("kept")))
+        second = asyncio.ensure_future(flights.run("c", lambda: slow_answer("kept")))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        print(f"Remaining waiter: {await second}")
+
+        # All waiters cancelled: the work is cancelled too
+        only = asyncio.ensure_future(flights.run("d", lambda: slow_answer("dropped")))
+        await asyncio.sleep(0.05)
+        shared = flights._flights["d"].task
+        only.cancel()
+        await asyncio.sleep(0.01)
+        print(f"Work cancelled with its last waiter: {shared.cancelled()}")
+        print(flights.snapshot())
+
+    asyncio.run(main())
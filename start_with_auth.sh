@@ -33,6 +33,10 @@ echo "   Username: demo    | Password: demo123"
 echo "   Username: guest   | Password: guest"
 echo ""
 
+# Precompile the schema snapshot shared by all workers
+echo "[INFO] Compiling PCDC schema snapshot..."
+python schema_snapshot.py
+
 # Start the application
 echo "[INFO] Starting Chainlit app with authentication and chat history..."
 echo "[INFO] App will be available at: http://localhost:8000"
@@ -0,0 +1,260 @@
+import ast
+import json
+import re
+import time
+
+# Fields of a generated result, in the order the prompt asks for them
+RESULT_FIELDS = ("query", "variables", "explanation")
+
+_KEY_RES = {field: re.compile(r'(?<!\\)["\']' + field + r'["\']\s*:\s*') for field in RESULT_FIELDS}
+
+# Start of the result object, possibly after prose or an opening fence
+_OBJECT_START_RE = re.compile(r'\{\s*["\'](?:' + "|".join(RESULT_FIELDS) + r')["\']\s*:')
+
+# Body of a JSON (or single-quoted) string up to its closing quote, if it has arrived yet
+_STRING_BODY_RES = {
+    '"': re.compile(r'((?:[^"\\]|\\.)*)(")?', re.DOTALL),
+    "'": re.compile(r"((?:[^'\\]|\\.)*)(')?", re.DOTALL)
+}
+
+# Fenced blocks, closed or still streaming
+_FENCE_RES = {
+    "query": re.compile(r'```graphql\s*(.*?)(```|$)', re.DOTALL),
+    "variables": re.compile(r'```json\s*(.*?)(```|$)', re.DOTALL)
+}
+
+# Unfenced blocks, laid out like the prompt's examples
+_BARE_QUERY_RE = re.compile(r'^\s*(?:query\b[^{]*)?\{\s*subject\b', re.MULTILINE)
+_BARE_VARIABLES_RE = re.compile(r'^\s*\**variables\**\s*:?\s*\**\s*(?=\{)', re.MULTILINE | re.IGNORECASE)
+
+_SINGLE_QUOTED_RE = re.compile(r"'((?:[^'\\]|\\.)*)'")
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+# Explanation given to results recovered from blocks rather than the JSON object
+RECOVERED_EXPLANATION = "Query and variables extracted from response"
+
+
+def _partial_string(text, start, quote='"'):
+    """Decode a string starting after its opening quote, returning (value, complete)"""
+    match = _STRING_BODY_RES[quote].match(text, start)
+    body, closed = match.group(1), match.group(2) is not None
+    if not closed:
+        # Drop an escape sequence cut off by the end of the stream
+        body = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', "", body)
+    if quote == "'":
+        body = body.replace("\\'", "'").replace('"', '\\"')
+    try:
+        return json.loads(f'"{body}"'), closed
+    except json.JSONDecodeError:
+        return body, closed
+
+
+def lenient_json(text):
+    """Load a JSON object/array the way an LLM tends to write one, or return None
+
+    Besides strict JSON this accepts trailing commas, single-quoted strings
+    and Python literals (True, None).
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    relaxed = _TRAILING_COMMA_RE.sub(r"\1", text)
+    relaxed = _SINGLE_QUOTED_RE.sub(lambda match: json.dumps(_partial_string(match.group(0), 1, "'")[0]), relaxed)
+    try:
+        return json.loads(relaxed)
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return value if isinstance(value, (dict, list)) else None
+
+
+def _partial_container(text, start):
+    """Get a JSON object/array starting at start, returning (text so far, complete)"""
+    depth = 0
+    in_string = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == in_string:
+                in_string = None
+        elif char in "\"'":
+            in_string = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1], True
+    return text[start:], False
+
+
+class StreamingResultParser:
+    """Fill in query, variables and explanation as LLM tokens arrive
+
+    The response is expected to be the JSON object the prompt asks for,
+    possibly after some prose or inside a ```json fence; fenced ```graphql
+    / ```json blocks, or the unfenced layout of the prompt's examples, are
+    read when it is not. Fields that are complete are not parsed again, so
+    feeding a token only rescans the field that is still streaming.
+    result() gives the final, tolerant reading once the stream has ended.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.complete = set()
+        self.object_start = None
+
+    def feed(self, chunk):
+        """Add a chunk of output, returning True when a field changed"""
+        self.text += chunk
+        before = dict(self.fields)
+        if self.object_start is None:
+            match = _OBJECT_START_RE.search(self.text)
+            if match:
+                self.object_start = match.start()
+                self.fields = {}
+        if self.object_start is not None:
+            self._parse_json()
+        else:
+            self._parse_fences()
+        return self.fields != before
+
+    def _parse_json(self):
+        for field, key_re in _KEY_RES.items():
+            if field in self.complete:
+                continue
+            match = key_re.search(self.text, self.object_start)
+            if not match or match.end() >= len(self.text):
+                continue
+            start = match.end()
+            opener = self.text[start]
+            if opener in "\"'":
+                value, done = _partial_string(self.text, start + 1, opener)
+            elif opener in "{[":
+                raw, done = _partial_container(self.text, start)
+                loaded = lenient_json(raw) if done else None
+                value = raw if loaded is None else loaded
+            else:
+                continue
+            self.fields[field] = value
+            if done:
+                self.complete.add(field)
+
+    def _parse_fences(self):
+        for field, fence_re in _FENCE_RES.items():
+            match = fence_re.search(self.text)
+            if match:
+                self.fields[field] = match.group(1).rstrip("`").strip()
+
+    def _parse_bare_blocks(self):
+        """Read an unfenced query and a `Variables:` object, as in the prompt's examples"""
+        if "query" not in self.fields:
+            match = _BARE_QUERY_RE.search(self.text)
+            if match:
+                brace = self.text.index("{", match.start())
+                self.fields["query"] = (self.text[match.start():brace] + _partial_container(self.text, brace)[0]).strip()
+        if "variables" not in self.fields:
+            match = _BARE_VARIABLES_RE.search(self.text)
+            if match:
+                self.fields["variables"] = _partial_container(self.text, match.end())[0]
+
+    def result(self):
+        """The result read from the whole response, as tolerantly as possible
+
+        The JSON object is loaded on its own, ignoring text around it; if it
+        is cut off or malformed, the fields read while streaming are used.
+        Variables that cannot be loaded are left as text for the validator
+        to report. Never raises; a response with nothing usable gives an
+        empty query.
+        """
+        result = None
+        if self.object_start is not None:
+            raw, done = _partial_container(self.text, self.object_start)
+            loaded = lenient_json(raw) if done else None
+            if isinstance(loaded, dict):
+                result = {field: loaded[field] for field in RESULT_FIELDS if field in loaded}
+        if result is None:
+            if self.object_start is None:
+                self._parse_bare_blocks()
+            result = dict(self.fields)
+            if self.object_start is None and result:
+                result.setdefault("explanation", RECOVERED_EXPLANATION)
+
+        query = result.get("query")
+        query = query if isinstance(query, str) else ""
+        fence = _FENCE_RES["query"].search(query)
+        result["query"] = (fence.group(1).rstrip("`") if fence else query).strip()
+
+        variables = result.get("variables")
+        if variables is None or variables == "":
+            variables = {}
+        elif isinstance(variables, str):
+            fence = _FENCE_RES["variables"].search(variables)
+            loaded = lenient_json(fence.group(1).rstrip("`") if fence else variables)
+            variables = loaded if isinstance(loaded, dict) else variables
+        result["variables"] = variables
+        result.setdefault("explanation", "")
+        return result
+
+
+def parse_result(text):
+    """Parse a complete LLM response into query, variables and explanation"""
+    parser = StreamingResultParser()
+    parser.feed(text)
+    return parser.result()
+
+
+if __name__ == "__main__":
+    # Test code
+    response = json.dumps({
+        "query": "query ($filter: JSON) {\n  subject(first: 20, filter: $filter) {\n    sex\n    race\n  }\n}",
+        "variables": {"filter": {"IN": {"race": ["Multiracial", "Asian \"A\""]}}},
+        "explanation": "Multiracial subjects — with sex and race."
+    }, indent=2)
+
+    parser = StreamingResultParser()
+    changes = 0
+    for i in range(0, len(response), 4):
+        if parser.feed(response[i:i + 4]):
+            changes += 1
+        if i == 120:
+            print(f"Partial after {i} chars: {parser.fields}")
+    print(f"Final ({changes} updates): {parser.fields}")
+    print(f"Matches json.loads: {parser.fields == json.loads(response)}")
+
+    fenced = "Here is the query:\n```graphql\nquery { subject { sex } }\n```\n```json\n{\"filter\": {}}\n```"
+    parser = StreamingResultParser()
+    for i in range(0, len(fenced), 3):
+        parser.feed(fenced[i:i + 3])
+    print(f"Fenced: {parser.fields}")
+
+    query = "query ($filter: JSON) { subject(first: 20, filter: $filter) { race } }"
+    messy = {
+        "prose around a fenced object": f'Sure! Here it is:\n```json\n{{"query": {json.dumps(query)}, "variables": {{"filter": {{"IN": {{"race": ["White"]}}}}}}, "explanation": "White subjects"}}\n```\nLet me know if you need more.',
+        "single-quoted variables": f'{{"query": {json.dumps(query)}, "variables": "{{\'filter\': {{\'IN\': {{\'race\': [\'Asian\']}}}}}}", "explanation": "Asian subjects"}}',
+        "python-style object": f"{{'query': {query!r}, 'variables': {{'filter': {{'IN': {{'race': ['Asian']}}}},}}, 'explanation': \"Subjects' race\"}}",
+        "cut off": f'{{"query": {json.dumps(query)}, "variables": {{"filter": {{"IN": {{"race": ["Wh',
+        "prompt example layout": f"{query}\n\nVariables:\n{{ \"filter\": {{ \"IN\": {{ \"race\": [\"White\"] }} }} }}",
+        "nothing usable": "I'm sorry, I can't help with that."
+    }
+    for name, text in messy.items():
+        print(f"{name}: {parse_result(text)}")
+
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parser = StreamingResultParser()
+        for i in range(0, len(response), 4):
+            parser.feed(response[i:i + 4])
+    print(f"Parse per token: {(time.perf_counter() - start) / rounds / (len(response) / 4) * 1_000_000:.1f} us")
@@ -0,0 +1,169 @@
+import re
+import time
+
+# Characters that make a mapping key behave as a regex instead of a literal
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+
+
+def apply_mappings_sequentially(text, mappings):
+    """Annotate terms one pattern at a time (the original standardize_terms loop)"""
+    for term, mapped_term in mappings:
+        pattern = re.compile(r'\b' + term + r'\b', re.IGNORECASE)
+        text = pattern.sub(f"{term} ({mapped_term})", text)
+    return text
+
+
+def _is_word(ch):
+    return ch.isalnum() or ch == "_"
+
+
+class TermMatcher:
+    """Aho-Corasick automaton that annotates mapped terms in one pass
+
+    Produces the same output as apply_mappings_sequentially: overlapping
+    matches are resolved in mapping order, and the effect of later mappings
+    on an earlier replacement is folded into that replacement when the
+    automaton is built.
+    """
+
+    def __init__(self, mappings):
+        self.mappings = list(mappings)
+        self.exact = all(term and not (set(term) & _REGEX_SPECIAL) for term, _ in self.mappings)
+
+        # First mapping wins for each lowercased term; later duplicates only
+        # apply through the cascaded replacement text.
+        self.priority = {}
+        self.replacements = {}
+        for index, (term, mapped_term) in enumerate(self.mappings):
+            key = term.lower()
+            if key in self.priority:
+                continue
+            self.priority[key] = index
+            replacement = f"{term} ({mapped_term})"
+            later = [(t, m) for t, m in self.mappings[index + 1:] if t.lower() in replacement.lower()]
+            self.replacements[key] = apply_mappings_sequentially(replacement, later) if self.exact else replacement
+
+        self._build_automaton(self.priority)
+
+    def _build_automaton(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for key in keys:
+            state = 0
+            for ch in key:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state].append(key)
+
+        # Breadth-first failure links
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Find term occurrences with regex word-boundary semantics
+
+        Returns (priority, start, end, key) tuples for every candidate match.
+        """
+        lowered = text.lower()
+        length = len(lowered)
+        candidates = []
+        state = 0
+
+        for pos, ch in enumerate(lowered):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+
+            for key in self.output[state]:
+                start = pos + 1 - len(key)
+                end = pos + 1
+                before = start > 0 and _is_word(lowered[start - 1])
+                after = end < length and _is_word(lowered[end])
+                if before != _is_word(key[0]) and after != _is_word(key[-1]):
+                    candidates.append((self.priority[key], start, end, key))
+
+        return candidates
+
+    def annotate(self, text):
+        """Append the mapped schema term after every matched term"""
+        lowered = text.lower()
+        if not self.exact or len(lowered) != len(text):
+            # Case folding changed the length or a key is a regex, keep regex semantics
+            return apply_mappings_sequentially(text, self.mappings)
+
+        # Earlier mappings claim their spans first, as in the sequential loop
+        occupied = bytearray(len(text))
+        accepted = []
+        for priority, start, end, key in sorted(self.find(text)):
+            if occupied.find(1, start, end) == -1:
+                occupied[start:end] = b"\x01" * (end - start)
+                accepted.append((start, end, key))
+
+        if not accepted:
+            return text
+
+        parts = []
+        cursor = 0
+        for start, end, key in sorted(accepted):
+            parts.append(text[cursor:start])
+            parts.append(self.replacements[key])
+            cursor = end
+        parts.append(text[cursor:])
+        return "".join(parts)
+
+
+if __name__ == "__main__":
+    # Benchmark against the sequential regex loop
+    from schema_parser import COMMON_TERM_MAPPINGS, get_term_mapping_pairs
+    from schema_snapshot import load_pcdc_schema
+
+    node_properties, term_mappings = load_pcdc_schema("pcdc-schema-prod-20250114.json")
+    mappings = get_term_mapping_pairs(term_mappings)
+
+    start = time.perf_counter()
+    matcher = TermMatcher(mappings)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"Built matcher for {len(mappings)} terms in {build_ms:.2f} ms ({len(matcher.goto)} states)")
+
+    queries = [
+        "Query subjects who are multiracial (Multiracial) and between 0-18 years of age",
+        "What proportion of Male and female patients, white or Black, Hispanic or Latino, are 10 years old?",
+        "The INRG executive committee is working on a presentation and wants to include the number of patients represented by the INRG consortium who are included in the data portal. What number do you give the executive committee?",
+        "How among patients on study AHOD0031 with Ann Arbor Stage II disease experienced rapid early response?",
+    ]
+
+    fallback_matcher = TermMatcher(list(COMMON_TERM_MAPPINGS.items()) * 2)
+    for query in queries:
+        assert matcher.annotate(query) == apply_mappings_sequentially(query, mappings), query
+        assert fallback_matcher.annotate(query) == apply_mappings_sequentially(query, fallback_matcher.mappings), query
+    print("Output identical to the sequential loop")
+
+    rounds = 2000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            apply_mappings_sequentially(query, mappings)
+    loop_us = (time.perf_counter() - start) / (rounds * len(queries)) * 1_000_000
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            matcher.annotate(query)
+    matcher_us = (time.perf_counter() - start) / (rounds * len(queries)) * 1_000_000
+
+    print(f"Sequential regex loop: {loop_us:.1f} us/query")
+    print(f"Aho-Corasick matcher:  {matcher_us:.1f} us/query ({loop_us / matcher_us:.1f}x faster)")
+    print(matcher.annotate(queries[1]))
@@ -4,6 +4,7 @@ import time
 
 # API endpoint
 API_URL = "http://localhost:8000/convert"
+BATCH_API_URL = "http://localhost:8000/convert/batch"
 
 # Test queries
 test_queries = [
@@ -49,6 +50,32 @@ def test_query(query):
         print("-" * 50)
         return False
 
+def test_batch(queries):
+    """Test the batch endpoint, reading NDJSON results as they complete"""
+    try:
+        start = time.time()
+        response = requests.post(BATCH_API_URL, json={"texts": queries}, stream=True)
+        if response.status_code != 200:
+            print(f"Batch failed: {response.text}")
+            return 0
+        
+        success_count = 0
+        for line in response.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            status = "error: " + item["error"] if item["error"] else "ok"
+            if item["duplicate_of"] is not None:
+                status += f" (duplicate of {item['duplicate_of']})"
+            print(f"[{item['index']}] {item['text'][:60]} -> {status}")
+            if not item["error"]:
+                success_count += 1
+        print(f"Batch of {len(queries)} finished in {time.time() - start:.1f}s")
+        return success_count
+    except Exception as e:
+        print(f"Batch exception: {str(e)}")
+        return 0
+
 def test_session():
     """Test session functionality"""
     try:
@@ -103,6 +130,11 @@ if __name__ == "__main__":
     
     print(f"Query tests completed: {success_count}/{len(test_queries)} successful")
     
+    # Test all queries again in one batch request
+    print("\nStarting batch test...")
+    batch_success = test_batch(test_queries)
+    print(f"Batch test completed: {batch_success}/{len(test_queries)} successful")
+    
     # Test session functionality
     print("\nStarting session test...")
     if test_session():